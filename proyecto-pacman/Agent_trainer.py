@@ -1,14 +1,39 @@
-from Rmatrix_populator import load_base, load_walls
+import os
+from Map_resources import MAP_PATH, load_map
+from Maze_topology import get_topology
 from GhostAI import GhostAI
+from Matrix_storage import DenseMatrix, LazyMatrix, add_canonical_row, create_binary_matrix, is_binary_matrix_file, iter_matrix_file, load_binary_matrix
+from Sparse_storage import SparseMatrix, is_sparse_matrix_file, load_sparse_matrix
+from Parallel_trainer import check_r_matrix_source, train_targets
+from Checkpoint_store import CheckpointStore, DEFAULT_CHECKPOINT_PATH
+from Reward_provider import RewardProvider
+from Reward_shards import ShardedMatrix, is_shard_directory
 
 #Used to monitor performance
 import time 
 from Performance_util import performance_decorator, get_timestamp
 
-R_MATRIX_PATH = "output-files/rmatrix_v2.txt"
-Q_MATRIX_PATH = "output-files/qmatrix.txt"
+MAP_FILE = MAP_PATH #Map to train on. Dimension, walls and base r-matrix are all read from it
+R_MATRIX_PATH = "output-files/rmatrix_v2.rqm" #Binary, sparse or shard store (directory) r-matrix. Convert older text matrixes with 'python Matrix_storage.py rmatrix_v2.txt rmatrix_v2.rqm'
+LAZY_REWARDS = True #Compute reward tables on demand (no pre-built r-matrix needed) instead of reading R_MATRIX_PATH
+REWARD_SETTINGS = {"value": 400, "decay": 50, "stay_prize": 1000, "time_multiplier": 0.3} #Same settings rmatrix_v2 is built with
+Q_MATRIX_PATH = "output-files/qmatrix.rqm"
 LOAD_Q_MATRIX = False
+Q_MATRIX_ON_DISK = False #Keep the q-matrix on a memory-mapped file (Q_MATRIX_PATH, overwritten unless LOAD_Q_MATRIX) instead of memory, for maps whose q-matrix does not fit
+RESUME_CHECKPOINT = False #Resume from the latest checkpoint on CHECKPOINT_PATH (if any, and saved with the same settings), skipping targets already trained. Same as '--resume'. Otherwise, any previous checkpoint is removed and training starts over
+CHECKPOINT_PATH = DEFAULT_CHECKPOINT_PATH
+CHECKPOINT_FREQ = 25 #Targets trained between checkpoints
 DEFAULT_ERROR_RECORD_PATH = "output-files/ai-error-records/"
+TRAIN_WORKERS = 1 #Processes used to train targets in parallel (requires a binary r-matrix or lazy rewards)
+TRAIN_SEED = None #Set to an integer for reproducible training. Each target gets its own random stream
+TRAIN_MODE = "episodes" #'episodes' trains every target over sampled episodes, 'value_iteration' solves every table directly (a few array sweeps per target)
+SOLVER_ARGS = (0.15, 0.5, 1000) #Value iteration gamma, tolerance and max sweeps
+PLATEAU_WINDOW = None #Opt-in: stop training a target once its error changed less than PLATEAU_TOLERANCE (relative) over this many episodes. None always runs every episode
+PLATEAU_TOLERANCE = 0.005
+TARGET_TIME_BUDGET = None #Seconds of training per target (None for no limit)
+EPSILON_DECAY_EPISODES = None #Episodes over which epsilon decays to its floor (None decays over every episode). Plateau stops only count episodes played after it
+# NOTE - Early stopping trades fit for time: with PLATEAU_WINDOW = 500 and EPSILON_DECAY_EPISODES = 2000, targets stop as soon as the check can fire (2500 episodes) with a clearly higher error. Before enabling it, make sure the tolerance is not met the first time it is checked, and that Game_evaluator capture rates match those of a full run
+METRICS_PATH = "output-files/metrics/train_metrics.jsonl" #Training metrics (steps, episodes, timings, memory), one JSON snapshot per line. Set to None to disable
 
 #Initialize a qtable from a given reward table 
 def qtable_initializer(r_table:dict[tuple[int,int], list[int]]) -> dict[tuple[int,int], list[int]]:
@@ -20,6 +45,11 @@ def qtable_initializer(r_table:dict[tuple[int,int], list[int]]) -> dict[tuple[in
 @performance_decorator
 #Initialize a combination of qtables from a given combination of reward tables
 def qmatrix_initializer(r_matrix:dict[int,dict[tuple[int,int],list[int]]]) -> dict[int,dict[tuple[int,int],list[int]]]:
+    if (isinstance(r_matrix, (DenseMatrix, RewardProvider, ShardedMatrix))): #Dense matrixes share layout, so there is no need to walk every state
+        return DenseMatrix.zeros_like(r_matrix)
+    if (isinstance(r_matrix, SparseMatrix)): #Sparse q-matrixes only store legal actions: those of the r-matrix that stay within the map (out-of-bounds moves keep the reward of the last square on r-matrixes, but ghosts never take them)
+        border_masks = get_topology(r_matrix.dimension).pair_masks(r_matrix.ghost_pairs)
+        return SparseMatrix.zeros_like(r_matrix, masks=r_matrix.masks & border_masks[None])
     q_matrix:dict[int,dict[tuple[int,int],list[int]]] = dict()
     for player_pos in r_matrix.keys():
         q_table = qtable_initializer(r_matrix[player_pos])
@@ -27,108 +57,135 @@ def qmatrix_initializer(r_matrix:dict[int,dict[tuple[int,int],list[int]]]) -> di
     return q_matrix
 
 @performance_decorator
-def load_full_matrix(filename:str, dimension:tuple[int,int], verbose:bool = False) -> dict[int,dict[tuple[int,int],list[int]]]:
+#Load a full matrix from file (or shard store directory). Binary matrix files and shards are memory-mapped (use writable=True for q-matrixes that will be trained further), text files are streamed line by line into canonical dictionaries (one row per unordered ghost pair)
+#If lazy, text files are not parsed up front. Player tables are loaded on first access instead, keeping at most max_tables in memory (read-only use)
+def load_full_matrix(filename:str, dimension:tuple[int,int], verbose:bool = False, writable:bool = False, lazy:bool = False, max_tables:int = 4) -> dict[int,dict[tuple[int,int],list[int]]]:
+    if (is_binary_matrix_file(filename)) or (is_sparse_matrix_file(filename)) or (is_shard_directory(filename)):
+        if (is_shard_directory(filename)):
+            if (writable):
+                raise ValueError(f"ERROR. Shard stores are read-only, {filename} cannot be trained further")
+            matrix = ShardedMatrix(filename)
+        elif (is_sparse_matrix_file(filename)):
+            matrix = load_sparse_matrix(filename, True, "c" if writable else "r")
+        else:
+            matrix = load_binary_matrix(filename, True, "c" if writable else "r")
+        if (matrix.dimension != tuple(dimension)):
+            raise ValueError(f"ERROR. Matrix on file {filename} was built for dimension {matrix.dimension[0]}x{matrix.dimension[1]}, not {dimension[0]}x{dimension[1]}")
+        return matrix
+    if (lazy):
+        return LazyMatrix(filename, dimension, max_tables)
+
     matrix:dict[int,dict[tuple[int,int],list[int]]] = dict()
     prev_player_pos:int = -1
-    
-    with open(filename, 'r') as file:
-        all_lines:list[str] = file.readlines()
-        print_acc:list[int] = [0,1]
-        timestamp:int = time.time()
-    
-        for index, line in enumerate(all_lines):
-            line = line.strip("\n").strip()
-            if (line != ""):
-                line_split = line.split("=")
-                if (len(line_split) != 2):
-                    raise ValueError(f"ERROR. Badly formatted line on file {filename}. Error found at line {index}. Should have key=value pairs.")
-                
-                state = line_split[0].strip().split("|")
-                if (len(state) != 3):
-                    raise ValueError(f"ERROR. Badly formatted line on file {filename}. Error found at line {index}. State should have ONLY 3 values")
-                for value in state:
-                    if (not value.isdigit()):
-                        raise ValueError(f"ERROR. Badly formatted line on file {filename}. Error found at line {index}. State should be an INTEGER tuple separated with pipes like 1|2|3")
-                    elif( (int(value) < 0) or (int(value) >= dimension[0]*dimension[1]) ):
-                        raise ValueError(f"ERROR. Badly formatted line on file {filename}. Error found at line {index}. Given dimension {dimension[0]}x{dimension[1]}, position must be between 0 and {dimension[0]*dimension[1] - 1} inclusive")
-                state = [int(value) for value in state]
-                    
-                reward = line_split[1].strip().split("|")
-                if (len(reward) != 16):
-                    raise ValueError(f"ERROR. Badly formatted line on file {filename}. Error found at line {index}. There should be rewards registered for 16 different actions")
-                for value in reward:
-                    if ( (not value.isdigit()) and not( (value[0] in "+-") and (value[1:].isdigit()) ) ):
-                        raise ValueError(f"ERROR. Badly formatted line on file {filename}. Error found at line {index}. Actions' rewards should be an INTEGER tuple separated with pipes like 1|2|3")
-                reward = [int(value) for value in reward]
-
-                if (prev_player_pos == -1): #Previous player position not initialized
-                    prev_player_pos = state[2]
-                    table:dict[tuple[int,int], list[int]] = dict()
-                
-                if (prev_player_pos == state[2]): #Previous player position same as current
-                    table[(state[0], state[1])] = reward #Save state*action -> reward association for current state
-                else: #Player position changed
-                    matrix[prev_player_pos] = table #Commit finished table of all combinations within the previous player position into full dictionary
-                    table = dict() #Reset dictionary for player position
-                    table[(state[0], state[1])] = reward
-                prev_player_pos = state[2] #Update previous player position for next line
-            if (verbose):
-                print_acc[0] += 1
-                if (print_acc[0] >= len(all_lines)*0.1):
-                    print(f"Matrix loading {print_acc[1]*5}% done (in {round(time.time() - timestamp, 4)}s)")
-                    print_acc[0] = 0
-                    print_acc[1] += 1
+    table:dict[tuple[int,int], list[int]] = dict()
+    timestamp:float = time.time()
+
+    for index, state, reward in iter_matrix_file(filename, dimension):
+        if (prev_player_pos == -1): #Previous player position not initialized
+            prev_player_pos = state[2]
+        
+        if (prev_player_pos != state[2]): #Player position changed
+            matrix[prev_player_pos] = table #Commit finished table of all combinations within the previous player position into full dictionary
+            table = dict() #Reset dictionary for player position
+        add_canonical_row(table, (state[0], state[1]), reward) #Save state*action -> reward association for current state (swapped ghost pairs are folded into canonical ones)
+        prev_player_pos = state[2] #Update previous player position for next line
+        if (verbose) and (index % 100000 == 0) and (index > 0):
+            print(f"Matrix loading: {index} lines done (in {round(time.time() - timestamp, 4)}s)")
+    if (prev_player_pos != -1):
         matrix[prev_player_pos] = table #Commit the last table into the full dictionary
     if (verbose):
         print(f"Loading completed in {round(time.time() - timestamp, 4)}s")
     return matrix
 
-if __name__ == "__main__":
-    #Get full r-matrix from disk and initialize q-matrix
-    rmatrix = load_full_matrix(R_MATRIX_PATH, (18,9))
-    if (not LOAD_Q_MATRIX):
-        qmatrix = qmatrix_initializer(rmatrix)
+#Save error list of a trained target as a single-line csv file
+def save_error_record(position:int, error_list:list[float], directory:str = DEFAULT_ERROR_RECORD_PATH) -> str:
+    error_record_filename = directory + "record-" + str(position) + "_" + str(round(error_list[-1], 4)) + "_" + get_timestamp() + ".csv"
+    with open(error_record_filename, 'w') as file:
+        for index,value in enumerate(error_list):
+            file.write(str(value))
+            if index < (len(error_list) - 1):
+                file.write(",")
+    print(f"Error records saved sucessfully at {error_record_filename}")
+    return error_record_filename
+
+def main(argv:list[str] = None) -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description="Train the ghosts q-matrix against every player position (other settings are the constants on top of Agent_trainer.py)")
+    parser.add_argument("--map", default=MAP_FILE, help="Map file to train on")
+    parser.add_argument("--rewards", default=None, help="R-matrix file or shard store to train against (default rewards computed on demand, or R_MATRIX_PATH if LAZY_REWARDS is off)")
+    parser.add_argument("--workers", type=int, default=TRAIN_WORKERS)
+    parser.add_argument("--resume", action="store_true", default=RESUME_CHECKPOINT, help=f"Resume from the checkpoint on {CHECKPOINT_PATH} (checkpoints are removed once training finishes)")
+    args = parser.parse_args(argv)
+    dimension, base_map, walls = load_map(args.map)
+
+    #Get r-matrix (computed on demand, or full from disk) and initialize q-matrix
+    if (LAZY_REWARDS) and (args.rewards is None):
+        r_matrix_source = dict(REWARD_SETTINGS, dimension=dimension, base_matrix=base_map, wall_index=walls)
+        rmatrix = RewardProvider(**r_matrix_source)
+    else:
+        r_matrix_source = R_MATRIX_PATH if (args.rewards is None) else args.rewards
+        check_r_matrix_source(r_matrix_source) #Text r-matrixes would only fail once the q-matrix and checkpoints are set up
+        rmatrix = load_full_matrix(r_matrix_source, dimension)
+    if (LOAD_Q_MATRIX) and (Q_MATRIX_ON_DISK):
+        qmatrix = load_binary_matrix(Q_MATRIX_PATH, True, "r+") #Trained in place
+    elif (LOAD_Q_MATRIX):
+        qmatrix = load_full_matrix(Q_MATRIX_PATH, dimension, writable=True)
+    elif (Q_MATRIX_ON_DISK):
+        qmatrix = create_binary_matrix(Q_MATRIX_PATH, dimension, rmatrix.player_positions, rmatrix.ghost_pairs, rmatrix.is_conmutative, rmatrix.dtype)
     else:
-        qmatrix = load_full_matrix(Q_MATRIX_PATH, (18,9))
+        qmatrix = qmatrix_initializer(rmatrix)
     print(f"Total states Q|R -> {len(qmatrix.keys())}|{len(rmatrix.keys())}")
 
+    episode_count = 10000
+    max_steps = 3000
+    train_args = (0.7, 0.05, 0.15, episode_count, max_steps, round(episode_count/10), None, "incremental", 1, PLATEAU_WINDOW, PLATEAU_TOLERANCE, TARGET_TIME_BUDGET, EPSILON_DECAY_EPISODES) #Incremental error keeps the same records without walking the whole table every episode
+    if (TRAIN_MODE == "value_iteration"):
+        train_args = SOLVER_ARGS
+    #Checkpoints are only resumed by runs with the same settings
+    rewards = REWARD_SETTINGS if (isinstance(r_matrix_source, dict)) else os.path.abspath(r_matrix_source)
+    train_config = {"map": os.path.abspath(args.map), "rewards": rewards, "train_mode": TRAIN_MODE, "train_args": train_args, "seed": TRAIN_SEED, "loaded_q_matrix": Q_MATRIX_PATH if (LOAD_Q_MATRIX) else None}
+    checkpoints = CheckpointStore(CHECKPOINT_PATH, train_config)
+    if (args.resume) and (checkpoints.exists()):
+        checkpoints.restore(qmatrix)
+    elif (checkpoints.exists()):
+        print(f"Previous checkpoint on {CHECKPOINT_PATH} removed ({checkpoints.clear()} tables). Use --resume to continue it instead")
+
     #Initialize states and ai_brain
     state_so = (79,82,154)
-    ai_brain = GhostAI(state_so, load_walls(), (18,9), qmatrix, 1)
+    ai_brain = GhostAI(state_so, walls, dimension, qmatrix, 1)
 
     #Load all target positions
     target_positions:list[int] = []
-    walls = load_walls()
-    for i in range(18*9):
-        if i not in walls:
+    completed = set(checkpoints.completed_positions)
+    for i in range(dimension[0]*dimension[1]):
+        if (i not in walls) and (i not in completed):
             target_positions.append(i)
 
-    acc = 25
-    for position in target_positions:
-        episode_count = 10000
-        max_steps = 3000
-        print(f"Training begin ({position}). {episode_count} Episodes of maximum {max_steps} steps each")
-        ai_brain.update_player_pos(position)
-        error_list = ai_brain.simulate_train(rmatrix, True, 0.7, 0.05, 0.15, episode_count, max_steps, round(episode_count/10))
-        print(f"Training ended ({position}). Error: {error_list[-1]}")
-
-        #SAVE ERROR RECORDS
-        error_record_filename = DEFAULT_ERROR_RECORD_PATH + "record-" + str(position) + "_" + str(round(error_list[-1], 4)) + "_" + get_timestamp() + ".csv"
-        with open(error_record_filename, 'w') as file:
-            for index,value in enumerate(error_list):
-                file.write(str(value))
-                if index < (len(error_list) - 1):
-                    file.write(",")
-        print(f"Error records saved sucessfully at {error_record_filename}")
+    #Targets are independent, so they are trained on TRAIN_WORKERS processes and merged back into qmatrix (which ai_brain shares) as they finish
+    #Checkpoints only write the tables trained since the previous one
+    acc = CHECKPOINT_FREQ
+    episodes_saved = 0
+    for position, error_list in train_targets(r_matrix_source, qmatrix, walls, target_positions, train_args, args.workers, TRAIN_SEED, METRICS_PATH, TRAIN_MODE):
+        save_error_record(position, error_list)
+        if (TRAIN_MODE == "episodes"):
+            episodes_saved += episode_count - len(error_list)
+        checkpoints.mark_dirty(position)
 
         acc -= 1
         if (acc <= 0):
-            ai_brain.save_matrix()
-            acc = 25
+            checkpoints.commit(qmatrix)
+            acc = CHECKPOINT_FREQ
+    checkpoints.commit(qmatrix)
+    if (TRAIN_MODE == "episodes") and ((PLATEAU_WINDOW is not None) or (TARGET_TIME_BUDGET is not None)):
+        print(f"Early stopping saved {episodes_saved} of {episode_count*len(target_positions)} episodes")
     
     #* SAVE Q-MATRIX
     ai_brain.save_matrix()
+    checkpoints.clear() #Training finished, so a later run must not resume from it
 
     #* ONLY SAVE UPDATED TABLE
     # ai_brain.save_table()
-    # print("Table saved sucessfully")
\ No newline at end of file
+    # print("Table saved sucessfully")
+
+if __name__ == "__main__":
+    main()
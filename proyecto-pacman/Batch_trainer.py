@@ -0,0 +1,126 @@
+import numpy as np
+from Maze_topology import MazeTopology
+from Matrix_storage import DenseMatrix
+
+# NOTE - Batched version of GhostAI.simulate_train for a fixed player position. batch_size independent episodes advance in lockstep, so every step of every episode is a handful of array operations.
+# Episodes follow the same rules (e-greedy over legal actions, same epsilon schedule, same update rule). When several episodes update the same state-action on the same step, the last update wins
+# With the player fixed, ghosts move on a deterministic MDP with known rewards, so q-tables can also be solved directly by value iteration (solve_q_table) instead of sampled
+
+#Next ghost pair index for every (ghost pair, joint action) of the matrix layout, or -1 if the action is illegal. Ghost pairs are kept sorted as (lower, higher), like GhostAI does
+def build_transitions(topology:MazeTopology, q_matrix:DenseMatrix) -> np.ndarray:
+    pairs = np.asarray(q_matrix.ghost_pairs, dtype=np.int64).reshape(-1, 2)
+    lower = pairs.min(axis=1)
+    higher = pairs.max(axis=1)
+    new_lower = np.repeat(topology.neighbors[lower], 4, axis=1) #Action index is action_lower*4 + action_higher
+    new_higher = np.tile(topology.neighbors[higher], (1, 4))
+    legal = (new_lower != -1) & (new_higher != -1) & (new_lower != new_higher) #Ghosts cannot land on the same square
+    transitions = q_matrix.pair_indexes(np.minimum(new_lower, new_higher), np.maximum(new_lower, new_higher))
+    return np.where(legal, transitions, -1).astype(np.int32)
+
+#Ghost pairs (lower, higher) with no ghost over the player, where episodes may start
+def valid_start_states(q_matrix:DenseMatrix, player_pos:int) -> np.ndarray:
+    pairs = np.asarray(q_matrix.ghost_pairs, dtype=np.int64).reshape(-1, 2)
+    valid = (pairs[:,0] < pairs[:,1]) & (pairs[:,0] != player_pos) & (pairs[:,1] != player_pos)
+    return np.flatnonzero(valid)
+
+#Epsilon used on each episode, following GhostAI.simulate_train schedule (updated after every finished episode)
+def epsilon_schedule(episode:np.ndarray, start_epsilon:float, epsilon_delta:float, episode_count:int) -> np.ndarray:
+    previous = episode.astype(np.float64) #Epsilon after finishing episode (index - 1)
+    scheduled = (previous - episode_count)**2 * (epsilon_delta/(episode_count**2)) + (start_epsilon - epsilon_delta)
+    return np.where(episode == 0, start_epsilon, scheduled)
+
+#Error of every given row (same formula as GhostAI.compute_error), vectorized
+def row_errors(q_rows:np.ndarray, r_rows:np.ndarray) -> np.ndarray:
+    q_rows = q_rows.astype(np.float64)
+    r_rows = r_rows.astype(np.float64)
+    max_q = np.maximum(q_rows.max(axis=1, keepdims=True), 1)
+    max_r = np.maximum(r_rows.max(axis=1, keepdims=True), 1)
+    counted = ~( (r_rows == -1) & (q_rows == 0) ) #Only compute error for legal moves or 'legalized' illegal ones
+    return (np.abs(r_rows/max_r - q_rows/max_q) * counted).sum(axis=1)
+
+#Train q_table (updated in place) over episode_count episodes, batch_size at a time. terminal marks ghost pairs over the player. Returns error list (one value per episode, measured when it finished)
+def train_batch(q_table:np.ndarray, r_table:np.ndarray, transitions:np.ndarray, terminal:np.ndarray, start_states:np.ndarray, start_epsilon:float, epsilon_delta:float, learn_rate:float, gamma:float, episode_count:int, max_steps:int, batch_size:int, rng:np.random.Generator) -> list[float]:
+    if (len(start_states) == 0):
+        raise ValueError("There are no valid ghost positions to start episodes from")
+    r_max = r_table.max(axis=1).astype(np.float64)
+    legal_actions = (transitions != -1)
+    if (max_steps is None):
+        max_steps = np.iinfo(np.int64).max
+
+    slot_count = min(batch_size, episode_count)
+    state = rng.choice(start_states, slot_count)
+    episode = np.arange(slot_count)
+    steps = np.zeros(slot_count, dtype=np.int64)
+    active = np.ones(slot_count, dtype=bool)
+    started = slot_count
+    error_list:list[float] = [0.0]*episode_count
+    errors = row_errors(q_table, r_table) #Per-row error, refreshed for the rows updated on each step
+
+    while (active.any()):
+        slots = np.flatnonzero(active)
+        current = state[slots]
+        legal = legal_actions[current]
+
+        #e-greedy. Optimal candidates are legal actions whose value is at least the max of the row (or every legal action, if none is)
+        q_rows = q_table[current]
+        candidates = legal & (q_rows >= q_rows.max(axis=1, keepdims=True))
+        candidates = np.where(candidates.any(axis=1, keepdims=True), candidates, legal)
+        explore = rng.random(len(slots)) < epsilon_schedule(episode[slots], start_epsilon, epsilon_delta, episode_count)
+        candidates = np.where(explore[:, None], legal, candidates)
+        stuck = ~candidates.any(axis=1)
+        action = np.argmax(rng.random(candidates.shape) * candidates, axis=1) #Uniform pick among candidates
+
+        #Temporal difference update
+        moving = ~stuck
+        current = current[moving]
+        action = action[moving]
+        following = transitions[current, action]
+        old_value = q_table[current, action].astype(np.float64)
+        new_value = old_value + learn_rate * (r_table[current, action] + gamma*r_max[following] - old_value)
+        q_table[current, action] = np.round(new_value)
+        updated = np.unique(current)
+        errors[updated] = row_errors(q_table[updated], r_table[updated])
+        state[slots[moving]] = following
+        steps[slots] += 1
+
+        #Finished episodes are measured and replaced with new ones, while there are episodes left
+        done = stuck.copy()
+        done[moving] = terminal[following]
+        done |= (steps[slots] >= max_steps)
+        finished = slots[done]
+        if (len(finished) > 0):
+            error = float(errors.sum())
+            for index in episode[finished]:
+                error_list[index] = round(error, 6)
+            restart_count = min(len(finished), episode_count - started)
+            restart = finished[:restart_count]
+            episode[restart] = np.arange(started, started + restart_count)
+            state[restart] = rng.choice(start_states, restart_count)
+            steps[restart] = 0
+            started += restart_count
+            active[finished[restart_count:]] = False
+    return error_list
+
+#Solve q-values of a player table by value iteration: q(s,a) = r(s,a) + gamma*v(s') over legal actions, where v(s') is the best q-value of s' (illegal actions count as 0, same as pick_action)
+#Episodes end on terminal states, so their value is the best reward of their row (same bootstrap simulate_train uses) and their rows stay 0. Sweeps go on until values change by at most tolerance
+#Returns (q-table as floats, max value change of every sweep)
+def solve_q_table(r_table:np.ndarray, transitions:np.ndarray, terminal:np.ndarray, gamma:float, tolerance:float = 0.5, max_iterations:int = 1000) -> tuple[np.ndarray, list[float]]:
+    if (gamma < 0) or (gamma >= 1):
+        raise ValueError("Gamma must be in [0, 1) for value iteration to converge")
+    legal = (transitions != -1)
+    following = np.where(legal, transitions, 0)
+    rewards = np.where(legal, r_table, 0).astype(np.float64)
+    terminal_values = r_table.max(axis=1).astype(np.float64)
+    values = np.where(terminal, terminal_values, 0.0)
+    q_table = np.zeros(r_table.shape, dtype=np.float64)
+    delta_list:list[float] = []
+    for iteration in range(max_iterations):
+        q_table = np.where(legal, rewards + gamma*values[following], 0.0)
+        new_values = np.where(terminal, terminal_values, np.maximum(q_table.max(axis=1), 0))
+        delta = float(np.abs(new_values - values).max())
+        values = new_values
+        delta_list.append(delta)
+        if (delta <= tolerance):
+            break
+    q_table[terminal] = 0
+    return q_table, delta_list
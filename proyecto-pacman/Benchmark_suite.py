@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import multiprocessing
+import numpy as np
+
+#Used to monitor performance
+import time
+from Performance_util import get_timestamp
+
+DEFAULT_OUTPUT_PATH = "output-files/benchmarks/"
+BENCHMARK_SEED = 1234
+DIMENSION = (18,9)
+PLAYER_POS = 40 #Fixed target for single-position benchmarks
+SIZES:dict[str,dict] = {
+    "small": {"player_count": 1, "populate_pairs": 300, "episodes": 200, "max_steps": 300, "resets": 10000},
+    "full": {"player_count": None, "populate_pairs": 2000, "episodes": 2000, "max_steps": 3000, "resets": 100000}, #None means every open square
+}
+
+SCALING_MAPS:list[tuple[int,int]] = [(12,9), None, (24,15), (28,31)] #Generated corridor mazes of each size (None is the package's map). 28x31 matches the arcade maze
+SCALING_PLAYERS = 4 #Player positions (shards) built per map. Full build time is projected from them
+
+# NOTE - Every benchmark returns (processed items, unit). The runner seeds random generators, times the call and records peak traced memory, so runs are comparable over time
+
+#Shared inputs, built once (outside of timings) and reused by benchmarks
+class BenchmarkContext:
+    def __init__(self, size:str, work_dir:str):
+        from Rmatrix_populator import load_base, load_walls
+        from Maze_topology import get_topology
+        from Matrix_storage import build_ghost_pairs
+
+        self.size = size
+        self.settings = SIZES[size]
+        self.work_dir = work_dir
+        self.base_matrix = load_base()
+        self.wall_index = load_walls()
+        self.open_cells = get_topology(DIMENSION, self.wall_index).open_cells
+        self.ghost_pairs = build_ghost_pairs(self.open_cells, True)
+        player_count = self.settings["player_count"]
+        self.player_positions = [PLAYER_POS] if (player_count is not None) else self.open_cells
+        self._r_matrix = None
+
+    #Conmutative r-matrix (time multiplier 0.3) for the benchmark player positions, as a dense matrix
+    @property
+    def r_matrix(self):
+        if (self._r_matrix is None):
+            from Heatmap_engine import build_player_heatmaps, build_player_rewards
+            from Parallel_builder import adjacent_positions
+            from Matrix_storage import DenseMatrix
+            data = np.zeros((len(self.player_positions), len(self.ghost_pairs), 16), dtype=np.int32)
+            for index, player_pos in enumerate(self.player_positions):
+                heatmaps = build_player_heatmaps(player_pos, self.ghost_pairs, DIMENSION, self.base_matrix)
+                adjacent = [build_player_heatmaps(position, self.ghost_pairs, DIMENSION, self.base_matrix) for position in adjacent_positions(player_pos, DIMENSION, self.open_cells)]
+                data[index] = build_player_rewards(heatmaps, self.ghost_pairs, DIMENSION, 1000, 0.3, adjacent)
+            self._r_matrix = DenseMatrix(data, self.player_positions, self.ghost_pairs, DIMENSION, True)
+        return self._r_matrix
+
+    @property
+    def text_path(self) -> str:
+        return os.path.join(self.work_dir, "rmatrix.txt")
+    @property
+    def binary_path(self) -> str:
+        return os.path.join(self.work_dir, "rmatrix.rqm")
+
+def bench_populate_matrix(context:BenchmarkContext) -> tuple[int, str]:
+    from Rmatrix_populator import populate_matrix
+    pairs = context.ghost_pairs[:context.settings["populate_pairs"]]
+    for ghost_pos in pairs:
+        populate_matrix(context.base_matrix.copy(), DIMENSION, (ghost_pos[0], ghost_pos[1], PLAYER_POS))
+    return len(pairs), "heatmaps"
+
+def bench_build_heatmaps(context:BenchmarkContext) -> tuple[int, str]:
+    from Heatmap_engine import build_player_heatmaps
+    for player_pos in context.player_positions:
+        build_player_heatmaps(player_pos, context.ghost_pairs, DIMENSION, context.base_matrix)
+    return len(context.player_positions)*len(context.ghost_pairs), "heatmaps"
+
+def bench_to_reward_matrix(context:BenchmarkContext) -> tuple[int, str]:
+    from Rmatrix_populator import build_ghost_shifted, to_reward_matrix
+    heatmaps = build_ghost_shifted(PLAYER_POS, DIMENSION, base_matrix=context.base_matrix, wall_index=context.wall_index, is_conmutative=True)
+    to_reward_matrix(heatmaps, DIMENSION, 1000, -1.0, None)
+    return len(heatmaps), "rows"
+
+def bench_save_full_matrix(context:BenchmarkContext) -> tuple[int, str]:
+    from Rmatrix_populator import save_full_matrix
+    save_full_matrix(context.r_matrix, context.text_path)
+    return len(context.player_positions)*len(context.ghost_pairs), "lines"
+
+def bench_load_full_matrix(context:BenchmarkContext) -> tuple[int, str]:
+    from Agent_trainer import load_full_matrix
+    if (not os.path.exists(context.text_path)):
+        bench_save_full_matrix(context)
+    matrix = load_full_matrix(context.text_path, DIMENSION)
+    return sum(len(table) for table in matrix.values()), "lines"
+
+def bench_save_binary_matrix(context:BenchmarkContext) -> tuple[int, str]:
+    from Matrix_storage import save_binary_matrix
+    save_binary_matrix(context.r_matrix, context.binary_path)
+    return len(context.player_positions)*len(context.ghost_pairs), "rows"
+
+def bench_load_binary_matrix(context:BenchmarkContext) -> tuple[int, str]:
+    from Matrix_storage import load_binary_matrix
+    if (not os.path.exists(context.binary_path)):
+        bench_save_binary_matrix(context)
+    matrix = load_binary_matrix(context.binary_path)
+    return int(matrix.data.shape[0]*matrix.data.shape[1]), "rows"
+
+#Run simulate_train on the benchmark target. Steps are counted through update_q_value, which is called exactly once per step
+def bench_simulate_train(context:BenchmarkContext) -> tuple[int, str]:
+    from GhostAI import GhostAI
+    from Matrix_storage import DenseMatrix
+    step_counter = [0]
+    class CountingGhostAI(GhostAI):
+        def update_q_value(self, action_index:int, new_value:int) -> None:
+            step_counter[0] += 1
+            super().update_q_value(action_index, new_value)
+
+    q_matrix = DenseMatrix.zeros_like(context.r_matrix)
+    ai_brain = CountingGhostAI((79,82,PLAYER_POS), context.wall_index, DIMENSION, q_matrix, 1)
+    random.seed(BENCHMARK_SEED)
+    ai_brain.simulate_train(context.r_matrix, True, 0.7, 0.05, 0.15, context.settings["episodes"], context.settings["max_steps"], error_mode="incremental")
+    return step_counter[0], "steps"
+
+def bench_simulate_train_batch(context:BenchmarkContext) -> tuple[int, str]:
+    from GhostAI import GhostAI
+    from Matrix_storage import DenseMatrix
+    q_matrix = DenseMatrix.zeros_like(context.r_matrix)
+    ai_brain = GhostAI((79,82,PLAYER_POS), context.wall_index, DIMENSION, q_matrix, 1)
+    error_list = ai_brain.simulate_train_batch(context.r_matrix, True, 0.7, 0.05, 0.15, context.settings["episodes"], context.settings["max_steps"], seed=BENCHMARK_SEED)
+    return len(error_list), "episodes"
+
+def bench_solve_value_iteration(context:BenchmarkContext) -> tuple[int, str]:
+    from GhostAI import GhostAI
+    from Matrix_storage import DenseMatrix
+    q_matrix = DenseMatrix.zeros_like(context.r_matrix)
+    ai_brain = GhostAI((79,82,PLAYER_POS), context.wall_index, DIMENSION, q_matrix, 1)
+    sweeps = 0
+    for player_pos in context.player_positions:
+        ai_brain.update_player_pos(player_pos)
+        sweeps += len(ai_brain.solve_value_iteration(context.r_matrix, 0.15))
+    return sweeps, "sweeps"
+
+#Episode resets (random start states) for the benchmark player positions, one at a time and batched
+def bench_randomize_pos(context:BenchmarkContext) -> tuple[int, str]:
+    from GhostAI import GhostAI
+    from Matrix_storage import DenseMatrix
+    from Maze_topology import get_topology
+    from State_sampler import get_sampler
+    q_matrix = DenseMatrix.zeros_like(context.r_matrix)
+    ai_brain = GhostAI((79,82,PLAYER_POS), context.wall_index, DIMENSION, q_matrix, 1)
+    sampler = get_sampler(get_topology(DIMENSION, context.wall_index))
+    resets = context.settings["resets"]
+    for player_pos in context.player_positions:
+        ai_brain.update_player_pos(player_pos)
+        for index in range(resets):
+            ai_brain.randomize_pos()
+        sampler.sample_batch(player_pos, resets, np.random.default_rng(BENCHMARK_SEED))
+    return 2*resets*len(context.player_positions), "resets"
+
+BENCHMARKS:dict[str,object] = {
+    "populate_matrix": bench_populate_matrix,
+    "build_heatmaps": bench_build_heatmaps,
+    "to_reward_matrix": bench_to_reward_matrix,
+    "save_full_matrix": bench_save_full_matrix,
+    "load_full_matrix": bench_load_full_matrix,
+    "save_binary_matrix": bench_save_binary_matrix,
+    "load_binary_matrix": bench_load_binary_matrix,
+    "simulate_train": bench_simulate_train,
+    "simulate_train_batch": bench_simulate_train_batch,
+    "solve_value_iteration": bench_solve_value_iteration,
+    "randomize_pos": bench_randomize_pos,
+}
+
+#Time a single benchmark, with fixed seeds. Returns its result record
+def run_benchmark(name:str, context:BenchmarkContext) -> dict:
+    random.seed(BENCHMARK_SEED)
+    np.random.seed(BENCHMARK_SEED)
+    tracemalloc.start()
+    timestamp = time.perf_counter()
+    items, unit = BENCHMARKS[name](context)
+    elapsed = time.perf_counter() - timestamp
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"name": name, "seconds": round(elapsed, 6), "items": items, "unit": unit, "throughput": round(items / elapsed, 3) if (elapsed > 0) else None, "peak_memory_mb": round(peak_memory / 2**20, 3)}
+
+#Run the selected benchmarks (all of them by default) and return the full report
+def run_suite(size:str = "small", names:list[str] = None, verbose:bool = True) -> dict:
+    if (size not in SIZES):
+        raise ValueError(f"Size must be one of {list(SIZES.keys())}")
+    if (names is None):
+        names = list(BENCHMARKS.keys())
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    results:list[dict] = []
+    try:
+        context = BenchmarkContext(size, work_dir)
+        context.r_matrix #Build shared inputs outside of timings
+        for name in names:
+            if (name not in BENCHMARKS):
+                raise ValueError(f"Unknown benchmark {name}. Available: {list(BENCHMARKS.keys())}")
+            result = run_benchmark(name, context)
+            results.append(result)
+            if (verbose):
+                print(f"INFO. {name}: {result['seconds']}s, {result['throughput']} {result['unit']}/s, peak {result['peak_memory_mb']}MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "size": size,
+        "seed": BENCHMARK_SEED,
+        "settings": SIZES[size],
+        "timestamp": get_timestamp(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+#Corridor maze of the given size: walls on the border, and open rows and columns every third square (like the arcade maze). Returned as map file text
+def generate_map(dimension:tuple[int,int]) -> str:
+    lines:list[str] = []
+    for row in range(dimension[1]):
+        line = ""
+        for column in range(dimension[0]):
+            is_border = (row in (0, dimension[1] - 1)) or (column in (0, dimension[0] - 1))
+            line += "X" if (is_border) or ((row % 3 != 1) and (column % 3 != 1)) else "O"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+#Build a few shards of the map on map_filename (on this process) and report build time and peak resident memory
+def _scaling_task(map_filename:str, players:int, work_dir:str, queue) -> None:
+    import resource
+    from Map_resources import load_map
+    from Maze_topology import get_topology
+    from Parallel_builder import build_reward_shards
+    from Reward_shards import shard_path
+    dimension, base_map, wall_index = load_map(map_filename)
+    open_cells = get_topology(dimension, wall_index).open_cells
+    pair_count = len(open_cells)*(len(open_cells) - 1)//2
+    positions = open_cells[::max(1, len(open_cells)//players)][:players]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timestamp = time.perf_counter()
+    build_reward_shards(work_dir, dimension, 400, 50, base_map, wall_index, 1000, 0.3, True, 1, False, positions)
+    elapsed = time.perf_counter() - timestamp
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    shard_bytes = os.path.getsize(shard_path(work_dir, positions[0]))
+    queue.put({
+        "dimension": list(dimension),
+        "open_cells": len(open_cells),
+        "ghost_pairs": pair_count,
+        "states": len(open_cells)*pair_count,
+        "shards_built": len(positions),
+        "seconds_per_shard": round(elapsed / len(positions), 4),
+        "projected_build_seconds": round(elapsed / len(positions) * len(open_cells), 1),
+        "shard_mb": round(shard_bytes / 2**20, 3),
+        "projected_store_mb": round(shard_bytes*len(open_cells) / 2**20, 1),
+        "full_heatmaps_mb": round(5*pair_count*dimension[0]*dimension[1]*4 / 2**20, 1), #Heatmaps a whole-table build holds per shard (player plus up to 4 adjacent positions)
+        "rss_before_mb": round(rss_before / 1024, 1),
+        "rss_peak_mb": round(rss_peak / 1024, 1),
+    })
+
+#Measure how sharded r-matrix builds scale with map size. Every map is built on a fresh process, so peak resident memory is its own
+def run_scaling(maps:list[tuple[int,int]] = None, players:int = SCALING_PLAYERS, verbose:bool = True) -> dict:
+    from Map_resources import MAP_PATH
+    if (maps is None):
+        maps = SCALING_MAPS
+    work_dir = tempfile.mkdtemp(prefix="scaling_")
+    results:list[dict] = []
+    try:
+        for index, dimension in enumerate(maps):
+            map_filename = MAP_PATH
+            if (dimension is not None):
+                map_filename = os.path.join(work_dir, f"map_{dimension[0]}x{dimension[1]}.txt")
+                with open(map_filename, 'w') as file:
+                    file.write(generate_map(dimension))
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_scaling_task, args=(map_filename, players, os.path.join(work_dir, f"shards_{index}"), queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            result["map"] = "package" if (dimension is None) else "generated"
+            results.append(result)
+            if (verbose):
+                print(f"INFO. {result['dimension'][0]}x{result['dimension'][1]} ({result['open_cells']} open, {result['states']} states): {result['seconds_per_shard']}s/shard, projected build {result['projected_build_seconds']}s, store {result['projected_store_mb']}MB, peak RSS {result['rss_peak_mb']}MB (whole-table heatmaps would take {result['full_heatmaps_mb']}MB)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "size": "scaling",
+        "players": players,
+        "timestamp": get_timestamp(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+#Print throughput ratio of each benchmark against a previous report (higher is faster)
+def compare_reports(current:dict, previous:dict) -> None:
+    previous_results = {result["name"]: result for result in previous["results"]}
+    for result in current["results"]:
+        old = previous_results.get(result["name"])
+        if (old is None) or (not old["throughput"]) or (not result["throughput"]):
+            print(f"{result['name']}: no previous result")
+            continue
+        ratio = result["throughput"] / old["throughput"]
+        print(f"{result['name']}: {round(ratio, 3)}x throughput ({old['throughput']} -> {result['throughput']} {result['unit']}/s), peak memory {old['peak_memory_mb']} -> {result['peak_memory_mb']}MB")
+
+def main(argv:list[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark r-matrix build, load/save and training hot paths")
+    parser.add_argument("--size", choices=list(SIZES.keys()), default="small")
+    parser.add_argument("--only", nargs="*", help="Benchmarks to run (default all)", choices=list(BENCHMARKS.keys()))
+    parser.add_argument("--output", default=None, help="JSON report path (default output-files/benchmarks/bench_<size>_<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="Previous JSON report to compare against")
+    parser.add_argument("--scaling", action="store_true", help=f"Measure sharded r-matrix build time and peak RSS over maps of growing size instead ({SCALING_PLAYERS} shards per map)")
+    args = parser.parse_args(argv)
+
+    report = run_scaling() if (args.scaling) else run_suite(args.size, args.only)
+    output = args.output
+    if (output is None):
+        output = DEFAULT_OUTPUT_PATH + "bench_" + report["size"] + "_" + report["timestamp"] + ".json"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Benchmark report saved at {output}")
+    if (args.compare is not None) and (not args.scaling):
+        with open(args.compare, 'r') as file:
+            compare_reports(report, json.load(file))
+
+if __name__ == "__main__":
+    main()
+    sys.exit(0)
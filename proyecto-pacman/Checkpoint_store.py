@@ -0,0 +1,172 @@
+import os
+import json
+import hashlib
+import numpy as np
+from Matrix_storage import DenseMatrix
+from Sparse_storage import SparseMatrix
+
+#Used to monitor performance
+import time
+
+DEFAULT_CHECKPOINT_PATH = "output-files/checkpoints/"
+MANIFEST_NAME = "manifest.json"
+TABLE_DIRECTORY = "tables"
+CHECKPOINT_VERSION = 1
+
+# NOTE - A checkpoint store keeps one file (shard) per player table, plus a manifest listing the shard of every saved table and the targets already trained
+# Dense q-matrixes save every table as its (pairs, 16) array, sparse ones as their packed legal values (legal actions are part of the layout, so they are never saved)
+# Only tables marked dirty since the last commit are written. New shards get new names, the manifest is replaced atomically once they are on disk, and only then are replaced shards removed. A crash at any point leaves the previous manifest and every shard it lists intact
+
+#Write a file through a temporary one, so readers see either the old or the new content
+def _atomic_write(filename:str, write_function) -> None:
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, 'wb') as file:
+        write_function(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_filename, filename)
+
+#Fingerprint of a dense or sparse matrix layout (sparse layouts include the legal actions of every row). Checkpoints can only be restored over the same layout
+def layout_hash(matrix:DenseMatrix) -> str:
+    digest = hashlib.sha1()
+    digest.update(np.asarray(matrix.player_positions, dtype=np.int64).tobytes())
+    digest.update(np.asarray(matrix.ghost_pairs, dtype=np.int64).tobytes())
+    digest.update(str((tuple(matrix.dimension), matrix.is_conmutative)).encode())
+    if (isinstance(matrix, SparseMatrix)):
+        digest.update(b"sparse")
+        digest.update(np.asarray(matrix.masks).tobytes())
+    return digest.hexdigest()
+
+#Values of a player table, as saved on its shard
+def _table_values(q_matrix:DenseMatrix, player_pos:int) -> np.ndarray:
+    if (isinstance(q_matrix, SparseMatrix)):
+        return q_matrix[player_pos].packed
+    return q_matrix[player_pos].data
+
+#Settings as they read back from a manifest (tuples become lists), so they can be compared
+def _normalize_config(config:dict) -> dict:
+    return None if (config is None) else json.loads(json.dumps(config))
+
+#Checkpoints are tied to the training settings given as config (train mode and arguments, rewards, ...): they are only restored (or extended) by runs with the same ones
+class CheckpointStore:
+    def __init__(self, directory:str = DEFAULT_CHECKPOINT_PATH, config:dict = None):
+        self._directory = directory
+        self._config = _normalize_config(config)
+        self._dirty:set[int] = set()
+        self._completed:set[int] = set()
+        self._manifest:dict = None
+        if (os.path.exists(self.manifest_path)):
+            with open(self.manifest_path, 'r') as file:
+                self._manifest = json.load(file)
+            if (self._manifest["version"] != CHECKPOINT_VERSION):
+                raise ValueError(f"ERROR. Unsupported checkpoint version {self._manifest['version']} on {self.manifest_path}")
+            self._completed = set(self._manifest["completed"])
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self._directory, MANIFEST_NAME)
+    @property
+    def checkpoint(self) -> int:
+        return 0 if (self._manifest is None) else self._manifest["checkpoint"]
+    @property
+    def dirty_positions(self) -> list[int]:
+        return sorted(self._dirty)
+    @property
+    def completed_positions(self) -> list[int]:
+        return sorted(self._completed)
+
+    #Whether there is a committed checkpoint to resume from
+    def exists(self) -> bool:
+        return self._manifest is not None
+
+    #Whether the committed checkpoint was saved with the same training settings as this store
+    def matches_config(self) -> bool:
+        return (self._manifest is not None) and (self._manifest.get("config") == self._config)
+
+    #Remove the committed checkpoint (manifest first, then every shard it lists), e.g. once training finished or to start over. Returns number of tables removed
+    def clear(self) -> int:
+        if (self._manifest is None):
+            return 0
+        os.remove(self.manifest_path)
+        for shard in self._manifest["tables"].values():
+            try:
+                os.remove(os.path.join(self._directory, shard))
+            except OSError:
+                pass
+        removed = len(self._manifest["tables"])
+        self._manifest = None
+        self._dirty.clear()
+        self._completed.clear()
+        return removed
+
+    #Register a player table as changed since the last commit. If completed, its target is also recorded as fully trained
+    def mark_dirty(self, player_pos:int, completed:bool = True) -> None:
+        self._dirty.add(player_pos)
+        if (completed):
+            self._completed.add(player_pos)
+
+    #Write dirty tables of q_matrix and a new manifest. Returns number of tables written
+    def commit(self, q_matrix:DenseMatrix, verbose:bool = True) -> int:
+        if (not isinstance(q_matrix, (DenseMatrix, SparseMatrix))):
+            raise ValueError("ERROR. Checkpoints require a dense or sparse q-matrix")
+        timestamp = time.time()
+        matrix_hash = layout_hash(q_matrix)
+        if (self._manifest is not None) and (self._manifest["layout"] != matrix_hash):
+            raise ValueError(f"ERROR. Q-matrix layout does not match the checkpoints on {self._directory}")
+        if (self._manifest is not None) and (not self.matches_config()):
+            raise ValueError(f"ERROR. Checkpoints on {self._directory} were saved with other training settings")
+        os.makedirs(os.path.join(self._directory, TABLE_DIRECTORY), exist_ok=True)
+
+        checkpoint = self.checkpoint + 1
+        tables:dict[str,str] = dict() if (self._manifest is None) else dict(self._manifest["tables"])
+        replaced:list[str] = []
+        for player_pos in sorted(self._dirty):
+            shard = os.path.join(TABLE_DIRECTORY, f"{player_pos}_{checkpoint}.npy")
+            _atomic_write(os.path.join(self._directory, shard), lambda file: np.save(file, np.asarray(_table_values(q_matrix, player_pos))))
+            if (str(player_pos) in tables):
+                replaced.append(tables[str(player_pos)])
+            tables[str(player_pos)] = shard
+
+        manifest = {
+            "version": CHECKPOINT_VERSION,
+            "checkpoint": checkpoint,
+            "timestamp": time.time(),
+            "layout": matrix_hash,
+            "dimension": list(q_matrix.dimension),
+            "dtype": str(q_matrix.dtype),
+            "tables": tables,
+            "completed": sorted(self._completed),
+            "config": self._config,
+        }
+        _atomic_write(self.manifest_path, lambda file: file.write(json.dumps(manifest, indent=1).encode()))
+        self._manifest = manifest
+        for shard in replaced: #No longer listed by the manifest
+            try:
+                os.remove(os.path.join(self._directory, shard))
+            except OSError:
+                pass
+
+        written = len(self._dirty)
+        self._dirty.clear()
+        if (verbose):
+            print(f"Checkpoint {checkpoint} saved at {self._directory} ({written} tables, in {round(time.time() - timestamp, 4)}s)")
+        return written
+
+    #Load every table of the last checkpoint into q_matrix (which must have the same layout). Returns positions of the restored tables
+    def restore(self, q_matrix:DenseMatrix) -> list[int]:
+        if (self._manifest is None):
+            raise ValueError(f"ERROR. There is no checkpoint to restore on {self._directory}")
+        if (not isinstance(q_matrix, (DenseMatrix, SparseMatrix))) or (layout_hash(q_matrix) != self._manifest["layout"]):
+            raise ValueError(f"ERROR. Q-matrix layout does not match the checkpoints on {self._directory}")
+        if (not self.matches_config()):
+            raise ValueError(f"ERROR. Checkpoints on {self._directory} were saved with other training settings (saved {self._manifest.get('config')}, current {self._config}). Train without resuming to start over")
+        restored:list[int] = []
+        for player_pos, shard in self._manifest["tables"].items():
+            table = np.load(os.path.join(self._directory, shard))
+            _table_values(q_matrix, int(player_pos))[:] = table
+            restored.append(int(player_pos))
+        print(f"Checkpoint {self.checkpoint} restored from {self._directory} ({len(restored)} tables, {len(self._completed)} targets completed)")
+        return sorted(restored)
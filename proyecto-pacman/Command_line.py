@@ -0,0 +1,34 @@
+import sys
+import argparse
+import importlib
+
+# NOTE - Every tool of the package behind a single command ('python Command_line.py <command> [arguments]'). Only the module of the chosen command is imported, and its own main() parses the remaining arguments
+# Each module still runs on its own as well ('python <Module>.py [arguments]')
+
+#Command name -> (module with a main(argv) entry point, description)
+COMMANDS:dict[str,tuple[str,str]] = {
+    "build-base": ("Rmatrix_constructor", "Build base r-matrix and wall index files from the map file"),
+    "build-rewards": ("Rmatrix_populator", "Build the conmutative r-matrix into a binary file"),
+    "convert": ("Matrix_storage", "Convert text matrixes into binary ones and vice versa"),
+    "merge-shards": ("Reward_shards", "Assemble a shard store into a single binary r-matrix"),
+    "sparse": ("Sparse_storage", "Convert binary matrixes into sparse ones and vice versa"),
+    "train": ("Agent_trainer", "Train the ghosts q-matrix"),
+    "train-linear": ("Linear_ghostAI", "Train a linear (feature-based) ghost model and compare it against q-matrixes"),
+    "compile-policy": ("Policy_table", "Compile a trained q-matrix into a greedy policy table"),
+    "evaluate": ("Game_evaluator", "Score trained q-matrixes over many headless games"),
+    "benchmark": ("Benchmark_suite", "Benchmark build, storage and training hot paths"),
+    "play": ("Pacman", "Play against the trained ghosts"),
+    "serve": ("Game_server", "Serve games against the trained ghosts to many clients over TCP"),
+    "load-test": ("Load_tester", "Load test a game server with concurrent bot sessions"),
+}
+
+def main(argv:list[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Pacman ghosts AI tools", epilog="Use '<command> --help' for the arguments of each command")
+    parser.add_argument("command", choices=list(COMMANDS.keys()), metavar="command", help=", ".join(f"{name} ({description})" for name, (_, description) in COMMANDS.items()))
+    parser.add_argument("arguments", nargs=argparse.REMAINDER)
+    args = parser.parse_args(sys.argv[1:] if (argv is None) else argv)
+    module_name, _ = COMMANDS[args.command]
+    importlib.import_module(module_name).main(args.arguments)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import math
+import numpy as np
+
+# NOTE - Training error is the same sum computed by GhostAI.compute_error: for every state, |r/max_r - q/max_q| over legal (or 'legalized') actions. Each state's share only changes when one of its q-values changes, so it is kept per state and the total is updated with the difference
+
+#Error contribution of a single state (same formula as GhostAI.compute_error)
+def row_error(r_row:list[int], q_row:list[int]) -> float:
+    max_q = max(max(q_row), 1)
+    max_r = max(max(r_row), 1)
+    error = 0
+    for value in zip(r_row, q_row):
+        if not( (value[0] == -1) and (value[1] == 0) ): #Only compute error for legal moves or 'legalized' illegal ones
+            error += abs((value[0]/max_r) - (value[1]/max_q))
+    return error
+
+#Keeps training error of a single player table up to date as its q-values change. Tables can be dictionaries (keyed by ghost positions) or dense arrays (keyed by row index)
+class ErrorTracker:
+    def __init__(self, q_table, r_table, resync_interval:int = 1000):
+        self._q_table = q_table
+        self._r_table = r_table
+        self._resync_interval = resync_interval
+        self._updates_since_resync:int = 0
+
+        if (isinstance(q_table, np.ndarray)):
+            self._row_errors:dict = dict(enumerate(row_error(r_row, q_row) for r_row, q_row in zip(r_table.tolist(), q_table.tolist())))
+        else:
+            self._row_errors:dict = {key: row_error(r_table[key], q_table[key]) for key in q_table.keys()}
+        self.resync()
+
+    @property
+    def error(self) -> float:
+        return self._error
+
+    #Recompute error of a state after its q-values changed
+    def update(self, key) -> None:
+        q_row = self._q_table[key]
+        r_row = self._r_table[key]
+        if (isinstance(q_row, np.ndarray)):
+            q_row = q_row.tolist()
+            r_row = r_row.tolist()
+        new_error = row_error(r_row, q_row)
+        self._error += new_error - self._row_errors[key]
+        self._row_errors[key] = new_error
+
+        self._updates_since_resync += 1
+        if (self._updates_since_resync >= self._resync_interval):
+            self.resync()
+
+    #Recompute total from per-state errors, dropping rounding drift of the running sum
+    def resync(self) -> None:
+        self._error = math.fsum(self._row_errors.values())
+        self._updates_since_resync = 0
@@ -0,0 +1,202 @@
+import os
+import json
+import random
+import argparse
+import multiprocessing
+import numpy as np
+from GhostAI import GhostAI
+from Maze_topology import MazeTopology, get_topology
+from State_sampler import get_sampler
+from Matrix_storage import MATRIX_EXTENSION
+from Sparse_storage import SPARSE_EXTENSION
+from Policy_table import POLICY_EXTENSION, is_policy_file, load_policy_table
+from Linear_ghostAI import LINEAR_EXTENSION, LinearGhostAI, LinearModel, is_linear_file, load_linear_model
+
+#Used to monitor performance
+import time
+from Performance_util import get_timestamp
+
+DEFAULT_TABLES_PATH = "output-files/ai-tables/"
+DEFAULT_OUTPUT_PATH = "output-files/evaluations/"
+DIMENSION = (18,9)
+CLASSIC_START = (79,82,153) #Same setup simulate_game starts from
+CHUNK_SIZE = 50 #Games per task. Each chunk has its own random stream, so results do not depend on worker count
+
+# NOTE - Games follow GhostAI.simulate_game rules (GhostAI.game_step) without rendering nor prompts: ghosts pick an action, Pacman moves (scripted policy), and ghosts move if Pacman is still alive
+# A game ends when Pacman is caught (capture) or after max_steps time steps (escape)
+
+#Shortest path length between every pair of squares (moving through open squares only), or -1 if unreachable
+def build_distances(topology:MazeTopology) -> np.ndarray:
+    return topology.distances
+
+#Pacman policies. Each one gets (player position, ghost positions, topology, distances) and returns a move (-1 to stay, 0 to 3 to move north, east, south or west)
+def _legal_moves(player_pos:int, topology:MazeTopology) -> list[int]:
+    return [-1] + [action for action in range(4) if (topology.move(player_pos, action) != -1)]
+
+def stay_policy(player_pos:int, ghost_pos:tuple[int,int], topology:MazeTopology, distances:np.ndarray) -> int:
+    return -1
+
+def random_policy(player_pos:int, ghost_pos:tuple[int,int], topology:MazeTopology, distances:np.ndarray) -> int:
+    return random.choice(_legal_moves(player_pos, topology))
+
+#Move to the square farthest from the closest ghost (ties broken by distance to the other ghost, then at random)
+def flee_policy(player_pos:int, ghost_pos:tuple[int,int], topology:MazeTopology, distances:np.ndarray) -> int:
+    best_moves:list[int] = []
+    best_score:tuple[int,int] = None
+    for action in _legal_moves(player_pos, topology):
+        position = topology.move(player_pos, action)
+        ghost_distances = sorted((int(distances[ghost_pos[0], position]), int(distances[ghost_pos[1], position])))
+        score = (ghost_distances[0], ghost_distances[1])
+        if (best_score is None) or (score > best_score):
+            best_score = score
+            best_moves = [action]
+        elif (score == best_score):
+            best_moves.append(action)
+    return random.choice(best_moves)
+
+POLICIES:dict[str,object] = {
+    "stay": stay_policy,
+    "random": random_policy,
+    "flee": flee_policy,
+}
+
+#Play a single game from start_state (ghost1, ghost2, player). Returns steps until capture, or -1 if Pacman escaped for max_steps steps
+def play_game(ai_brain:GhostAI, policy, start_state:tuple[int,int,int], max_steps:int, topology:MazeTopology, distances:np.ndarray) -> int:
+    ai_brain.update_self_pos((start_state[0], start_state[1]))
+    ai_brain.update_player_pos(start_state[2])
+    ignore_epsilon = ai_brain.epsilon < 0.01 #Same as simulate_game
+    for step in range(1, max_steps + 1):
+        action = ai_brain.pick_action(ignore_epsilon)
+        player_pos = ai_brain.state[2]
+        player_move = policy(player_pos, ai_brain.ghost_pos, topology, distances)
+        if (not ai_brain.game_step(action, topology.move(player_pos, player_move))):
+            return step
+    return -1
+
+#Load the ghosts model on matrix_path (q-matrix, policy table or linear model) for playing. Models are read-only (binary ones memory-mapped), so one of them can be shared by any number of GhostAIs
+def load_ghost_model(matrix_path:str, dimension:tuple[int,int]):
+    from Agent_trainer import load_full_matrix
+    if (is_linear_file(matrix_path)): #Linear models play on any map, whatever the one they were trained on
+        return load_linear_model(matrix_path)
+    if (is_policy_file(matrix_path)):
+        return load_policy_table(matrix_path)
+    return load_full_matrix(matrix_path, dimension, lazy=True)
+
+#GhostAI playing with a loaded ghosts model
+def new_ghost_brain(model, start_state:tuple[int,int,int], wall_index:list[int], dimension:tuple[int,int], epsilon:float, topology:MazeTopology = None) -> GhostAI:
+    if (isinstance(model, LinearModel)):
+        return LinearGhostAI(start_state, wall_index, dimension, model, epsilon, topology)
+    return GhostAI(start_state, wall_index, dimension, model, epsilon, topology)
+
+#Worker state, set once per process by the pool initializer
+_worker_state:dict = dict()
+
+def _init_worker(matrix_path:str, wall_index:list[int], dimension:tuple[int,int], epsilon:float) -> None:
+    _worker_state.clear()
+    topology = get_topology(dimension, wall_index)
+    _worker_state["topology"] = topology
+    _worker_state["distances"] = build_distances(topology)
+    _worker_state["ai_brain"] = new_ghost_brain(load_ghost_model(matrix_path, dimension), CLASSIC_START, wall_index, dimension, epsilon, topology)
+
+#Play a chunk of games. Returns steps of every game (-1 on escapes)
+def _play_chunk(task:tuple[int,int,str,str,int,int]) -> list[int]:
+    chunk_index, game_count, policy_name, start, max_steps, seed = task
+    random.seed(f"{seed}:{chunk_index}")
+    topology = _worker_state["topology"]
+    sampler = get_sampler(topology)
+    policy = POLICIES[policy_name]
+    results:list[int] = []
+    for index in range(game_count):
+        if (start == "classic"):
+            start_state = CLASSIC_START
+        else: #Pacman anywhere, ghosts uniformly among valid start states
+            player_pos = random.choice(topology.open_cells)
+            start_state = sampler.sample(player_pos) + (player_pos,)
+        results.append(play_game(_worker_state["ai_brain"], policy, start_state, max_steps, topology, _worker_state["distances"]))
+    return results
+
+#Summarize game results: capture rate and steps-to-capture distribution
+def summarize(results:list[int], max_steps:int) -> dict:
+    steps = np.asarray([result for result in results if (result != -1)], dtype=np.int64)
+    summary = {"games": len(results), "captures": len(steps), "capture_rate": round(len(steps) / len(results), 6) if (len(results) > 0) else None}
+    if (len(steps) > 0):
+        summary["steps"] = {"mean": round(float(steps.mean()), 3), "min": int(steps.min()), "p50": round(float(np.percentile(steps, 50)), 3), "p90": round(float(np.percentile(steps, 90)), 3), "p99": round(float(np.percentile(steps, 99)), 3), "max": int(steps.max())}
+        edges = [0] + [2**exponent for exponent in range(int(np.ceil(np.log2(max(max_steps, 1)))) + 1)]
+        counts, _ = np.histogram(steps, bins=np.asarray(edges) + 0.5) #Bucket (a, b] holds games caught within a+1 to b steps
+        summary["distribution"] = {f"<={edge}": int(count) for edge, count in zip(edges[1:], counts)}
+    return summary
+
+#Run game_count games against the q-matrix on matrix_path, on workers processes (serially if workers <= 1). Returns the evaluation report
+def evaluate(matrix_path:str, wall_index:list[int], game_count:int = 1000, policy:str = "random", start:str = "random", max_steps:int = 200, epsilon:float = 0, workers:int = 1, seed:int = 0, dimension:tuple[int,int] = DIMENSION) -> dict:
+    if (policy not in POLICIES):
+        raise ValueError(f"Policy must be one of {list(POLICIES.keys())}")
+    if (start not in ("random", "classic")):
+        raise ValueError("Start can only be 'random' or 'classic'")
+    if (start == "classic") and (not all(get_topology(dimension, wall_index).is_open(position) for position in CLASSIC_START)):
+        raise ValueError("ERROR. Classic start is not valid on this map, use random starts instead")
+    if (not os.path.isfile(matrix_path)): #Checked here, since workers failing to start are restarted endlessly by the pool
+        raise ValueError(f"ERROR. Q-matrix file {matrix_path} does not exist")
+    timestamp = time.perf_counter()
+    tasks = [(index, min(CHUNK_SIZE, game_count - first), policy, start, max_steps, seed) for index, first in enumerate(range(0, game_count, CHUNK_SIZE))]
+    results:list[int] = []
+    if (workers <= 1):
+        _init_worker(matrix_path, wall_index, dimension, epsilon)
+        for chunk in map(_play_chunk, tasks):
+            results.extend(chunk)
+        _worker_state.clear()
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(matrix_path, wall_index, dimension, epsilon)) as pool:
+            for chunk in pool.imap(_play_chunk, tasks):
+                results.extend(chunk)
+    elapsed = time.perf_counter() - timestamp
+    report = {"matrix": matrix_path, "policy": policy, "start": start, "max_steps": max_steps, "epsilon": epsilon, "seed": seed}
+    report.update(summarize(results, max_steps))
+    report["seconds"] = round(elapsed, 4)
+    report["games_per_second"] = round(game_count / elapsed, 3) if (elapsed > 0) else None
+    return report
+
+#Matrix files to evaluate: the given files, plus every binary or sparse matrix (or policy table, or linear model) inside the given directories (sorted by name, so timestamped checkpoints come in order)
+def collect_matrix_files(paths:list[str]) -> list[str]:
+    files:list[str] = []
+    for path in paths:
+        if (os.path.isdir(path)):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith((MATRIX_EXTENSION, SPARSE_EXTENSION, POLICY_EXTENSION, LINEAR_EXTENSION)))
+        else:
+            files.append(path)
+    return files
+
+def main(argv:list[str] = None) -> None:
+    from Map_resources import MAP_PATH, load_map
+    parser = argparse.ArgumentParser(description="Score trained q-matrixes over many headless games against scripted Pacman policies")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_TABLES_PATH], help=f"Q-matrix files or directories (default {DEFAULT_TABLES_PATH})")
+    parser.add_argument("--map", default=MAP_PATH, help="Map file the q-matrixes were trained on")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--policy", choices=list(POLICIES.keys()), default="random")
+    parser.add_argument("--start", choices=["random", "classic"], default="random", help="Random start states, or the simulate_game setup")
+    parser.add_argument("--max-steps", type=int, default=200)
+    parser.add_argument("--epsilon", type=float, default=0, help="Ghost exploration rate during games")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON report path (default output-files/evaluations/eval_<timestamp>.json)")
+    args = parser.parse_args(argv)
+    dimension, _, walls = load_map(args.map)
+
+    reports:list[dict] = []
+    for matrix_path in collect_matrix_files(args.paths):
+        report = evaluate(matrix_path, walls, args.games, args.policy, args.start, args.max_steps, args.epsilon, args.workers, args.seed, dimension)
+        reports.append(report)
+        steps = report.get("steps", {})
+        print(f"INFO. {matrix_path}: capture rate {report['capture_rate']} ({report['captures']}/{report['games']}), steps p50 {steps.get('p50')} p90 {steps.get('p90')}, {report['games_per_second']} games/s")
+    if (reports == []):
+        print("\033[93m" + f"WARN. No q-matrixes found on {args.paths}" + "\033[0m")
+    else:
+        output = args.output
+        if (output is None):
+            os.makedirs(DEFAULT_OUTPUT_PATH, exist_ok=True)
+            output = DEFAULT_OUTPUT_PATH + "eval_" + get_timestamp() + ".json"
+        with open(output, 'w') as file:
+            json.dump(reports, file, indent=1)
+        print(f"Evaluation report saved at {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import os
+import json
+import random
+import asyncio
+from GhostAI import GhostAI
+from Maze_topology import get_topology
+from State_sampler import get_sampler
+from Game_evaluator import load_ghost_model, new_ghost_brain
+from Performance_util import get_metrics
+
+#Used to monitor performance
+import time
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7777
+DEFAULT_MAX_SESSIONS = 1024
+DEFAULT_MAX_STEPS = 200 #Same game length Game_evaluator scores with
+PROTOCOL_VERSION = 1
+LINE_LIMIT = 256 #Longest request accepted (bytes)
+
+# NOTE - The server loads the ghosts model (q-matrix, policy table or linear model) once, read-only, and every connection plays its own games with its own GhostAI over it. Binary models are memory-mapped, so sessions cost a few KB each, not a copy of the matrix
+# Decisions are a few table lookups, so they run right on the event loop (no threads): one process serves hundreds of sessions, and several server processes on other ports share the same mapped pages
+# Protocol: one request per line, one reply per line, words separated by spaces. Games follow GhostAI.simulate_game rules (GhostAI.game_step)
+#   On connect          -> HELLO <version> <width> <height> <max steps>
+#   START               -> STATE <ghost1> <ghost2> <player> <step>          New game, Pacman on a random open square and ghosts on a random valid start
+#   START <g1> <g2> <p> -> STATE ...                                        New game from the given positions
+#   MOVE <action>       -> STATE ... | CAUGHT ... | ESCAPED ...             Pacman moves (-1 stays, 0 to 3 move north, east, south or west), then ghosts do. CAUGHT and ESCAPED (max steps survived) end the game
+#   STATS               -> STATS <json>                                     Server counters and decision latency
+#   QUIT                -> BYE
+#   Anything wrong      -> ERROR <message>                                  The session (and its game, if any) stays as it was
+
+#Game state of a connection
+class GameSession:
+    def __init__(self, ai_brain:GhostAI):
+        self._ai_brain = ai_brain
+        self._step:int = 0
+        self._is_playing:bool = False
+
+    @property
+    def ai_brain(self) -> GhostAI:
+        return self._ai_brain
+    @property
+    def step(self) -> int:
+        return self._step
+    @property
+    def is_playing(self) -> bool:
+        return self._is_playing
+
+    def start(self, state:tuple[int,int,int]) -> None:
+        self._ai_brain.update_self_pos((state[0], state[1]))
+        self._ai_brain.update_player_pos(state[2])
+        self._step = 0
+        self._is_playing = True
+
+    #Play a time step (ghosts pick an action, then Pacman and ghosts move). Returns whether Pacman is still alive
+    def play(self, player_new_pos:int) -> bool:
+        ai_brain = self._ai_brain
+        action = ai_brain.pick_action(ai_brain.epsilon < 0.01) #Same as simulate_game
+        self._step += 1
+        is_alive = ai_brain.game_step(action, player_new_pos)
+        if (not is_alive):
+            self._is_playing = False
+        return is_alive
+
+    def stop(self) -> None:
+        self._is_playing = False
+
+class GameServer:
+    def __init__(self, matrix_path:str, wall_index:list[int], dimension:tuple[int,int], epsilon:float = 0, max_steps:int = DEFAULT_MAX_STEPS, max_sessions:int = DEFAULT_MAX_SESSIONS):
+        if (max_steps < 1):
+            raise ValueError("Max steps must be at least 1")
+        if (max_sessions < 1):
+            raise ValueError("Max sessions must be at least 1")
+        timestamp = time.time()
+        self._model = load_ghost_model(matrix_path, dimension)
+        self._matrix_path = matrix_path
+        self._wall_index = wall_index
+        self._dimension = tuple(dimension)
+        self._topology = get_topology(dimension, wall_index)
+        self._sampler = get_sampler(self._topology)
+        self._epsilon = epsilon
+        self._max_steps = max_steps
+        self._max_sessions = max_sessions
+        self._session_count:int = 0
+        self._server:asyncio.AbstractServer = None
+        print(f"Ghosts model {matrix_path} loaded (in {round(time.time() - timestamp, 4)}s)")
+
+    @property
+    def session_count(self) -> int:
+        return self._session_count
+    @property
+    def max_steps(self) -> int:
+        return self._max_steps
+    @property
+    def port(self) -> int:
+        if (self._server is None):
+            return None
+        return self._server.sockets[0].getsockname()[1]
+
+    #New session playing with the shared model
+    def new_session(self) -> GameSession:
+        player_pos = self._topology.open_cells[0]
+        return GameSession(new_ghost_brain(self._model, self._sampler.sample(player_pos) + (player_pos,), self._wall_index, self._dimension, self._epsilon, self._topology))
+
+    def greeting(self) -> str:
+        return f"HELLO {PROTOCOL_VERSION} {self._dimension[0]} {self._dimension[1]} {self._max_steps}"
+
+    def stats(self) -> dict:
+        metrics = get_metrics()
+        decision = metrics.timers.get("server.decision")
+        return {
+            "sessions": self._session_count,
+            "connections": metrics.counters.get("server.connections", 0),
+            "games": metrics.counters.get("server.games", 0),
+            "captures": metrics.counters.get("server.captures", 0),
+            "moves": metrics.counters.get("server.moves", 0),
+            "errors": metrics.counters.get("server.errors", 0),
+            "decision_ms": None if (decision is None) else {field: round(value*1000, 4) for field, value in decision.to_dict().items() if field in ("mean", "p50", "p90", "p99", "max")},
+        }
+
+    #Answer a request of a session. Returns (reply, whether to close the connection)
+    def handle_request(self, session:GameSession, request:str) -> tuple[str,bool]:
+        words = request.split()
+        if (words == []):
+            return self._error("Empty request"), False
+        command = words[0].upper()
+        if (command == "MOVE"):
+            return self._move(session, words[1:]), False
+        if (command == "START"):
+            return self._start(session, words[1:]), False
+        if (command == "STATS"):
+            return "STATS " + json.dumps(self.stats()), False
+        if (command == "QUIT"):
+            return "BYE", True
+        return self._error(f"Unknown command {words[0]} (use START, MOVE, STATS or QUIT)"), False
+
+    def _error(self, message:str) -> str:
+        get_metrics().count("server.errors")
+        return "ERROR " + message
+
+    def _state_reply(self, kind:str, session:GameSession) -> str:
+        state = session.ai_brain.state
+        return f"{kind} {state[0]} {state[1]} {state[2]} {session.step}"
+
+    def _start(self, session:GameSession, arguments:list[str]) -> str:
+        if (arguments == []):
+            player_pos = random.choice(self._topology.open_cells)
+            state = self._sampler.sample(player_pos) + (player_pos,)
+        else:
+            try:
+                state = tuple(int(argument) for argument in arguments)
+            except ValueError:
+                return self._error("Positions must be integers")
+            if (len(state) != 3):
+                return self._error("START takes no positions, or three (ghost1 ghost2 player)")
+            if (not all(self._topology.is_open(position) for position in state)):
+                return self._error("Positions must be open squares")
+            if (len(set(state)) != 3):
+                return self._error("Ghosts and Pacman must start on different squares")
+        session.start(state)
+        get_metrics().count("server.games")
+        return self._state_reply("STATE", session)
+
+    def _move(self, session:GameSession, arguments:list[str]) -> str:
+        if (not session.is_playing):
+            return self._error("No game in progress (use START)")
+        if (len(arguments) != 1) or (arguments[0] not in ("-1", "0", "1", "2", "3")):
+            return self._error("Only insert numeric action (-1 to stay, 0 to move north, 1 to move east, 2 to move south, 3 to move west)")
+        action = int(arguments[0])
+        player_pos = session.ai_brain.state[2]
+        player_new_pos = player_pos if (action == -1) else self._topology.move(player_pos, action)
+        if (player_new_pos == -1):
+            return self._error("Invalid action selected (Cannot move into walls nor out-of-bounds)")
+        metrics = get_metrics()
+        timestamp = time.perf_counter()
+        is_alive = session.play(player_new_pos)
+        metrics.record_time("server.decision", time.perf_counter() - timestamp)
+        metrics.count("server.moves")
+        if (not is_alive):
+            metrics.count("server.captures")
+            return self._state_reply("CAUGHT", session)
+        if (session.step >= self._max_steps):
+            session.stop()
+            return self._state_reply("ESCAPED", session)
+        return self._state_reply("STATE", session)
+
+    #Serve a connection until it quits or drops
+    async def handle_client(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        metrics = get_metrics()
+        if (self._session_count >= self._max_sessions):
+            writer.write(f"ERROR Server full ({self._max_sessions} sessions)\n".encode())
+            metrics.count("server.rejected")
+            await self._close(writer)
+            return
+        self._session_count += 1
+        metrics.count("server.connections")
+        try:
+            session = self.new_session()
+            writer.write((self.greeting() + "\n").encode())
+            while (True):
+                try:
+                    line = await reader.readline()
+                except ValueError: #Line longer than LINE_LIMIT
+                    writer.write((self._error(f"Requests must be shorter than {LINE_LIMIT} bytes") + "\n").encode())
+                    break
+                if (line == b""): #Connection closed by the client
+                    break
+                reply, is_closing = self.handle_request(session, line.decode(errors="replace"))
+                writer.write((reply + "\n").encode())
+                await writer.drain()
+                if (is_closing):
+                    break
+                metrics.maybe_export()
+        except ConnectionError:
+            metrics.count("server.dropped")
+        finally:
+            self._session_count -= 1
+            await self._close(writer)
+
+    async def _close(self, writer:asyncio.StreamWriter) -> None:
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    #Start listening (port 0 picks a free port). Returns the asyncio server
+    async def start(self, host:str = DEFAULT_HOST, port:int = DEFAULT_PORT) -> asyncio.AbstractServer:
+        self._server = await asyncio.start_server(self.handle_client, host, port, limit=LINE_LIMIT, backlog=self._max_sessions)
+        print(f"Game server listening on {host}:{self.port} (up to {self._max_sessions} sessions)")
+        return self._server
+
+    async def serve_forever(self, host:str = DEFAULT_HOST, port:int = DEFAULT_PORT) -> None:
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+def main(argv:list[str] = None) -> None:
+    import argparse
+    from Map_resources import MAP_PATH, load_map
+    from Performance_util import configure_metrics
+    from Pacman import QMATRIX_PATH, POLICY_PATH
+    parser = argparse.ArgumentParser(description="Serve games against the trained ghosts to many clients at once, over a line protocol on TCP (see 'python Load_tester.py' for a client)")
+    parser.add_argument("matrix", nargs="?", default=None, help=f"Q-matrix, policy table or linear model (default {POLICY_PATH} if compiled, {QMATRIX_PATH} otherwise)")
+    parser.add_argument("--map", default=MAP_PATH, help="Map file the ghosts were trained on")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--epsilon", type=float, default=0, help="Ghost exploration rate during games")
+    parser.add_argument("--max-steps", type=int, default=DEFAULT_MAX_STEPS, help="Time steps Pacman must survive to escape")
+    parser.add_argument("--max-sessions", type=int, default=DEFAULT_MAX_SESSIONS)
+    parser.add_argument("--metrics", default=None, help="Append metrics snapshots (JSON lines) to this file once a minute")
+    args = parser.parse_args(argv)
+    matrix_path = args.matrix
+    if (matrix_path is None):
+        matrix_path = POLICY_PATH if (os.path.exists(POLICY_PATH)) else QMATRIX_PATH
+    if (args.metrics is not None):
+        configure_metrics(args.metrics)
+    dimension, _, walls = load_map(args.map)
+    server = GameServer(matrix_path, walls, dimension, args.epsilon, args.max_steps, args.max_sessions)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Game server stopped")
+
+if __name__ == "__main__":
+    main()
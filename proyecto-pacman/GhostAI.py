@@ -1,77 +1,85 @@
 import random
-from Rmatrix_populator import save_full_matrix, load_base, BASE_PATH
-from Performance_util import get_timestamp, performance_decorator
+import time
+import threading
+import numpy as np
+from Rmatrix_populator import save_full_matrix
+from Map_resources import BASE_PATH, load_base
+from Performance_util import get_timestamp, performance_decorator, get_metrics
+from Matrix_storage import ACTION_COUNT, DenseMatrix, MATRIX_EXTENSION, canonical_pair, save_binary_matrix, snapshot_matrix
+from Maze_topology import MazeTopology, get_topology
+from State_sampler import get_sampler
+from Error_tracker import ErrorTracker, row_error
+from Batch_trainer import build_transitions, solve_q_table, train_batch, valid_start_states
+from Reward_provider import RewardProvider
+from Reward_shards import ShardedMatrix
+from Sparse_storage import SPARSE_EXTENSION, SparseMatrix, SparseTable, mask_joint_actions, save_sparse_matrix
+from Policy_table import PolicyTable
 
 DEFAULT_SAVE_PATH = "output-files/ai-tables/"
+DENSE_SOURCES = (DenseMatrix, RewardProvider, ShardedMatrix) #R-matrixes whose player tables are dense arrays
+INDEXED_SOURCES = DENSE_SOURCES + (SparseMatrix,) #R-matrixes whose rows can be read by integer indexes
 
 class GhostAI:
     #Initialize GhostAI model. future_factor is gamma (discount for future actions versus value of present ones) and learn_rate is alpha
-    def __init__(self, initial_state:tuple[int,int,int], wall_index:list[int], dimension:tuple[int,int], q_matrix:dict[int,dict[tuple[int,int],list[int]]], epsilon:float):
+    def __init__(self, initial_state:tuple[int,int,int], wall_index:list[int], dimension:tuple[int,int], q_matrix:dict[int,dict[tuple[int,int],list[int]]], epsilon:float, topology:MazeTopology = None):
         self._q_matrix = q_matrix
+        self._is_dense:bool = isinstance(q_matrix, DenseMatrix) #Dense q-matrixes are accessed by integer indexes instead of dictionary lookups
+        self._is_sparse:bool = isinstance(q_matrix, SparseMatrix) #Sparse q-matrixes too, but only store values of legal actions
+        self._is_policy:bool = isinstance(q_matrix, PolicyTable) #Policy tables only store greedy actions, for playing (cannot be trained)
         self._wall_index = wall_index
         self._dimension = dimension
+        self._topology = topology if (topology is not None) else get_topology(dimension, wall_index) #Shared neighbor table, so legality checks are plain lookups
+        self._sampler = get_sampler(self._topology)
         self.update_self_pos((initial_state[0], initial_state[1]))
         self.update_player_pos(initial_state[2])
 
         self._epsilon = epsilon
         self._do_explore = True
+        self._error_tracker:ErrorTracker = None #Only set while training with incremental error
+        self._transitions:np.ndarray = None #Built on first batched training
+        self._maps:dict[str,list[int]] = dict() #Maps already read by print_state
 
         random.seed() #Initialize random generator seed
     
+    #Ghost positions are kept in canonical (lower, higher) order, which is how q-tables store them. _is_swapped remembers whether the first ghost is the higher one, so ghosts keep their identity on display
     def update_self_pos(self, position:tuple[int,int]):
-        if (position[0] < position[1]):
-            self._lower_pos = position[0]
-            self._higher_pos = position[1]
-            self._inverted_pos:bool = False
-        else:
-            self._lower_pos = position[1]
-            self._higher_pos = position[0]
-            self._inverted_pos:bool = True
+        (self._lower_pos, self._higher_pos), self._is_swapped = canonical_pair(position)
+        if (self._is_dense) or (self._is_sparse) or (self._is_policy):
+            self._pair_index:int = self._q_matrix.pair_index((self._lower_pos, self._higher_pos))
     
+    #Move ghosts to random positions, uniformly among the valid start states of the current player position
     def randomize_pos(self):
-        #Pick position
-        newPos = random.choices(list(self._q_matrix.keys()), k=2)
-        newPos.sort()
-        need_check:bool = True
-        #Assert that ghosts are in different squares and are not over the player
-        while (need_check):
-            if newPos[0] == self._player_pos:
-                newPos[0] += 1
-            elif newPos[1] == self._player_pos:
-                newPos[1] += 1
-            elif newPos[0] in self._wall_index:
-                newPos[0] += 1
-            elif newPos[1] in self._wall_index:
-                newPos[1] += 1
-            elif newPos[0] == newPos[1]:
-                newPos[1] += 1
-            elif (newPos[0] > (self._dimension[0]*self._dimension[1] - 1)):
-                newPos[0] = 0
-            elif (newPos[1] > (self._dimension[0]*self._dimension[1] - 1)):
-                newPos[1] = 0
-            else:
-                need_check = False
-        #Decide if ghosts appear in normal or inverted position
-        if random.random() > 0.5:
-            newPos.sort(reverse=True)
-        else:
-            newPos.sort()
-        #Update position
-        self.update_self_pos(newPos)
+        self.update_self_pos(self._sampler.sample(self._player_pos))
     
     def update_player_pos(self, position:int):
         self._player_pos = position
+        if (self._is_dense):
+            player_index = self._q_matrix.player_index(position)
+            self._q_table = None if (player_index == -1) else self._q_matrix.data[player_index]
+        elif (self._is_sparse):
+            self._q_table = None if (self._q_matrix.player_index(position) == -1) else self._q_matrix[position]
+        elif (self._is_policy):
+            self._policy_index:int = self._q_matrix.player_index(position)
+    
+    #Get list of action values for current state from q-matrix
+    def get_q_values(self) -> list[int]:
+        if (self._is_policy):
+            raise ValueError("ERROR. Policy tables do not store q-values")
+        if (not self._is_dense) and (not self._is_sparse):
+            return self._q_matrix[self._player_pos][(self._lower_pos, self._higher_pos)]
+        if (self._q_table is None) or (self._pair_index == -1):
+            raise KeyError((self._lower_pos, self._higher_pos, self._player_pos))
+        if (self._is_sparse):
+            return self._q_table.expand_row(self._pair_index)
+        return self._q_table[self._pair_index].tolist()
     
     @property
     def state(self) -> tuple[int, int, int]:
-        if (self._inverted_pos):
-            return (self._higher_pos, self._lower_pos, self._player_pos)
-        else:
-            return (self._lower_pos, self._higher_pos, self._player_pos)
+        return self.ghost_pos + (self._player_pos,)
     
     @property
     def ghost_pos(self) -> tuple[int, int]:
-        if (self._inverted_pos):
+        if (self._is_swapped):
             return (self._higher_pos, self._lower_pos)
         else:
             return (self._lower_pos, self._higher_pos)
@@ -83,12 +91,34 @@ class GhostAI:
     def epsilon(self, value):
         self._epsilon = value
     
-    #Saves current q-matrix to file
+    #Saves current q-matrix to file. Dense q-matrixes are saved in binary format by default
+    #If background, a copy of the q-matrix is written on a separate thread (so training may go on) and the thread is returned. Join it before saving again
     @performance_decorator
-    def save_matrix(self, filename:str = None) -> None:
+    def save_matrix(self, filename:str = None, background:bool = False) -> threading.Thread:
         if (filename is None):
-            filename = DEFAULT_SAVE_PATH + "GhostAI_" + get_timestamp() + ".txt"
-        save_full_matrix(self._q_matrix, filename)
+            extension = MATRIX_EXTENSION if isinstance(self._q_matrix, DenseMatrix) else ".txt"
+            if (self._is_sparse):
+                extension = SPARSE_EXTENSION
+            filename = DEFAULT_SAVE_PATH + "GhostAI_" + get_timestamp() + extension
+        if (filename.endswith(SPARSE_EXTENSION)):
+            if (not self._is_sparse): #Legal actions of trained q-values cannot be told apart from zeros
+                raise ValueError(f"ERROR. Only sparse q-matrixes can be saved as {SPARSE_EXTENSION}")
+            if (background):
+                matrix = self._q_matrix
+                snapshot = SparseMatrix(np.array(matrix.masks), np.array(matrix.packed), matrix.player_positions, matrix.ghost_pairs, matrix.dimension, matrix.is_conmutative, matrix.fill)
+                thread = threading.Thread(target=save_sparse_matrix, args=(snapshot, filename), name="save_matrix")
+                thread.start()
+                return thread
+            save_sparse_matrix(self._q_matrix, filename)
+            return None
+        if (filename.endswith(MATRIX_EXTENSION)):
+            if (background):
+                thread = threading.Thread(target=save_binary_matrix, args=(snapshot_matrix(self._q_matrix), filename, self._dimension), name="save_matrix")
+                thread.start()
+                return thread
+            save_binary_matrix(self._q_matrix, filename, self._dimension)
+            return None
+        return save_full_matrix(self._q_matrix, filename, background=background)
     #Saves table corresponding to current player position to file
     def save_table(self, filename:str = None):
         if (filename is None):
@@ -97,57 +127,18 @@ class GhostAI:
         save_full_matrix(fake_matrix, filename)
 
     #Parses and determinates if proposed action is legal (and returns new positions if so) or not (returns -1,-1)
+    #Actions are given in canonical order (lower ghost's move, higher ghost's move). New positions are returned in ghost order (same as ghost_pos), each ghost following its own move
     def parse_action(self, action_tuple:tuple[int, int]) -> tuple[int, int]:
-        newPos:list[int] = []
-        for oldPos, action in zip((self._lower_pos, self._higher_pos), action_tuple):
-            match action:
-                case 0: #Move north
-                    candidate = oldPos - self._dimension[0]
-                    if (candidate < 0):
-                        newPos.append(-1)
-                    elif (candidate in self._wall_index):
-                        newPos.append(-1)
-                    else:
-                        newPos.append(candidate)
-                case 1: #Move east
-                    candidate = oldPos + 1
-                    if ( (oldPos % self._dimension[0]) == (self._dimension[0] - 1) ):
-                        newPos.append(-1)
-                    elif (candidate in self._wall_index):
-                        newPos.append(-1)
-                    else:
-                        newPos.append(candidate)
-                case 2: #Move south
-                    candidate = oldPos + self._dimension[0]
-                    if (candidate > ((self._dimension[0]*self._dimension[1])-1)):
-                        newPos.append(-1)
-                    elif (candidate in self._wall_index):
-                        newPos.append(-1)
-                    else:
-                        newPos.append(candidate)
-                case 3: #Move west
-                    candidate = oldPos - 1
-                    if ( (oldPos % self._dimension[0]) == (0) ):
-                        newPos.append(-1)
-                    elif (candidate in self._wall_index):
-                        newPos.append(-1)
-                    else:
-                        newPos.append(oldPos - 1)
+        newPos = (self._topology.move(self._lower_pos, action_tuple[0]), self._topology.move(self._higher_pos, action_tuple[1]))
         if (newPos[0] == newPos[1]): #Ghosts cannot land on the same square
-            newPos = [-1,-1]
-        if (self._inverted_pos): #to-do Cleaner way to implement this?
-            newPos.sort(reverse=True)
-        return tuple(newPos)
+            return (-1,-1)
+        if (self._is_swapped):
+            return (newPos[1], newPos[0])
+        return newPos
     
     #Return list with all available actions for current state
     def get_available_actions(self) -> list[tuple[int,int]]:
-        action_list:list[tuple[int,int]] = []
-        for i in range(16):
-            action = (i//4, i%4)
-            result = self.parse_action(action)
-            if ( (result[0] != -1) and (result[1] != -1) ):
-                action_list.append(action)
-        return action_list
+        return self._topology.joint_actions((self._lower_pos, self._higher_pos))
     
     #Transform action tuple into integer index, for using with q-tables
     def get_action_index(self, action:tuple[int,int]) -> int:
@@ -155,8 +146,11 @@ class GhostAI:
 
     #Picks an action tuple from the available legal actions using e-greedy
     def pick_action(self, ignore_epsilon:bool = False) -> tuple[int,int]:
-        q_table = self._q_matrix[self._player_pos]
-        reward_list = q_table[(self._lower_pos, self._higher_pos)]
+        if (self._is_sparse):
+            return self._pick_sparse_action(ignore_epsilon)
+        if (self._is_policy):
+            return self._pick_policy_action(ignore_epsilon)
+        reward_list = self.get_q_values()
         action_list = self.get_available_actions()
 
         if ( (not ignore_epsilon) and (random.random() < self.epsilon) ): #Pick random action
@@ -172,31 +166,174 @@ class GhostAI:
                 action_candidates = action_list
             return random.choice(action_candidates)
     
+    #Same as pick_action, reading legal actions and their values straight from the sparse q-table (legal actions of a row are exactly its mask)
+    def _pick_sparse_action(self, ignore_epsilon:bool) -> tuple[int,int]:
+        if (self._q_table is None) or (self._pair_index == -1):
+            raise KeyError((self._lower_pos, self._higher_pos, self._player_pos))
+        action_list = self._q_table.joint_actions(self._pair_index)
+        if ( (not ignore_epsilon) and (random.random() < self.epsilon) ): #Pick random action
+            return random.choice(action_list)
+        value_list = self._q_table.row(self._pair_index).tolist()
+        max_reward = self._q_table.fill if (len(value_list) < ACTION_COUNT) else None
+        for value in value_list: #Illegal actions (fill value) take part in the max too, same as with full rows
+            if (max_reward is None) or (value > max_reward):
+                max_reward = value
+        action_candidates = [action for action, value in zip(action_list, value_list) if (value >= max_reward)]
+        if (action_candidates == []):
+            print("\033[93m" + f"WARN. Action candidates empty when selecting optimal action for state {self.state}\nInternal\n\tLower: {self._lower_pos}, Higher: {self._higher_pos}, Player: {self._player_pos}\n\tAction list: {action_list}" + "\033[0m")
+            action_candidates = action_list
+        return random.choice(action_candidates)
+    
+    #Same as pick_action, with greedy candidates read from the policy table (one lookup per decision)
+    def _pick_policy_action(self, ignore_epsilon:bool) -> tuple[int,int]:
+        if (self._policy_index == -1) or (self._pair_index == -1):
+            raise KeyError((self._lower_pos, self._higher_pos, self._player_pos))
+        if ( (not ignore_epsilon) and (random.random() < self.epsilon) ): #Pick random action
+            return random.choice(self.get_available_actions())
+        return random.choice(mask_joint_actions(self._q_matrix.tie_mask(self._policy_index, self._pair_index)))
+    
     def update_q_value(self, action_index:int, new_value:int) -> None:
+        if (self._is_dense):
+            self._q_table[self._pair_index, action_index] = new_value
+            if (self._error_tracker is not None):
+                self._error_tracker.update(self._pair_index)
+            return
+        if (self._is_sparse):
+            self._q_table.set_value(self._pair_index, action_index, new_value)
+            if (self._error_tracker is not None):
+                self._error_tracker.update((self._lower_pos, self._higher_pos))
+            return
         #Demeter will probably die reading this. Do not try to understand, just *flow* with it ;-;
         ((self._q_matrix[self._player_pos])[(self._lower_pos, self._higher_pos)])[action_index] = new_value
+        if (self._error_tracker is not None):
+            self._error_tracker.update((self._lower_pos, self._higher_pos))
     
     def compute_error(self, r_matrix:dict[int,dict[tuple[int,int],list[int]]]) -> float:
+        if (self._is_sparse) and (isinstance(r_matrix, SparseMatrix)):
+            r_table = self._check_r_layout(r_matrix)[self._player_pos]
+            if (np.array_equal(r_table.masks, self._q_table.masks)):
+                return self._compute_sparse_error(r_table)
+        if ((self._is_dense) or (self._is_sparse)) and (isinstance(r_matrix, INDEXED_SOURCES)):
+            return self._compute_dense_error(r_matrix)
         q_table = self._q_matrix[self._player_pos]
         r_table = r_matrix[self._player_pos]
         error = 0
         for position in q_table.keys():
-            max_q = max(max(q_table[position]), 1)
-            max_r = max(max(r_table[position]), 1)
-            for value in zip(r_table[position], q_table[position]):
-                if not( (value[0] == -1) and (value[1] == 0) ): #Only compute error for legal moves or 'legalized' illegal ones
-                    error += abs((value[0]/max_r) - (value[1]/max_q))
+            error += row_error(r_table[position], q_table[position])
         return error
     
+    #Same as compute_error, vectorized over the whole dense table of current player position (sparse tables are expanded first)
+    def _compute_dense_error(self, r_matrix:DenseMatrix) -> float:
+        q_table = (self._q_table.expand() if (self._is_sparse) else self._q_table).astype(np.float64)
+        r_table = self._get_r_table(r_matrix).astype(np.float64)
+        max_q = np.maximum(q_table.max(axis=1, keepdims=True), 1)
+        max_r = np.maximum(r_table.max(axis=1, keepdims=True), 1)
+        counted = ~( (r_table == -1) & (q_table == 0) ) #Only compute error for legal moves or 'legalized' illegal ones
+        return float(np.abs(r_table/max_r - q_table/max_q)[counted].sum())
+    
+    #Same as _compute_dense_error, over packed values only. Both tables must have the same legal actions, so illegal entries (-1 on the r-table, 0 on the q-table) are never counted
+    def _compute_sparse_error(self, r_table:SparseTable) -> float:
+        counts = self._q_table.row_counts()
+        max_q = np.repeat(np.maximum(self._q_table.row_max(), 1), counts)
+        max_r = np.repeat(np.maximum(r_table.row_max(), 1), counts)
+        return float(np.abs(r_table.packed/max_r - self._q_table.packed/max_q).sum())
+    
+    #Get dense r-table for current player position, with rows sorted like the q-table. Sparse r-tables are expanded
+    def _get_r_table(self, r_matrix:DenseMatrix) -> np.ndarray:
+        self._check_r_layout(r_matrix)
+        if (isinstance(r_matrix, SparseMatrix)):
+            return r_matrix[self._player_pos].expand()
+        return r_matrix[self._player_pos].data
+    
+    #Assert that r-matrix rows are sorted like the q-table and have the current player position
+    def _check_r_layout(self, r_matrix:DenseMatrix) -> DenseMatrix:
+        if (r_matrix.player_index(self._player_pos) == -1):
+            raise KeyError(self._player_pos)
+        if (r_matrix.ghost_pairs is not self._q_matrix.ghost_pairs) and (r_matrix.ghost_pairs != self._q_matrix.ghost_pairs):
+            raise ValueError("ERROR. R-matrix and Q-matrix must share the same ghost pairs layout")
+        return r_matrix
+    
+    #Start tracking error of current player table incrementally, as q-values get updated
+    def _start_error_tracker(self, r_matrix:dict[int,dict[tuple[int,int],list[int]]]) -> ErrorTracker:
+        if (self._is_dense): #Dense q-values are updated by row index, so the tracker is keyed by row index too
+            if (isinstance(r_matrix, INDEXED_SOURCES)):
+                r_table = self._get_r_table(r_matrix)
+            else: #Dictionary r-tables are laid out in q-table row order first
+                r_rows = r_matrix[self._player_pos]
+                r_table = np.asarray([r_rows[ghost_pos] for ghost_pos in self._q_matrix.ghost_pairs])
+            self._error_tracker = ErrorTracker(self._q_table, r_table)
+        else: #Sparse q-tables are tracked by ghost positions, same as dictionaries
+            self._error_tracker = ErrorTracker(self._q_matrix[self._player_pos], r_matrix[self._player_pos])
+        return self._error_tracker
+    
+    #Incremental error of the current player table (only called while training with error_mode 'incremental')
+    def _tracked_error(self) -> float:
+        return self._error_tracker.error
+    
+    #Pick the action of a training step with e-greedy. Returns (action, data _add_transition needs about it). Q-tables need nothing but the action index
+    def _choose(self, ignore_epsilon:bool) -> tuple[tuple[int,int], object]:
+        return self.pick_action(ignore_epsilon), None
+    
+    #Learn from a training step (taking action_index from the current state) towards target, the reward plus discounted max future reward. Q-values move learn_rate of the way there
+    def _add_transition(self, action_index:int, features:object, target:float, learn_rate:float) -> None:
+        if (self._is_dense):
+            oldValue = self._q_table.item(self._pair_index, action_index)
+        elif (self._is_sparse):
+            oldValue = self._q_table.value(self._pair_index, action_index)
+        else:
+            oldValue = self._q_matrix[self._player_pos][(self._lower_pos, self._higher_pos)][action_index]
+        self.update_q_value(action_index, round(oldValue + learn_rate * (target - oldValue)))
+    
+    #Apply transitions still waiting for an update once training ends. Q-values are updated on every transition, so there are none
+    def _gradient_step(self, learn_rate:float) -> None:
+        return
+    
     @performance_decorator
-    #Simulate ghosts chasing Pacman for the desired number of episodes, updating own q-tables along the way. It is assumed that Pacman will not move
-    def simulate_train(self, r_matrix:dict[int,dict[tuple[int,int],list[int]]], randomize_ghost_pos:bool, epsilon_delta:float, learn_rate:float, gamma:float, episode_count:int, max_steps:int = None, heartbeat_episode_freq:int = None, heartbeat_step_freq:int = None) -> list[float]:
+    #Simulate ghosts chasing Pacman for the desired number of episodes, learning along the way. It is assumed that Pacman will not move
+    #Every step goes through _choose and _add_transition, and training ends with _gradient_step, so other learners (see Linear_ghostAI) only override those and error computation
+    #error_mode 'full' recomputes error over the whole table every error_interval episodes (repeating the last value in between), 'incremental' keeps it updated as q-values change
+    #Epsilon decays over decay_episodes (default episode_count), then stays at start epsilon minus epsilon_delta
+    #If plateau_window is set, training stops early once the error changed by at most plateau_tolerance (relative to the last error) over the last plateau_window episodes, counting only episodes played after epsilon bottomed out. If time_budget is set, training stops after that many seconds (epsilon is logged, since it may still be decaying)
+    #Returns error list, one value per episode run (shorter than episode_count when stopped early)
+    def simulate_train(self, r_matrix:dict[int,dict[tuple[int,int],list[int]]], randomize_ghost_pos:bool, epsilon_delta:float, learn_rate:float, gamma:float, episode_count:int, max_steps:int = None, heartbeat_episode_freq:int = None, heartbeat_step_freq:int = None, error_mode:str = "full", error_interval:int = 1, plateau_window:int = None, plateau_tolerance:float = 0.001, time_budget:float = None, decay_episodes:int = None) -> list[float]:
+        if (error_mode not in ("full", "incremental")):
+            raise ValueError("Error mode can only be 'full' or 'incremental'")
+        if (error_interval < 1):
+            raise ValueError("Error interval must be at least 1")
+        if (self._is_policy):
+            raise ValueError("ERROR. Policy tables cannot be trained. Train a q-matrix and compile it instead")
+        if (plateau_window is not None) and (plateau_window < 2):
+            raise ValueError("Plateau window must be at least 2 episodes")
+        if (decay_episodes is None):
+            decay_episodes = episode_count
+        if (decay_episodes < 1):
+            raise ValueError("Decay episodes must be at least 1")
+        train_timestamp = time.perf_counter()
         heartbeat_acc:list[int] = [0,0]
         start_epsilon = self.epsilon
         start_pos = self.ghost_pos
         error_list:list[float] = []
 
+        #With indexed r-matrixes every reward lookup is done by integer indexes. Max future reward only depends on the r-table, so it is computed once
+        #Dense and sparse q-tables share rows with the r-table, so the row of the current state is already known
+        read_reward = None
+        shares_layout = (self._is_dense) or (self._is_sparse)
+        if (isinstance(r_matrix, INDEXED_SOURCES)):
+            r_table = self._check_r_layout(r_matrix)[self._player_pos] if (shares_layout) else r_matrix[self._player_pos]
+            if (isinstance(r_table, SparseTable)):
+                read_reward = r_table.value
+                indexed_r_max:list[int] = r_table.row_max().tolist()
+            else:
+                read_reward = r_table.data.item
+                indexed_r_max:list[int] = r_table.data.max(axis=1).tolist()
+            pair_index = r_table.pair_index
+        if (error_mode == "incremental"):
+            self._start_error_tracker(r_matrix)
+        error:float = None
+        metrics = get_metrics()
+
         for index in range(episode_count):
+            episode_timestamp = time.perf_counter()
             if (randomize_ghost_pos):
                 self.randomize_pos()
             else:
@@ -205,18 +342,20 @@ class GhostAI:
             step_count:int = 0
             heartbeat_acc[0] = 0
             while ( (self._lower_pos != self._player_pos) and (self._higher_pos != self._player_pos) ):
-                action = self.pick_action()
-                newPos_raw = self.parse_action(action)
-                newPos = list(newPos_raw)
-                newPos.sort()
-                newPos = tuple(newPos)
-
-                reward = r_matrix[self._player_pos][(self._lower_pos, self._higher_pos)][self.get_action_index(action)]
-                maxFuture = max(r_matrix[self._player_pos][newPos])
-                oldValue = self._q_matrix[self._player_pos][(self._lower_pos, self._higher_pos)][self.get_action_index(action)]
-                newValue = oldValue + learn_rate * (reward + gamma*maxFuture - oldValue)
+                action, features = self._choose(False)
+                newPos, _ = canonical_pair(self.parse_action(action))
 
-                self.update_q_value(self.get_action_index(action), round(newValue))
+                action_index = self.get_action_index(action)
+                if (read_reward is not None):
+                    next_index = pair_index(newPos)
+                    if (next_index == -1):
+                        raise KeyError(newPos)
+                    reward = read_reward(self._pair_index if (shares_layout) else pair_index((self._lower_pos, self._higher_pos)), action_index)
+                    maxFuture = indexed_r_max[next_index]
+                else:
+                    reward = r_matrix[self._player_pos][(self._lower_pos, self._higher_pos)][action_index]
+                    maxFuture = max(r_matrix[self._player_pos][newPos])
+                self._add_transition(action_index, features, reward + gamma*maxFuture, learn_rate)
                 self.update_self_pos(newPos)
 
                 #Monitor performance
@@ -229,24 +368,95 @@ class GhostAI:
                 if (max_steps is not None):
                     if (step_count >= max_steps):
                         print("\033[93m" + f"WARN. Max steps hit for Episode {index+1}" + "\033[0m")
+                        metrics.count("train.max_steps_hits")
                         break
-            #Update epsilon
-            self.epsilon = (index+1 - episode_count)**2 * (epsilon_delta/(episode_count**2)) + (start_epsilon - epsilon_delta)
+            #Update epsilon (it bottoms out at start_epsilon - epsilon_delta after decay_episodes, and stays there)
+            decay_step = min(index+1, decay_episodes)
+            self.epsilon = (decay_step - decay_episodes)**2 * (epsilon_delta/(decay_episodes**2)) + (start_epsilon - epsilon_delta)
             #Monitor episode performance
-            error = self.compute_error(r_matrix)
+            error_timestamp = time.perf_counter()
+            tracked_error = self._tracked_error() if (error_mode == "incremental") else None
+            if (tracked_error is not None):
+                error = tracked_error
+            elif ( (error is None) or ((index+1) % error_interval == 0) or (index+1 == episode_count) ):
+                error = self.compute_error(r_matrix)
             error_list.append(round(error,6))
+            metrics.record_time("train.error", time.perf_counter() - error_timestamp)
+            metrics.record_time("train.episode", time.perf_counter() - episode_timestamp)
+            metrics.observe("train.episode_steps", step_count)
+            metrics.count("train.steps", step_count)
+            metrics.count("train.episodes")
+            metrics.maybe_export()
             heartbeat_acc[1] += 1
             if (heartbeat_episode_freq is not None):
                 if (heartbeat_acc[1] >= heartbeat_episode_freq):
                     heartbeat_acc[1] = 0
                     print(f"INFO. Episode {index+1} successful. Epsilon: {round(self.epsilon,6)}. Error: {round(error,4)}.")
+            #Stop early on converged error or exhausted budget
+            stop_reason:str = None
+            if (plateau_window is not None) and (index+1 - decay_episodes >= plateau_window): #Only episodes played once epsilon bottomed out tell whether training converged
+                window = error_list[-plateau_window:]
+                if ( (max(window) - min(window)) <= plateau_tolerance * max(abs(error), 1e-12) ):
+                    stop_reason = f"error changed less than {plateau_tolerance*100}% over {plateau_window} episodes"
+            if (stop_reason is None) and (time_budget is not None) and (time.perf_counter() - train_timestamp >= time_budget):
+                stop_reason = f"time budget of {time_budget}s exhausted"
+            if (stop_reason is not None) and (index+1 < episode_count):
+                print(f"INFO. Training of target {self._player_pos} stopped after {index+1} episodes ({episode_count - index - 1} saved): {stop_reason}. Epsilon: {round(self.epsilon,6)}.")
+                if (index+1 < decay_episodes):
+                    print("\033[93m" + f"WARN. Epsilon of target {self._player_pos} was still decaying ({decay_episodes - index - 1} decay episodes left), so its q-table comes from exploring ghosts" + "\033[0m")
+                metrics.count("train.early_stops")
+                metrics.count("train.episodes_saved", episode_count - index - 1)
+                break
+        self._gradient_step(learn_rate) #Apply what is left of the last transitions
         self.update_self_pos(start_pos) #Restore previous position after simulation
         self.epsilon = start_epsilon #Restore previous epsilon
+        self._error_tracker = None
         return error_list
     
-    #Print map state to console, showing next action
+    @performance_decorator
+    #Same as simulate_train, but advancing batch_size independent episodes at once with NumPy. Only for dense matrixes. Returns error list (one value per episode)
+    def simulate_train_batch(self, r_matrix:DenseMatrix, randomize_ghost_pos:bool, epsilon_delta:float, learn_rate:float, gamma:float, episode_count:int, max_steps:int = None, batch_size:int = 1024, seed:int = None) -> list[float]:
+        if (not self._is_dense) or (not isinstance(r_matrix, DENSE_SOURCES)):
+            raise ValueError("ERROR. Batched training requires dense q-matrix and r-matrix (or reward provider)")
+        if (self._transitions is None):
+            self._transitions = build_transitions(self._topology, self._q_matrix)
+        pairs = np.asarray(self._q_matrix.ghost_pairs).reshape(-1, 2)
+        terminal = (pairs[:,0] == self._player_pos) | (pairs[:,1] == self._player_pos)
+        if (randomize_ghost_pos):
+            start_states = valid_start_states(self._q_matrix, self._player_pos)
+        else:
+            start_states = np.array([self._pair_index])
+        r_table = self._get_r_table(r_matrix)
+        error_list = train_batch(self._q_table, r_table, self._transitions, terminal, start_states, self.epsilon, epsilon_delta, learn_rate, gamma, episode_count, max_steps, batch_size, np.random.default_rng(seed))
+        get_metrics().count("train.episodes", episode_count)
+        return error_list
+    
+    @performance_decorator
+    #Alternative to simulate_train: solve the q-table of the current player position by value iteration over every state at once (see Batch_trainer.solve_q_table). Only for dense q-matrixes
+    #Q-values are rounded into the table, same as training. Returns the max value change of every sweep
+    def solve_value_iteration(self, r_matrix:DenseMatrix, gamma:float, tolerance:float = 0.5, max_iterations:int = 1000) -> list[float]:
+        if (not self._is_dense) or (not isinstance(r_matrix, INDEXED_SOURCES)):
+            raise ValueError("ERROR. Value iteration requires a dense q-matrix and an indexed r-matrix (dense, sparse or reward provider)")
+        if (self._transitions is None):
+            self._transitions = build_transitions(self._topology, self._q_matrix)
+        pairs = np.asarray(self._q_matrix.ghost_pairs).reshape(-1, 2)
+        terminal = (pairs[:,0] == self._player_pos) | (pairs[:,1] == self._player_pos)
+        q_table, delta_list = solve_q_table(self._get_r_table(r_matrix), self._transitions, terminal, gamma, tolerance, max_iterations)
+        if (delta_list[-1] > tolerance):
+            print("\033[93m" + f"WARN. Value iteration for target {self._player_pos} did not converge after {max_iterations} sweeps (last change {round(delta_list[-1],4)})" + "\033[0m")
+        self._q_table[:] = np.round(q_table)
+        get_metrics().count("train.sweeps", len(delta_list))
+        return delta_list
+    
+    #Print map state to console, showing next action. map_filename is a base r-matrix file (None draws the map from the topology)
     def print_state(self,  map_filename = BASE_PATH, action:tuple[int,int] = None, powerups:tuple[int,int] = None) -> None:
-        map = load_base(map_filename)
+        map = self._maps.get(map_filename)
+        if (map is None):
+            if (map_filename is None): #Drawn from the topology, for maps without base files
+                map = [0 if self._topology.is_open(index) else -1 for index in range(self._topology.cell_count)]
+            else:
+                map = load_base(map_filename)
+            self._maps[map_filename] = map
         acc = 0
         row = 0
         new_pos = None
@@ -295,50 +505,19 @@ class GhostAI:
                 row += 1
                 print()
 
+    #Advance a game by one time step: Pacman moves to player_new_pos first and, if not caught there, ghosts take action. Returns whether Pacman is still alive
+    def game_step(self, action:tuple[int,int], player_new_pos:int) -> bool:
+        self.update_player_pos(player_new_pos)
+        if (self._player_pos in self.ghost_pos):
+            return False
+        self.update_self_pos(self.parse_action(action))
+        return self._player_pos not in self.ghost_pos
+
     def simulate_game(self, resume_game:bool = False, map_filename = BASE_PATH, deploy_powerups:bool = False, game_epsilon:float = None) -> None:
         def parse_player_move(current_pos:int, action:int) -> int:
-            new_pos:int = -1
-            match action:
-                case -1: #Stay
-                    new_pos = current_pos
-                case 0: #Move north
-                    candidate = current_pos - self._dimension[0]
-                    if (candidate < 0):
-                        new_pos = -1
-                    elif (candidate in self._wall_index):
-                        new_pos = -1
-                    else:
-                        new_pos = candidate
-                case 1: #Move east
-                    candidate = current_pos + 1
-                    if ( (current_pos % self._dimension[0]) == (self._dimension[0] - 1) ):
-                        new_pos = -1
-                    elif (candidate in self._wall_index):
-                        new_pos = -1
-                    else:
-                        new_pos = candidate
-                case 2: #Move south
-                    candidate = current_pos + self._dimension[0]
-                    if (candidate > ((self._dimension[0]*self._dimension[1])-1)):
-                        new_pos = -1
-                    elif (candidate in self._wall_index):
-                        new_pos = -1
-                    else:
-                        new_pos = candidate
-                case 3: #Move west
-                    candidate = current_pos - 1
-                    if ( (current_pos % self._dimension[0]) == (0) ):
-                        new_pos = -1
-                    elif (candidate in self._wall_index):
-                        new_pos = -1
-                    else:
-                        new_pos = current_pos - 1
-            return new_pos
-        
-        def is_collision() -> bool:
-            if self._player_pos in self.ghost_pos:
-                return True
-            return False
+            if (action < -1) or (action > 3): #Not a move
+                return -1
+            return self._topology.move(current_pos, action)
         
         old_epsilon = self.epsilon
         if (game_epsilon is not None):
@@ -374,12 +553,7 @@ class GhostAI:
                 player_new_pos = parse_player_move(self._player_pos, int(player_move))
                 step += 1 #Move to next timestep
 
-                self.update_player_pos(player_new_pos)
-                if (is_collision()): #to-do Consider powerup state
-                    is_alive = False
-                else:
-                    self.update_self_pos(self.parse_action(action))
-                    is_alive = not is_collision() #to-do Consider powerup state
+                is_alive = self.game_step(action, player_new_pos) #to-do Consider powerup state
                 if (not is_alive):
                     print("\033[91m" + "\tYOU LOST" + "\033[0m")
                     print(f"Survived for {step} time steps")
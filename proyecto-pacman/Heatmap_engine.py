@@ -0,0 +1,111 @@
+import numpy as np
+from Maze_topology import get_topology
+from Matrix_storage import SWAPPED_ACTIONS, fold_ghost_pairs
+
+# NOTE - Since heat decays linearly, the heat of a square is max(0, value - decay*distance), where distance is the shortest path to the player that does not cross walls nor ghosts. This matches Rmatrix_populator.populate_matrix
+
+DEFAULT_CHUNK_SIZE = 4096 #Ghost pairs processed at once. Bounds memory to roughly chunk_size*cells bytes per temporary array
+
+#Build heatmaps for every given ghost pair with the player standing on player_pos. Returns array shaped (pairs, cells), where walls keep the base value (-1)
+def build_player_heatmaps(player_pos:int, ghost_pairs:np.ndarray, dimension:tuple[int,int], base_matrix:list[int], value:int = 400, decay:int = 50, chunk_size:int = DEFAULT_CHUNK_SIZE, dtype = np.int32) -> np.ndarray:
+    if (decay < 0):
+        raise ValueError("Decay must not be negative")
+    base = np.asarray(base_matrix, dtype=dtype)
+    if (np.any((base != 0) & (base != -1))):
+        raise ValueError("Base matrix must only contain open squares (0) and walls (-1)")
+    ghost_pairs = np.asarray(ghost_pairs, dtype=np.int64).reshape(-1, 2)
+    first_index, inverse, _ = fold_ghost_pairs(ghost_pairs)
+    if (len(first_index) < len(ghost_pairs)): #Swapped pairs share the heatmap of their canonical pair, so each unordered pair is only built once
+        return build_player_heatmaps(player_pos, ghost_pairs[first_index], dimension, base_matrix, value, decay, chunk_size, dtype)[inverse]
+    cell_count = dimension[0]*dimension[1]
+
+    #Neighbors only account for map borders, walls are read from the base matrix (same as populate_matrix). Illegal moves point to an extra, always empty, column
+    neighbors = get_topology(dimension).neighbors.astype(np.int64)
+    neighbors = np.where(neighbors == -1, cell_count, neighbors)
+    is_open = (base != -1)
+
+    heatmaps = np.empty((len(ghost_pairs), cell_count), dtype=dtype)
+    for start in range(0, len(ghost_pairs), chunk_size):
+        pairs = ghost_pairs[start:start + chunk_size]
+        heatmaps[start:start + len(pairs)] = _build_chunk(player_pos, pairs, neighbors, base, is_open, value, decay)
+    return heatmaps
+
+#Bounded breadth-first search from the player, for a chunk of ghost pairs at once. Works cell-major (cells, pairs), so every move is a contiguous row gather
+def _build_chunk(player_pos:int, pairs:np.ndarray, neighbors:np.ndarray, base:np.ndarray, is_open:np.ndarray, value:int, decay:int) -> np.ndarray:
+    pair_count = len(pairs)
+    cell_count = len(base)
+    columns = np.arange(pair_count)
+    heat = np.repeat(base[:, None], pair_count, axis=1)
+
+    passable = np.repeat(is_open[:, None], pair_count, axis=1) #Do not spread past ghosts nor walls
+    passable[pairs[:,0], columns] = False
+    passable[pairs[:,1], columns] = False
+    if (value <= 0) or (not is_open[player_pos]):
+        return heat.T
+
+    #frontier has an extra row so illegal moves (pointing at cell_count) never spread
+    frontier = np.zeros((cell_count + 1, pair_count), dtype=bool)
+    frontier[player_pos] = passable[player_pos]
+    visited = frontier[:cell_count].copy()
+    heat[player_pos][frontier[player_pos]] = value
+
+    current_value = value
+    while ( (current_value - decay) > 0 ):
+        current_value -= decay
+        reached = frontier[neighbors[:,0]]
+        for direction in range(1, neighbors.shape[1]):
+            reached |= frontier[neighbors[:,direction]]
+        reached &= passable
+        reached &= ~visited
+        if (not reached.any()):
+            break
+        visited |= reached
+        heat[reached] = current_value
+        frontier[:cell_count] = reached
+    return heat.T
+
+#Build reward rows for every given ghost pair out of its heatmaps. Returns array shaped (pairs, 16), same values as Rmatrix_populator.to_reward_matrix. Actions sorted by sequence (0,0), (0,1), (0,2), ...
+#If time_multiplier is higher than zero and adjacent_heatmaps (heatmap arrays of the player positions on time t+1) is not None, compounds reward for time t with reward for time t+1
+def build_player_rewards(heatmaps:np.ndarray, ghost_pairs:np.ndarray, dimension:tuple[int,int], stay_prize:int = 1000, time_multiplier:float = -1.0, adjacent_heatmaps:list[np.ndarray] = None, dtype = np.int32) -> np.ndarray:
+    ghost_pairs = np.asarray(ghost_pairs, dtype=np.int64).reshape(-1, 2)
+    first_index, inverse, swapped = fold_ghost_pairs(ghost_pairs)
+    if (len(first_index) < len(ghost_pairs)): #Rows of swapped pairs are the rows of their canonical pair through the action-swap mapping, so each unordered pair is only built once
+        canonical_pairs = np.sort(ghost_pairs[first_index], axis=1)
+        canonical_adjacent = None if (adjacent_heatmaps is None) else [future_heatmaps[first_index] for future_heatmaps in adjacent_heatmaps]
+        rewards = build_player_rewards(heatmaps[first_index], canonical_pairs, dimension, stay_prize, time_multiplier, canonical_adjacent, dtype)[inverse]
+        rewards[swapped] = rewards[swapped][:, SWAPPED_ACTIONS]
+        return rewards
+    neighbors = get_topology(dimension).neighbors #Only map borders, walls are read from the heatmaps
+    new_g1 = np.repeat(neighbors[ghost_pairs[:,0]], 4, axis=1) #Action index is action_g1*4 + action_g2
+    new_g2 = np.tile(neighbors[ghost_pairs[:,1]], (1, 4))
+    rows = np.arange(len(ghost_pairs))[:, None]
+
+    #Out-of-bounds moves (-1) read the last square of the heatmap, same as to_reward_matrix does, so they are only illegal if that square is a wall
+    heat_g1 = heatmaps[rows, new_g1].astype(np.int64)
+    heat_g2 = heatmaps[rows, new_g2].astype(np.int64)
+    legal = (heat_g1 != -1) & (heat_g2 != -1) & (new_g1 != new_g2) #Ghosts cannot land on the same square
+    rewards = np.where(legal, heat_g1 + heat_g2, -1)
+    captured = (heatmaps.max(axis=1) < 1)[:, None] #There are no rewards on map. Thus, Pacman was captured and all legal actions get the max-prize
+    rewards[captured & legal] = stay_prize
+
+    if ( (time_multiplier > 0) and (adjacent_heatmaps is not None) ):
+        for future_heatmaps in adjacent_heatmaps:
+            future_reward = future_heatmaps[rows, new_g1].astype(np.int64) + future_heatmaps[rows, new_g2]
+            rewards += np.where(legal, np.round(time_multiplier * future_reward).astype(np.int64), 0)
+    elif ( (time_multiplier > 0) or (adjacent_heatmaps is not None) ):
+        print('\033[93m' + "WARN" + "\033[0m" + ". Time multiplier (must be higher than zero) or adjacent states (must be not None) not valid. Ignoring time projection.")
+    return rewards.astype(dtype)
+
+#Build reward rows of a player position straight from the map, chunk_size ghost pairs at a time. Heatmaps of the player position (and of adjacent_positions, where the player may stand on time t+1) are only ever held for a single chunk, so memory does not grow with map size
+#Returns array shaped (pairs, 16), same values as build_player_rewards over full heatmap arrays
+def build_reward_rows(player_pos:int, adjacent_positions:list[int], ghost_pairs:np.ndarray, dimension:tuple[int,int], base_matrix:list[int], value:int = 400, decay:int = 50, stay_prize:int = 1000, time_multiplier:float = -1.0, chunk_size:int = DEFAULT_CHUNK_SIZE, dtype = np.int32) -> np.ndarray:
+    ghost_pairs = np.asarray(ghost_pairs, dtype=np.int64).reshape(-1, 2)
+    rewards = np.empty((len(ghost_pairs), 16), dtype=dtype)
+    for start in range(0, len(ghost_pairs), chunk_size):
+        pairs = ghost_pairs[start:start + chunk_size]
+        heatmaps = build_player_heatmaps(player_pos, pairs, dimension, base_matrix, value, decay, chunk_size)
+        adjacent_heatmaps = None
+        if (time_multiplier > 0):
+            adjacent_heatmaps = [build_player_heatmaps(position, pairs, dimension, base_matrix, value, decay, chunk_size) for position in adjacent_positions]
+        rewards[start:start + len(pairs)] = build_player_rewards(heatmaps, pairs, dimension, stay_prize, time_multiplier, adjacent_heatmaps, dtype)
+    return rewards
@@ -0,0 +1,346 @@
+import os
+import json
+import random
+import threading
+import numpy as np
+from GhostAI import GhostAI, DEFAULT_SAVE_PATH, DENSE_SOURCES
+from Maze_topology import MazeTopology, get_topology
+from Matrix_storage import ACTION_COUNT
+from Performance_util import get_timestamp, get_metrics
+
+#Used to monitor performance
+import time
+
+LINEAR_EXTENSION = ".rql"
+LINEAR_VERSION = 1
+NEARNESS_RANGE = 8 #Squares away from Pacman where ghosts stop counting as near (same reach as the 400/50 heatmaps)
+DEFAULT_BATCH_SIZE = 256 #Transitions per gradient step
+ERROR_CHUNK_SIZE = 4096 #Ghost pairs evaluated at once by compute_error
+FEATURE_NAMES:list[str] = [
+    "bias",
+    "closest_distance", #Shortest path from the closest ghost to Pacman, after moving (normalized by map diameter)
+    "farthest_distance",
+    "closest_nearness", #max(0, 1 - distance/NEARNESS_RANGE), so near ghosts weigh more than far ones
+    "farthest_nearness",
+    "approach", #Squares both ghosts got closer to Pacman (mean, -1 to 1)
+    "both_approach", #Both ghosts got closer to Pacman
+    "direction", #Ghosts moving in Pacman's direction on the grid, regardless of walls (mean of manhattan distance change signs)
+    "separation", #Shortest path between ghosts, after moving (normalized by map diameter)
+    "flank", #Ghosts come from different sides: no square next to Pacman leads towards both of them
+    "escape", #Fraction of Pacman's squares (its own and its moves) at least 2 steps away from both ghosts
+    "capture", #A ghost lands on Pacman
+]
+FEATURE_COUNT = len(FEATURE_NAMES)
+
+# NOTE - A linear model scores every (state, joint action) as features . weights, with features built from the shortest paths of the maze (see FEATURE_NAMES). It holds FEATURE_COUNT weights whatever the state count, so maps too large for q-matrixes can still be trained and played
+# Training runs GhostAI.simulate_train (same episodes and targets: reward plus gamma times the best reward of the next state), but transitions are gathered into batches and weights are fitted with a gradient step per batch
+
+#Feature builder for a maze. Built once per topology and shared
+class LinearFeatures:
+    def __init__(self, topology:MazeTopology):
+        distances = topology.distances.astype(np.float64)
+        diameter = max(float(distances.max()), 1)
+        self._distances = np.where(distances < 0, diameter + 1, distances) #Unreachable squares count as farther than anything reachable
+        self._scale = 1 / diameter
+        self._neighbors = topology.neighbors.astype(np.int64)
+        cells = np.arange(topology.cell_count)
+        self._columns = cells % topology.dimension[0]
+        self._rows = cells // topology.dimension[0]
+        self._player_squares:dict[int,np.ndarray] = dict()
+        self._mask_actions:dict[int,np.ndarray] = dict()
+
+    #Pacman's square and every square it can move to
+    def player_squares(self, player_pos:int) -> np.ndarray:
+        squares = self._player_squares.get(player_pos)
+        if (squares is None):
+            moves = self._neighbors[player_pos]
+            squares = np.concatenate([[player_pos], moves[moves != -1]])
+            self._player_squares[player_pos] = squares
+        return squares
+
+    #Legal joint actions of a mask as an array shaped (actions, 2), in action index order
+    def mask_actions(self, mask:int) -> np.ndarray:
+        actions = self._mask_actions.get(mask)
+        if (actions is None):
+            indexes = [index for index in range(ACTION_COUNT) if (mask >> index) & 1]
+            actions = np.asarray([(index // 4, index % 4) for index in indexes], dtype=np.int64).reshape(-1, 2)
+            self._mask_actions[mask] = actions
+        return actions
+
+    #Positions of both ghosts after the given joint actions (arrays of the same length)
+    def move(self, first:np.ndarray, second:np.ndarray, actions:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return self._neighbors[first, actions[...,0]], self._neighbors[second, actions[...,1]]
+
+    #Features of (state, joint action) rows with Pacman on player_pos. Ghost positions before (first, second) and after (new_first, new_second) moving are arrays of the same length. Returns array shaped (rows, FEATURE_COUNT)
+    def build(self, player_pos:int, first:np.ndarray, second:np.ndarray, new_first:np.ndarray, new_second:np.ndarray) -> np.ndarray:
+        to_player = self._distances[player_pos]
+        new_first_distance = to_player[new_first]
+        new_second_distance = to_player[new_second]
+        closest = np.minimum(new_first_distance, new_second_distance)
+        farthest = np.maximum(new_first_distance, new_second_distance)
+        first_delta = to_player[first] - new_first_distance
+        second_delta = to_player[second] - new_second_distance
+        def manhattan(position:np.ndarray) -> np.ndarray:
+            return np.abs(self._columns[position] - self._columns[player_pos]) + np.abs(self._rows[position] - self._rows[player_pos])
+
+        squares = self.player_squares(player_pos)
+        first_from_squares = self._distances[squares][:, new_first] #(squares, rows)
+        second_from_squares = self._distances[squares][:, new_second]
+        towards_both = (first_from_squares < new_first_distance) & (second_from_squares < new_second_distance)
+
+        features = np.empty((len(new_first), FEATURE_COUNT), dtype=np.float64)
+        features[:,0] = 1
+        features[:,1] = closest * self._scale
+        features[:,2] = farthest * self._scale
+        features[:,3] = np.maximum(0, 1 - closest / NEARNESS_RANGE)
+        features[:,4] = np.maximum(0, 1 - farthest / NEARNESS_RANGE)
+        features[:,5] = (first_delta + second_delta) / 2
+        features[:,6] = (first_delta > 0) & (second_delta > 0)
+        features[:,7] = (np.sign(manhattan(first) - manhattan(new_first)) + np.sign(manhattan(second) - manhattan(new_second))) / 2
+        features[:,8] = self._distances[new_first, new_second] * self._scale
+        features[:,9] = ~towards_both[1:].any(axis=0) #Pacman's own square never leads towards a ghost
+        features[:,10] = (np.minimum(first_from_squares, second_from_squares) >= 2).mean(axis=0)
+        features[:,11] = (new_first == player_pos) | (new_second == player_pos)
+        return features
+
+_feature_cache:dict[MazeTopology,LinearFeatures] = dict()
+
+#Get shared feature builder for the given topology, building it on first use
+def get_features(topology:MazeTopology) -> LinearFeatures:
+    features = _feature_cache.get(topology)
+    if (features is None):
+        features = LinearFeatures(topology)
+        _feature_cache[topology] = features
+    return features
+
+#Linear q-function: weights over FEATURE_NAMES
+class LinearModel:
+    def __init__(self, weights:np.ndarray = None, trained_on:tuple[int,int] = None):
+        if (weights is None):
+            weights = np.zeros(FEATURE_COUNT, dtype=np.float64)
+        weights = np.asarray(weights, dtype=np.float64)
+        if (weights.shape != (FEATURE_COUNT,)):
+            raise ValueError(f"ERROR. Linear models need {FEATURE_COUNT} weights, got {weights.shape}")
+        self._weights = weights
+        self._trained_on = None if (trained_on is None) else tuple(trained_on)
+
+    @property
+    def weights(self) -> np.ndarray:
+        return self._weights
+    @property
+    def trained_on(self) -> tuple[int,int]:
+        return self._trained_on
+    @trained_on.setter
+    def trained_on(self, dimension:tuple[int,int]):
+        self._trained_on = tuple(dimension)
+    @property
+    def nbytes(self) -> int:
+        return self._weights.nbytes
+
+    #Add a step (gradient times learn rate) to the weights
+    def update(self, step:np.ndarray) -> None:
+        self._weights += step
+
+    #Q-values of feature rows
+    def predict(self, features:np.ndarray) -> np.ndarray:
+        return features @ self._weights
+
+#Save a linear model as a JSON file. If it already exists, overwrites it.
+def save_linear_model(model:LinearModel, filename:str) -> None:
+    content = {"version": LINEAR_VERSION, "features": FEATURE_NAMES, "nearness_range": NEARNESS_RANGE, "trained_on": None if (model.trained_on is None) else list(model.trained_on), "weights": model.weights.tolist()}
+    with open(filename, 'w') as file:
+        json.dump(content, file, indent=1)
+    print(f"Linear model saved successfully at {filename}")
+
+def load_linear_model(filename:str) -> LinearModel:
+    with open(filename, 'r') as file:
+        content = json.load(file)
+    if (content.get("version") != LINEAR_VERSION):
+        raise ValueError(f"ERROR. File {filename} has linear model version {content.get('version')}, only version {LINEAR_VERSION} is supported")
+    if (content["features"] != FEATURE_NAMES) or (content["nearness_range"] != NEARNESS_RANGE):
+        raise ValueError(f"ERROR. File {filename} was trained over other features")
+    return LinearModel(np.asarray(content["weights"]), content["trained_on"])
+
+#Linear model files are recognized by their extension
+def is_linear_file(filename:str) -> bool:
+    return filename.endswith(LINEAR_EXTENSION)
+
+#GhostAI whose q-values come from a linear model instead of a q-matrix. Same interface (pick_action, game_step, simulate_train, save_matrix), so games and evaluations run it unchanged
+class LinearGhostAI(GhostAI):
+    def __init__(self, initial_state:tuple[int,int,int], wall_index:list[int], dimension:tuple[int,int], model:LinearModel, epsilon:float, topology:MazeTopology = None, batch_size:int = DEFAULT_BATCH_SIZE):
+        if (not isinstance(model, LinearModel)):
+            raise ValueError("ERROR. LinearGhostAI requires a linear model, use GhostAI for q-matrixes")
+        if (batch_size < 1):
+            raise ValueError("Batch size must be at least 1")
+        super().__init__(initial_state, wall_index, dimension, model, epsilon, topology)
+        self._features = get_features(self._topology)
+        self._batch_size = batch_size
+        self._batch_features = np.empty((batch_size, FEATURE_COUNT), dtype=np.float64)
+        self._batch_targets = np.empty(batch_size, dtype=np.float64)
+        self._batch_fill = 0
+        self._batch_error:float = None #Normalized error of the last batch, before its gradient step
+
+    @property
+    def model(self) -> LinearModel:
+        return self._q_matrix
+
+    #Legal actions of the current state (array shaped (actions, 2)) and their features
+    def _action_features(self) -> tuple[np.ndarray, np.ndarray]:
+        actions = self._features.mask_actions(self._topology.joint_mask((self._lower_pos, self._higher_pos)))
+        new_lower, new_higher = self._features.move(self._lower_pos, self._higher_pos, actions)
+        lower = np.full(len(actions), self._lower_pos)
+        higher = np.full(len(actions), self._higher_pos)
+        return actions, self._features.build(self._player_pos, lower, higher, new_lower, new_higher)
+
+    #Pick an action with e-greedy. Returns (action, its feature row)
+    def _choose(self, ignore_epsilon:bool) -> tuple[tuple[int,int], np.ndarray]:
+        actions, features = self._action_features()
+        if (len(actions) == 0):
+            raise ValueError(f"ERROR. There are no legal actions for state {self.state}")
+        if ( (not ignore_epsilon) and (random.random() < self.epsilon) ): #Pick random action
+            index = random.randrange(len(actions))
+        else: #Pick optimal choice (ties broken at random)
+            values = self.model.predict(features)
+            index = random.choice(np.flatnonzero(values >= values.max()).tolist())
+        return (int(actions[index,0]), int(actions[index,1])), features[index]
+
+    #Picks an action tuple from the available legal actions using e-greedy
+    def pick_action(self, ignore_epsilon:bool = False) -> tuple[int,int]:
+        return self._choose(ignore_epsilon)[0]
+
+    #Q-values of every joint action of the current state (illegal actions are -inf)
+    def get_q_values(self) -> list[float]:
+        actions, features = self._action_features()
+        values = np.full(ACTION_COUNT, -np.inf)
+        values[actions[:,0]*4 + actions[:,1]] = self.model.predict(features)
+        return values.tolist()
+
+    def update_q_value(self, action_index:int, new_value:int) -> None:
+        raise ValueError("ERROR. Linear models have no q-values to update, they are fitted by simulate_train")
+
+    #Add a transition to the batch, taking a gradient step once it is full. Targets are the same as GhostAI.simulate_train's, but learn_rate is the gradient step size
+    def _add_transition(self, action_index:int, features:np.ndarray, target:float, learn_rate:float) -> None:
+        self._batch_features[self._batch_fill] = features
+        self._batch_targets[self._batch_fill] = target
+        self._batch_fill += 1
+        if (self._batch_fill >= self._batch_size):
+            self._gradient_step(learn_rate)
+
+    #Fit weights to the gathered transitions with a single gradient step over the mean squared error
+    def _gradient_step(self, learn_rate:float) -> None:
+        if (self._batch_fill == 0):
+            return
+        features = self._batch_features[:self._batch_fill]
+        targets = self._batch_targets[:self._batch_fill]
+        residuals = targets - self.model.predict(features)
+        self._batch_error = float(np.abs(residuals).mean() / max(np.abs(targets).max(), 1))
+        self.model.update(learn_rate * (features.T @ residuals) / self._batch_fill)
+        self.model.trained_on = self._dimension
+        self._batch_fill = 0
+        get_metrics().count("train.gradient_steps")
+
+    #Incremental error of linear models is the normalized error of the last gradient step (no table walk), so there is nothing to track
+    def _start_error_tracker(self, r_matrix) -> None:
+        return None
+    def _tracked_error(self) -> float:
+        return self._batch_error
+
+    #Same error as GhostAI.compute_error (normalized difference against the r-table of the current player position), with q-values predicted by the model a chunk of ghost pairs at a time
+    def compute_error(self, r_matrix) -> float:
+        if (not isinstance(r_matrix, DENSE_SOURCES)):
+            raise ValueError("ERROR. Linear models compute error against dense r-matrixes (dense, shards or rewards on demand)")
+        r_table = r_matrix[self._player_pos].data
+        pair_array = np.asarray(r_matrix.ghost_pairs, dtype=np.int64).reshape(-1, 2)
+        legal = ((self._topology.pair_masks(pair_array)[:, None].astype(np.uint32) >> np.arange(ACTION_COUNT, dtype=np.uint32)) & 1).astype(bool)
+        all_actions = np.asarray([(index // 4, index % 4) for index in range(ACTION_COUNT)], dtype=np.int64)
+        error = 0.0
+        for start in range(0, len(pair_array), ERROR_CHUNK_SIZE):
+            pairs = pair_array[start:start + ERROR_CHUNK_SIZE]
+            chunk_legal = legal[start:start + ERROR_CHUNK_SIZE]
+            rows, columns = np.nonzero(chunk_legal)
+            new_first, new_second = self._features.move(pairs[rows,0], pairs[rows,1], all_actions[columns])
+            q_table = np.zeros(chunk_legal.shape, dtype=np.float64)
+            q_table[rows, columns] = self.model.predict(self._features.build(self._player_pos, pairs[rows,0], pairs[rows,1], new_first, new_second))
+            chunk_r = np.asarray(r_table[start:start + ERROR_CHUNK_SIZE], dtype=np.float64)
+            max_q = np.maximum(q_table.max(axis=1, keepdims=True), 1)
+            max_r = np.maximum(chunk_r.max(axis=1, keepdims=True), 1)
+            counted = ~( (chunk_r == -1) & (q_table == 0) ) #Only compute error for legal moves or 'legalized' illegal ones
+            error += float(np.abs(chunk_r/max_r - q_table/max_q)[counted].sum())
+        return error
+
+    #Saves current model to file (background saves are written right away, the model is tiny)
+    def save_matrix(self, filename:str = None, background:bool = False) -> threading.Thread:
+        if (filename is None):
+            filename = DEFAULT_SAVE_PATH + "GhostAI_Linear_" + get_timestamp() + LINEAR_EXTENSION
+        save_linear_model(self.model, filename)
+        return None
+    def save_table(self, filename:str = None):
+        raise ValueError("ERROR. Linear models have no tables, use save_matrix")
+
+#Train the linear model of ai_brain against every target position, in the given order (weights are shared, so every target refines the same model). train_args are the simulate_train arguments after randomize_ghost_pos
+#Returns error lists by target position
+def train_linear(ai_brain:LinearGhostAI, r_matrix, target_positions:list[int], train_args:tuple, seed:int = None, verbose:bool = True) -> dict[int,list[float]]:
+    timestamp = time.time()
+    if (seed is not None):
+        random.seed(seed)
+    error_lists:dict[int,list[float]] = dict()
+    for count, position in enumerate(target_positions):
+        ai_brain.update_player_pos(position)
+        error_lists[position] = ai_brain.simulate_train(r_matrix, True, *train_args)
+        if (verbose) and ( ((count+1) % max(1, len(target_positions)//10) == 0) or (count+1 == len(target_positions)) ):
+            print(f"Linear training: {count+1}/{len(target_positions)} targets done. Last error: {error_lists[position][-1]} (in {round(time.time() - timestamp, 4)}s)")
+    return error_lists
+
+#Evaluate models (linear or tabular files) with Game_evaluator under the same games, and print capture rates side by side. Returns the reports
+def compare_models(paths:list[str], wall_index:list[int], dimension:tuple[int,int], game_count:int = 1000, policy:str = "flee", workers:int = 1, seed:int = 0) -> list[dict]:
+    from Game_evaluator import evaluate
+    reports:list[dict] = []
+    for path in paths:
+        report = evaluate(path, wall_index, game_count, policy, "random", 200, 0, workers, seed, dimension)
+        report["file_mb"] = round(os.path.getsize(path) / 2**20, 4)
+        reports.append(report)
+    print(f"{'model':<48} {'capture rate':>12} {'steps p50':>10} {'games/s':>10} {'file MB':>10}")
+    for report in reports:
+        print(f"{os.path.basename(report['matrix']):<48} {report['capture_rate']:>12} {str(report.get('steps', {}).get('p50')):>10} {report['games_per_second']:>10} {report['file_mb']:>10}")
+    return reports
+
+def main(argv:list[str] = None) -> None:
+    import argparse
+    from Agent_trainer import REWARD_SETTINGS
+    from Map_resources import MAP_PATH, load_map
+    from Reward_provider import RewardProvider
+    parser = argparse.ArgumentParser(description="Train a linear (feature-based) ghost model and compare its capture rate against tabular q-matrixes")
+    parser.add_argument("--map", default=MAP_PATH)
+    parser.add_argument("--load", default=None, help="Evaluate this linear model instead of training a new one")
+    parser.add_argument("--output", default=None, help=f"Trained model path (default {DEFAULT_SAVE_PATH}GhostAI_Linear_<timestamp>{LINEAR_EXTENSION})")
+    parser.add_argument("--episodes", type=int, default=100, help="Episodes per target position")
+    parser.add_argument("--max-steps", type=int, default=300)
+    parser.add_argument("--learn-rate", type=float, default=0.05)
+    parser.add_argument("--gamma", type=float, default=0.15)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--compare", nargs="*", default=[], help="Tabular q-matrixes (or policy tables) to evaluate alongside")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--policy", default="flee", help="Pacman policy of evaluation games")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    dimension, base_map, walls = load_map(args.map)
+
+    model_path = args.load
+    if (model_path is None):
+        topology = get_topology(dimension, walls)
+        r_matrix = RewardProvider(dimension, base_map, walls, **REWARD_SETTINGS) #Reward tables are built on demand, one target at a time
+        ai_brain = LinearGhostAI((79,82,topology.open_cells[0]), walls, dimension, LinearModel(), 1, topology, args.batch_size)
+        targets = list(topology.open_cells)
+        random.Random(args.seed).shuffle(targets) #Spread targets over the map, so the model does not drift towards the last region trained
+        train_linear(ai_brain, r_matrix, targets, (0.7, args.learn_rate, args.gamma, args.episodes, args.max_steps, None, None, "incremental"), args.seed)
+        model_path = args.output
+        if (model_path is None):
+            os.makedirs(DEFAULT_SAVE_PATH, exist_ok=True)
+            model_path = DEFAULT_SAVE_PATH + "GhostAI_Linear_" + get_timestamp() + LINEAR_EXTENSION
+        ai_brain.save_matrix(model_path)
+        print("Weights: " + ", ".join(f"{name} {round(weight, 3)}" for name, weight in zip(FEATURE_NAMES, ai_brain.model.weights)))
+    compare_models([model_path] + args.compare, walls, dimension, args.games, args.policy, args.workers, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import json
+import random
+import asyncio
+import numpy as np
+from Maze_topology import MazeTopology, get_topology
+from Game_evaluator import POLICIES
+from Game_server import DEFAULT_HOST, DEFAULT_PORT, PROTOCOL_VERSION
+
+#Used to monitor performance
+import time
+
+DEFAULT_SESSIONS = 200
+DEFAULT_GAMES = 5 #Games per session
+CONNECT_TIMEOUT = 30.0 #Seconds
+
+# NOTE - Every session is a bot on its own connection, playing games with a Game_evaluator policy as fast as the server answers. Latency is measured per MOVE, from sending the request to reading its reply (so it includes the ghosts decision, the network and the event loops of both ends)
+# Bots run on the same event loop, so on a single box the load test competes with the server for CPU. Numbers are a lower bound of what the server sustains
+
+#Bot results, shared by every session
+class LoadResults:
+    def __init__(self):
+        self.latencies:list[float] = []
+        self.games:int = 0
+        self.captures:int = 0
+        self.escapes:int = 0
+        self.errors:list[str] = []
+
+#Read a reply line, failing on errors and closed connections
+async def _read_reply(reader:asyncio.StreamReader) -> list[str]:
+    line = await reader.readline()
+    if (line == b""):
+        raise ConnectionError("Connection closed by the server")
+    words = line.decode().split()
+    if (words == []) or (words[0] == "ERROR"):
+        raise ValueError(f"ERROR. Server replied '{line.decode().strip()}'")
+    return words
+
+#Play game_count games on a new connection
+async def _run_session(host:str, port:int, topology:MazeTopology, distances:np.ndarray, policy, game_count:int, results:LoadResults) -> None:
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), CONNECT_TIMEOUT)
+    try:
+        hello = await _read_reply(reader)
+        if (hello[0] != "HELLO") or (int(hello[1]) != PROTOCOL_VERSION):
+            raise ValueError(f"ERROR. Unexpected greeting '{' '.join(hello)}'")
+        if ( (int(hello[2]), int(hello[3])) != topology.dimension ):
+            raise ValueError(f"ERROR. Server plays on a {hello[2]}x{hello[3]} map, not {topology.dimension[0]}x{topology.dimension[1]}")
+        for _ in range(game_count):
+            writer.write(b"START\n")
+            reply = await _read_reply(reader)
+            while (reply[0] == "STATE"):
+                ghost_pos, player_pos = (int(reply[1]), int(reply[2])), int(reply[3])
+                move = policy(player_pos, ghost_pos, topology, distances)
+                timestamp = time.perf_counter()
+                writer.write(f"MOVE {move}\n".encode())
+                reply = await _read_reply(reader)
+                results.latencies.append(time.perf_counter() - timestamp)
+            results.games += 1
+            if (reply[0] == "CAUGHT"):
+                results.captures += 1
+            elif (reply[0] == "ESCAPED"):
+                results.escapes += 1
+            else:
+                raise ValueError(f"ERROR. Unexpected reply '{' '.join(reply)}'")
+        writer.write(b"QUIT\n")
+        await reader.readline()
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+#Ask the server for its stats on a separate connection
+async def fetch_server_stats(host:str, port:int) -> dict:
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), CONNECT_TIMEOUT)
+    try:
+        await _read_reply(reader)
+        writer.write(b"STATS\nQUIT\n")
+        reply = await reader.readline()
+        return json.loads(reply.decode().split(" ", 1)[1])
+    finally:
+        writer.close()
+
+#Run session_count bots at once, each playing game_count games against the server. Returns the load test report
+async def run_load_test(host:str, port:int, wall_index:list[int], dimension:tuple[int,int], session_count:int = DEFAULT_SESSIONS, game_count:int = DEFAULT_GAMES, policy:str = "flee", seed:int = 0) -> dict:
+    if (policy not in POLICIES):
+        raise ValueError(f"Policy must be one of {list(POLICIES.keys())}")
+    if (session_count < 1) or (game_count < 1):
+        raise ValueError("At least one session and one game are needed")
+    random.seed(seed)
+    topology = get_topology(dimension, wall_index)
+    distances = topology.distances
+    results = LoadResults()
+    timestamp = time.perf_counter()
+    outcomes = await asyncio.gather(*(_run_session(host, port, topology, distances, POLICIES[policy], game_count, results) for _ in range(session_count)), return_exceptions=True)
+    elapsed = time.perf_counter() - timestamp
+    results.errors = [f"{type(outcome).__name__}: {outcome}" for outcome in outcomes if isinstance(outcome, BaseException)]
+
+    latencies = np.asarray(results.latencies, dtype=np.float64) * 1000
+    report = {"host": host, "port": port, "sessions": session_count, "games_per_session": game_count, "policy": policy, "seed": seed}
+    report.update({"games": results.games, "captures": results.captures, "escapes": results.escapes, "failed_sessions": len(results.errors), "moves": len(latencies), "seconds": round(elapsed, 4)})
+    report["moves_per_second"] = round(len(latencies) / elapsed, 3) if (elapsed > 0) else None
+    if (len(latencies) > 0):
+        report["latency_ms"] = {"mean": round(float(latencies.mean()), 4), "p50": round(float(np.percentile(latencies, 50)), 4), "p90": round(float(np.percentile(latencies, 90)), 4), "p99": round(float(np.percentile(latencies, 99)), 4), "max": round(float(latencies.max()), 4)}
+    if (results.errors != []):
+        report["errors"] = sorted(set(results.errors))[:10] #Distinct errors only, sessions usually fail for the same reason
+    try:
+        report["server"] = await fetch_server_stats(host, port)
+    except (ConnectionError, asyncio.TimeoutError, ValueError) as error:
+        report["server"] = {"error": str(error)}
+    return report
+
+def main(argv:list[str] = None) -> None:
+    import argparse
+    from Map_resources import MAP_PATH, load_map
+    parser = argparse.ArgumentParser(description="Load test a game server (python Game_server.py) with many concurrent bot sessions. Reports moves per second and move latency")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--map", default=MAP_PATH, help="Map file the server plays on")
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS, help="Concurrent sessions")
+    parser.add_argument("--games", type=int, default=DEFAULT_GAMES, help="Games per session")
+    parser.add_argument("--policy", choices=list(POLICIES.keys()), default="flee", help="Pacman policy of the bots")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also save the JSON report to this file")
+    args = parser.parse_args(argv)
+    dimension, _, walls = load_map(args.map)
+    report = asyncio.run(run_load_test(args.host, args.port, walls, dimension, args.sessions, args.games, args.policy, args.seed))
+    latency = report.get("latency_ms", {})
+    print(f"INFO. {report['sessions']} sessions played {report['games']} games ({report['captures']} captures, {report['escapes']} escapes) in {report['seconds']}s")
+    print(f"INFO. {report['moves']} moves, {report['moves_per_second']} moves/s. Latency p50 {latency.get('p50')}ms p99 {latency.get('p99')}ms max {latency.get('max')}ms")
+    if (report["failed_sessions"] > 0):
+        print("\033[93m" + f"WARN. {report['failed_sessions']} sessions failed: {report['errors']}" + "\033[0m")
+    if (args.output is not None):
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+        print(f"Load test report saved at {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+
+PACKAGE_PATH = os.path.dirname(os.path.abspath(__file__))
+MAP_PATH = os.path.join(PACKAGE_PATH, "base-files", "map.txt")
+BASE_PATH = os.path.join(PACKAGE_PATH, "base-files", "base_r.txt")
+WALL_PATH = os.path.join(PACKAGE_PATH, "base-files", "wall_index.txt")
+
+# NOTE - Map resources are never read at import time. Each file is read on first use and cached by absolute path, so importing any module (or starting a worker process) costs nothing
+# Default paths point to the package's base-files, whatever the working directory. Returned lists are copies, so callers may modify them
+
+_resource_cache:dict[tuple[str,str],object] = dict()
+
+#Get a cached resource, reading it on first use
+def _cached(kind:str, filename:str, loader):
+    key = (kind, os.path.abspath(filename))
+    resource = _resource_cache.get(key)
+    if (resource is None):
+        resource = loader(filename)
+        _resource_cache[key] = resource
+    return resource
+
+#Forget every cached resource (e.g. after rebuilding the base files)
+def clear_cache() -> None:
+    _resource_cache.clear()
+
+#Read a map file of 'O' (open) and 'X' (wall) squares. Returns (dimension, base r-matrix, wall index), where the base r-matrix holds 0 on open squares and -1 on walls
+def parse_map(filename:str = MAP_PATH) -> tuple[tuple[int,int], list[int], list[int]]:
+    base_map:list[int] = []
+    wall_index:list[int] = []
+    map_width:int = -1
+    map_height:int = 0
+    with open(filename, 'r') as file:
+        for line in file.readlines():
+            line = line.strip("\n")
+            if (line == ""):
+                continue
+            if (map_width == -1):
+                map_width = len(line)
+            elif (map_width != len(line)):
+                raise ValueError("Map must be of fixed width")
+            for column, char in enumerate(line):
+                if (char == "O"):
+                    base_map.append(0) #Set current square as 'legal' move
+                elif (char == "X"):
+                    base_map.append(-1) #Set current square as 'illegal' move
+                    wall_index.append(map_width*map_height + column)
+                else:
+                    raise ValueError("Squares must be either spaces (O) or walls (X)")
+            map_height += 1
+    return (map_width, map_height), base_map, wall_index
+
+#Read a file of '|' separated integers (base r-matrix or wall index)
+def read_index_file(filename:str) -> tuple[int,...]:
+    with open(filename, 'r') as file:
+        return tuple(int(value) for value in file.read().split("|"))
+
+#Write integers into a '|' separated file. If it already exists, overwrites it
+def write_index_file(values:list[int], filename:str) -> None:
+    with open(filename, 'w') as file:
+        file.write("|".join(str(value) for value in values))
+
+#Load base r-matrix from specified file
+def load_base(filename:str = BASE_PATH) -> list[int]:
+    return list(_cached("base", filename, read_index_file))
+#Load index with all possible wall positions
+def load_walls(filename:str = WALL_PATH) -> list[int]:
+    return list(_cached("walls", filename, read_index_file))
+#Load (dimension, base r-matrix, wall index) straight from a map file
+def load_map(filename:str = MAP_PATH) -> tuple[tuple[int,int], list[int], list[int]]:
+    dimension, base_map, wall_index = _cached("map", filename, parse_map)
+    return dimension, list(base_map), list(wall_index)
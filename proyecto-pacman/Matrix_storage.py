@@ -0,0 +1,498 @@
+import os
+import json
+import struct
+import numpy as np
+from collections import OrderedDict
+
+#Used to monitor performance
+import time
+
+MATRIX_EXTENSION = ".rqm"
+INDEX_EXTENSION = ".index"
+MATRIX_MAGIC = b"RQMX"
+MATRIX_VERSION = 1
+# Header layout: magic, version, width, height, is_conmutative, dtype code, player count, pair count, action count, data offset
+HEADER_FORMAT = "<4sHHHBBIIHQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+DATA_ALIGNMENT = 64
+ACTION_COUNT = 16
+DTYPE_CODES:dict[int,np.dtype] = {0: np.dtype("<i4"), 1: np.dtype("<f4"), 2: np.dtype("<i2")}
+
+# NOTE - Binary matrixes are stored as a dense array shaped (player_pos, ghost_pair_index, action). Player positions and ghost pairs are stored after the header, in the same order as the text files
+
+#Ordered list of ghost pairs for the given open squares. If conmutative, only pairs with ghost1 < ghost2 are kept
+def build_ghost_pairs(effective_range:list[int], is_conmutative:bool) -> list[tuple[int,int]]:
+    ghost_pairs:list[tuple[int,int]] = []
+    for ghost1_pos in effective_range:
+        for ghost2_pos in effective_range:
+            if (ghost1_pos != ghost2_pos):
+                if (ghost1_pos < ghost2_pos) or (not is_conmutative):
+                    ghost_pairs.append((ghost1_pos, ghost2_pos))
+    return ghost_pairs
+
+# NOTE - Both ghosts behave the same, so state (g1, g2) with joint action (a1, a2) is state (g2, g1) with joint action (a2, a1). Canonical tables only keep ghost pairs as (lower, higher), and other orders are read through the action-swap mapping below
+
+#Joint action index with both ghosts' moves exchanged, for every action index ((a1, a2) -> (a2, a1))
+SWAPPED_ACTIONS = np.array([(index % 4)*4 + index//4 for index in range(ACTION_COUNT)], dtype=np.int64)
+
+#Canonical (lower, higher) order of the given ghost positions, and whether they had to be swapped into it
+def canonical_pair(ghost_pos:tuple[int,int]) -> tuple[tuple[int,int], bool]:
+    if (ghost_pos[0] > ghost_pos[1]):
+        return (ghost_pos[1], ghost_pos[0]), True
+    return (ghost_pos[0], ghost_pos[1]), False
+
+#Action values of a row with both ghosts' moves exchanged
+def swap_actions(row:list[int]) -> list[int]:
+    return [row[index] for index in SWAPPED_ACTIONS.tolist()]
+
+#Add a row read from a file to a canonical table. Swapped pairs are only kept (through the action-swap mapping) while their canonical pair has not been read
+def add_canonical_row(table:dict[tuple[int,int],list[int]], ghost_pos:tuple[int,int], row:list[int]) -> None:
+    pair, swapped = canonical_pair(ghost_pos)
+    if (not swapped):
+        table[pair] = row
+    elif (pair not in table):
+        table[pair] = swap_actions(row)
+
+#Group ghost pairs by unordered pair. Returns (index of the first pair of every group, group of every pair, whether every pair is in swapped order). Canonical pairs of the groups are np.sort(ghost_pairs[first_index], axis=1)
+def fold_ghost_pairs(ghost_pairs:np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    pairs = np.asarray(ghost_pairs, dtype=np.int64).reshape(-1, 2)
+    swapped = pairs[:,0] > pairs[:,1]
+    lower = np.minimum(pairs[:,0], pairs[:,1])
+    higher = np.maximum(pairs[:,0], pairs[:,1])
+    keys = lower*(int(pairs.max(initial=0)) + 1) + higher
+    _, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return first_index, inverse.reshape(-1), swapped
+
+#Transform ghost positions into row index using a flattened (cells*cells) lookup array. Returns -1 if the pair is not registered
+def _lookup_pair(pair_lookup:np.ndarray, cell_count:int, ghost_pos:tuple[int,int]) -> int:
+    if (ghost_pos[0] < 0) or (ghost_pos[1] < 0) or (ghost_pos[0] >= cell_count) or (ghost_pos[1] >= cell_count):
+        return -1
+    return int(pair_lookup[ghost_pos[0]*cell_count + ghost_pos[1]])
+
+#Lookup arrays of a matrix layout: player position -> player index (cells), and flattened ghost pair -> pair index (cells*cells). Unregistered entries are -1
+def build_lookups(player_positions:list[int], ghost_pairs:list[tuple[int,int]], dimension:tuple[int,int]) -> tuple[np.ndarray, np.ndarray]:
+    cell_count = dimension[0]*dimension[1]
+    player_lookup = np.full(cell_count, -1, dtype=np.int32)
+    player_lookup[np.asarray(player_positions, dtype=np.int64)] = np.arange(len(player_positions), dtype=np.int32)
+    pair_array = np.asarray(ghost_pairs, dtype=np.int64).reshape(-1, 2)
+    pair_lookup = np.full(cell_count*cell_count, -1, dtype=np.int32)
+    pair_lookup[pair_array[:,0]*cell_count + pair_array[:,1]] = np.arange(len(ghost_pairs), dtype=np.int32)
+    return player_lookup, pair_lookup
+
+#Table (ghost-positions -> action values) for a single player position, backed by a slice of a dense matrix. Rows are returned as array views, so writes go through to the matrix
+class DenseTable:
+    def __init__(self, data:np.ndarray, ghost_pairs:list[tuple[int,int]], pair_lookup:np.ndarray, cell_count:int, is_conmutative:bool = False):
+        self._data = data
+        self._ghost_pairs = ghost_pairs
+        self._pair_lookup = pair_lookup
+        self._cell_count = cell_count
+        self._is_conmutative = is_conmutative
+
+    #Transform ghost positions into row index of the dense table (or -1 if the pair is not registered)
+    def pair_index(self, ghost_pos:tuple[int,int]) -> int:
+        return _lookup_pair(self._pair_lookup, self._cell_count, ghost_pos)
+
+    @property
+    def data(self) -> np.ndarray:
+        return self._data
+
+    def keys(self) -> list[tuple[int,int]]:
+        return self._ghost_pairs
+    def values(self):
+        for index in range(len(self._ghost_pairs)):
+            yield self._data[index]
+    def items(self):
+        for index, ghost_pos in enumerate(self._ghost_pairs):
+            yield ghost_pos, self._data[index]
+
+    #Row index of the given ghost positions, and whether the row is stored in swapped order (only on conmutative tables). Index is -1 if the pair is not registered
+    def _locate(self, ghost_pos:tuple[int,int]) -> tuple[int, bool]:
+        index = self.pair_index(ghost_pos)
+        if (index == -1) and (self._is_conmutative):
+            pair, swapped = canonical_pair(ghost_pos)
+            return self.pair_index(pair), swapped
+        return index, False
+
+    #Rows of swapped pairs are copies (read through the action-swap mapping), so write them back with table[ghost_pos] = row
+    def __getitem__(self, ghost_pos:tuple[int,int]) -> np.ndarray:
+        index, swapped = self._locate(ghost_pos)
+        if (index == -1):
+            raise KeyError(ghost_pos)
+        return self._data[index, SWAPPED_ACTIONS] if (swapped) else self._data[index]
+    def __setitem__(self, ghost_pos:tuple[int,int], value:list[int]) -> None:
+        index, swapped = self._locate(ghost_pos)
+        if (index == -1):
+            raise KeyError(ghost_pos)
+        if (swapped):
+            self._data[index, SWAPPED_ACTIONS] = value
+        else:
+            self._data[index] = value
+    def __contains__(self, ghost_pos:tuple[int,int]) -> bool:
+        return self._locate(ghost_pos)[0] != -1
+    def __iter__(self):
+        return iter(self._ghost_pairs)
+    def __len__(self) -> int:
+        return len(self._ghost_pairs)
+
+#Full matrix (player-position -> ghost-positions -> action values) stored as a single dense array. Behaves like the nested dictionaries used elsewhere
+class DenseMatrix:
+    def __init__(self, data:np.ndarray, player_positions:list[int], ghost_pairs:list[tuple[int,int]], dimension:tuple[int,int], is_conmutative:bool):
+        if (data.shape != (len(player_positions), len(ghost_pairs), ACTION_COUNT)):
+            raise ValueError(f"ERROR. Matrix data should be shaped ({len(player_positions)}, {len(ghost_pairs)}, {ACTION_COUNT}) but is shaped {data.shape}")
+        self._data = data
+        self._player_positions = list(player_positions)
+        self._ghost_pairs = list(ghost_pairs)
+        self._dimension = dimension
+        self._is_conmutative = is_conmutative
+
+        self._player_lookup, self._pair_lookup = build_lookups(self._player_positions, self._ghost_pairs, dimension)
+
+    #Build a dense matrix from the nested dictionary representation. All player tables must share the same ghost pairs
+    @classmethod
+    def from_dict(cls, full_matrix:dict[int,dict[tuple[int,int],list[int]]], dimension:tuple[int,int], dtype = np.int32) -> "DenseMatrix":
+        player_positions = list(full_matrix.keys())
+        if (player_positions == []):
+            raise ValueError("ERROR. Cannot build a dense matrix from an empty matrix")
+        ghost_pairs = list(full_matrix[player_positions[0]].keys())
+        is_conmutative = all(ghost_pos[0] < ghost_pos[1] for ghost_pos in ghost_pairs)
+
+        data = np.zeros((len(player_positions), len(ghost_pairs), ACTION_COUNT), dtype=dtype)
+        for player_index, player_pos in enumerate(player_positions):
+            table = full_matrix[player_pos]
+            if (len(table) != len(ghost_pairs)):
+                raise ValueError(f"ERROR. Table for player position {player_pos} has {len(table)} states, expected {len(ghost_pairs)}")
+            data[player_index] = [table[ghost_pos] for ghost_pos in ghost_pairs]
+        return cls(data, player_positions, ghost_pairs, dimension, is_conmutative)
+
+    #Build a zero-filled matrix with the same layout as the given one (used to initialize q-matrixes from r-matrixes)
+    @classmethod
+    #Any object exposing the layout (player_positions, ghost_pairs, dimension, is_conmutative and dtype) can be used as model, such as Reward_provider.RewardProvider
+    def zeros_like(cls, other:"DenseMatrix", dtype = None) -> "DenseMatrix":
+        if (dtype is None):
+            dtype = other.dtype
+        data = np.zeros((len(other.player_positions), len(other.ghost_pairs), ACTION_COUNT), dtype=dtype)
+        return cls(data, other.player_positions, other.ghost_pairs, other.dimension, other.is_conmutative)
+
+    @property
+    def data(self) -> np.ndarray:
+        return self._data
+    @property
+    def dtype(self) -> np.dtype:
+        return self._data.dtype
+    @property
+    def player_positions(self) -> list[int]:
+        return self._player_positions
+    @property
+    def ghost_pairs(self) -> list[tuple[int,int]]:
+        return self._ghost_pairs
+    @property
+    def dimension(self) -> tuple[int,int]:
+        return self._dimension
+    @property
+    def is_conmutative(self) -> bool:
+        return self._is_conmutative
+
+    #Transform player position into index of the dense matrix (or -1 if the position is not registered)
+    def player_index(self, player_pos:int) -> int:
+        if (player_pos < 0) or (player_pos >= len(self._player_lookup)):
+            return -1
+        return int(self._player_lookup[player_pos])
+    #Transform ghost positions into index of the dense matrix (or -1 if the pair is not registered)
+    def pair_index(self, ghost_pos:tuple[int,int]) -> int:
+        return _lookup_pair(self._pair_lookup, len(self._player_lookup), ghost_pos)
+
+    #Vectorized pair_index over arrays of first and second ghost positions
+    def pair_indexes(self, first:np.ndarray, second:np.ndarray) -> np.ndarray:
+        cell_count = len(self._player_lookup)
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        valid = (first >= 0) & (second >= 0) & (first < cell_count) & (second < cell_count)
+        indexes = self._pair_lookup[np.where(valid, first*cell_count + second, 0)]
+        return np.where(valid, indexes, -1)
+
+    #Convert back into the nested dictionary representation
+    def to_dict(self) -> dict[int,dict[tuple[int,int],list[int]]]:
+        full_matrix:dict[int,dict[tuple[int,int],list[int]]] = dict()
+        for player_index, player_pos in enumerate(self._player_positions):
+            full_matrix[player_pos] = dict(zip(self._ghost_pairs, self._data[player_index].tolist()))
+        return full_matrix
+
+    def keys(self) -> list[int]:
+        return self._player_positions
+    def values(self):
+        for player_pos in self._player_positions:
+            yield self[player_pos]
+    def items(self):
+        for player_pos in self._player_positions:
+            yield player_pos, self[player_pos]
+
+    def __getitem__(self, player_pos:int) -> DenseTable:
+        index = self.player_index(player_pos)
+        if (index == -1):
+            raise KeyError(player_pos)
+        return DenseTable(self._data[index], self._ghost_pairs, self._pair_lookup, len(self._player_lookup), self._is_conmutative)
+    def __contains__(self, player_pos:int) -> bool:
+        return self.player_index(player_pos) != -1
+    def __iter__(self):
+        return iter(self._player_positions)
+    def __len__(self) -> int:
+        return len(self._player_positions)
+
+#Copy of a full matrix (dense or nested dictionaries) that can be saved while the original keeps being trained
+def snapshot_matrix(full_matrix):
+    if (isinstance(full_matrix, DenseMatrix)):
+        return DenseMatrix(np.array(full_matrix.data), full_matrix.player_positions, full_matrix.ghost_pairs, full_matrix.dimension, full_matrix.is_conmutative)
+    return {player_pos: {ghost_pos: list(row) for ghost_pos, row in table.items()} for player_pos, table in full_matrix.items()}
+
+#Write the header, player positions and ghost pairs of a binary matrix file. Returns offset where dense data starts
+def _write_header(file, dimension:tuple[int,int], player_positions:list[int], ghost_pairs:list[tuple[int,int]], is_conmutative:bool, dtype:np.dtype) -> int:
+    dtype_code:int = -1
+    for code, candidate in DTYPE_CODES.items():
+        if (candidate == np.dtype(dtype).newbyteorder("<")):
+            dtype_code = code
+    if (dtype_code == -1):
+        raise ValueError(f"ERROR. Unsupported matrix dtype {dtype}. Must be one of {[str(value) for value in DTYPE_CODES.values()]}")
+
+    index_size = 4*len(player_positions) + 8*len(ghost_pairs)
+    data_offset = HEADER_SIZE + index_size
+    data_offset += (-data_offset) % DATA_ALIGNMENT
+    file.write(struct.pack(HEADER_FORMAT, MATRIX_MAGIC, MATRIX_VERSION, dimension[0], dimension[1], int(is_conmutative), dtype_code, len(player_positions), len(ghost_pairs), ACTION_COUNT, data_offset))
+    file.write(np.asarray(player_positions, dtype="<i4").tobytes())
+    file.write(np.asarray(ghost_pairs, dtype="<i4").reshape(-1, 2).tobytes())
+    file.write(b"\0" * (data_offset - HEADER_SIZE - index_size))
+    return data_offset
+
+#Read header of a binary matrix file. Returns (dimension, player positions, ghost pairs, is_conmutative, dtype, data offset)
+def read_header(filename:str) -> tuple[tuple[int,int], list[int], list[tuple[int,int]], bool, np.dtype, int]:
+    with open(filename, 'rb') as file:
+        raw_header = file.read(HEADER_SIZE)
+        if (len(raw_header) != HEADER_SIZE):
+            raise ValueError(f"ERROR. File {filename} is too short to be a binary matrix")
+        magic, version, width, height, is_conmutative, dtype_code, player_count, pair_count, action_count, data_offset = struct.unpack(HEADER_FORMAT, raw_header)
+        if (magic != MATRIX_MAGIC):
+            raise ValueError(f"ERROR. File {filename} is not a binary matrix (bad magic number)")
+        if (version != MATRIX_VERSION):
+            raise ValueError(f"ERROR. File {filename} has binary matrix version {version}, only version {MATRIX_VERSION} is supported")
+        if (action_count != ACTION_COUNT) or (dtype_code not in DTYPE_CODES):
+            raise ValueError(f"ERROR. File {filename} has an unsupported binary matrix layout")
+        player_positions = np.frombuffer(file.read(4*player_count), dtype="<i4").tolist()
+        pair_array = np.frombuffer(file.read(8*pair_count), dtype="<i4").reshape(-1, 2)
+        ghost_pairs = [tuple(pair) for pair in pair_array.tolist()]
+    return (width, height), player_positions, ghost_pairs, bool(is_conmutative), DTYPE_CODES[dtype_code], data_offset
+
+#Save a matrix (dense or nested dictionaries) into a binary matrix file. If it already exists, overwrites it.
+def save_binary_matrix(full_matrix, filename:str, dimension:tuple[int,int] = None, dtype = None) -> None:
+    timestamp = time.time()
+    if (not isinstance(full_matrix, DenseMatrix)):
+        if (dimension is None):
+            raise ValueError("ERROR. Dimension is required to save a dictionary matrix in binary format")
+        full_matrix = DenseMatrix.from_dict(full_matrix, dimension)
+    if (dtype is None):
+        dtype = full_matrix.data.dtype
+    with open(filename, 'wb') as file:
+        _write_header(file, full_matrix.dimension, full_matrix.player_positions, full_matrix.ghost_pairs, full_matrix.is_conmutative, dtype)
+        file.write(np.ascontiguousarray(full_matrix.data, dtype=np.dtype(dtype).newbyteorder("<")).tobytes())
+    print(f"Matrix saved successfully at {filename} (in {round(time.time() - timestamp, 4)}s)")
+
+#Open a binary matrix file. If memory_map, data is memory-mapped instead of read (use mode 'r+' to write through, 'c' for copy-on-write)
+def load_binary_matrix(filename:str, memory_map:bool = True, mode:str = "r") -> DenseMatrix:
+    dimension, player_positions, ghost_pairs, is_conmutative, dtype, data_offset = read_header(filename)
+    shape = (len(player_positions), len(ghost_pairs), ACTION_COUNT)
+    if (memory_map):
+        data = np.memmap(filename, dtype=dtype, mode=mode, offset=data_offset, shape=shape)
+    else:
+        with open(filename, 'rb') as file:
+            file.seek(data_offset)
+            data = np.fromfile(file, dtype=dtype, count=shape[0]*shape[1]*shape[2]).reshape(shape)
+    return DenseMatrix(data, player_positions, ghost_pairs, dimension, is_conmutative)
+
+#Create a zero-filled binary matrix file with the given layout, and open it memory-mapped for writing. If it already exists, overwrites it.
+def create_binary_matrix(filename:str, dimension:tuple[int,int], player_positions:list[int], ghost_pairs:list[tuple[int,int]], is_conmutative:bool, dtype = np.int32) -> DenseMatrix:
+    with open(filename, 'wb') as file:
+        data_offset = _write_header(file, dimension, player_positions, ghost_pairs, is_conmutative, dtype)
+        file.truncate(data_offset + len(player_positions)*len(ghost_pairs)*ACTION_COUNT*np.dtype(dtype).itemsize)
+    return load_binary_matrix(filename, True, "r+")
+
+#Parse a single 'g1|g2|p = r0|r1|...|r15' line of a text matrix. Returns (state, rewards). If dimension is given, positions are checked against it
+def parse_matrix_line(line:str, dimension:tuple[int,int] = None) -> tuple[list[int], list[int]]:
+    line_split = line.split("=")
+    if (len(line_split) != 2):
+        raise ValueError("Should have key=value pairs.")
+    
+    state = line_split[0].strip().split("|")
+    if (len(state) != 3):
+        raise ValueError("State should have ONLY 3 values")
+    for value in state:
+        if (not value.isdigit()):
+            raise ValueError("State should be an INTEGER tuple separated with pipes like 1|2|3")
+        elif (dimension is not None) and ( (int(value) < 0) or (int(value) >= dimension[0]*dimension[1]) ):
+            raise ValueError(f"Given dimension {dimension[0]}x{dimension[1]}, position must be between 0 and {dimension[0]*dimension[1] - 1} inclusive")
+    state = [int(value) for value in state]
+        
+    rewards = line_split[1].strip().split("|")
+    if (len(rewards) != ACTION_COUNT):
+        raise ValueError(f"There should be rewards registered for {ACTION_COUNT} different actions")
+    for value in rewards:
+        if ( (not value.isdigit()) and not( (value[0:1] in ("+", "-")) and (value[1:].isdigit()) ) ):
+            raise ValueError("Actions' rewards should be an INTEGER tuple separated with pipes like 1|2|3")
+    rewards = [int(value) for value in rewards]
+    return state, rewards
+
+#Stream a text matrix file line by line, without reading it whole. Yields (line index, state, rewards). Starts at byte offset and stops after line_limit lines, if given
+def iter_matrix_file(filename:str, dimension:tuple[int,int] = None, offset:int = 0, line_limit:int = None):
+    with open(filename, 'rb') as file:
+        file.seek(offset)
+        for index, raw_line in enumerate(file):
+            if (line_limit is not None) and (index >= line_limit):
+                break
+            line = raw_line.decode().strip()
+            if (line == ""):
+                continue
+            try:
+                state, rewards = parse_matrix_line(line, dimension)
+            except ValueError as error:
+                raise ValueError(f"ERROR. Badly formatted line on file {filename}. Error found at line {index}. {error}")
+            yield index, state, rewards
+
+#Byte offset and line count where each player position's block starts on a text matrix file. The index is cached next to the file (as <filename>.index) and rebuilt when the file changes
+def build_offset_index(filename:str, use_cache:bool = True) -> dict[int,tuple[int,int]]:
+    file_stat = os.stat(filename)
+    cache_filename = filename + INDEX_EXTENSION
+    if (use_cache) and (os.path.exists(cache_filename)):
+        with open(cache_filename, 'r') as file:
+            cache = json.load(file)
+        if (cache["size"] == file_stat.st_size) and (cache["mtime"] == file_stat.st_mtime):
+            return {int(player_pos): (block[0], block[1]) for player_pos, block in cache["blocks"].items()}
+
+    offset_index:dict[int,tuple[int,int]] = dict()
+    prev_player_pos:int = -1
+    offset:int = 0
+    with open(filename, 'rb') as file:
+        for raw_line in file:
+            separator = raw_line.find(b"=")
+            if (separator != -1):
+                player_pos = int(raw_line[:separator].rsplit(b"|", 1)[-1])
+                if (player_pos != prev_player_pos):
+                    if (player_pos in offset_index):
+                        raise ValueError(f"ERROR. Player position {player_pos} appears in more than one block on file {filename}. Lines must be grouped by player position")
+                    offset_index[player_pos] = (offset, 0)
+                    prev_player_pos = player_pos
+            if (prev_player_pos != -1):
+                block = offset_index[prev_player_pos]
+                offset_index[prev_player_pos] = (block[0], block[1] + 1)
+            offset += len(raw_line)
+
+    if (use_cache):
+        try:
+            with open(cache_filename, 'w') as file:
+                json.dump({"size": file_stat.st_size, "mtime": file_stat.st_mtime, "blocks": offset_index}, file)
+        except OSError: #Read-only location. Index still works, just is not cached
+            pass
+    return offset_index
+
+#Read-only matrix over a text matrix file. Player tables are parsed on first access and the least recently used ones are evicted to keep at most max_tables in memory
+#NOTE - Evicted tables are reloaded from file, so changes made to them are lost. Use it to play or inspect, not to train
+class LazyMatrix:
+    def __init__(self, filename:str, dimension:tuple[int,int], max_tables:int = 4):
+        if (max_tables < 1):
+            raise ValueError("At least one table must fit in memory")
+        self._filename = filename
+        self._dimension = dimension
+        self._max_tables = max_tables
+        self._offset_index = build_offset_index(filename)
+        self._tables:OrderedDict[int,dict[tuple[int,int],list[int]]] = OrderedDict()
+
+    @property
+    def loaded_positions(self) -> list[int]:
+        return list(self._tables.keys())
+
+    #Parse the table of a single player position from file
+    def _load_table(self, player_pos:int) -> dict[tuple[int,int],list[int]]:
+        offset, line_count = self._offset_index[player_pos]
+        table:dict[tuple[int,int],list[int]] = dict()
+        for index, state, rewards in iter_matrix_file(self._filename, self._dimension, offset, line_count):
+            add_canonical_row(table, (state[0], state[1]), rewards)
+        return table
+
+    def keys(self) -> list[int]:
+        return list(self._offset_index.keys())
+    def values(self):
+        for player_pos in self._offset_index.keys():
+            yield self[player_pos]
+    def items(self):
+        for player_pos in self._offset_index.keys():
+            yield player_pos, self[player_pos]
+
+    def __getitem__(self, player_pos:int) -> dict[tuple[int,int],list[int]]:
+        table = self._tables.get(player_pos)
+        if (table is not None):
+            self._tables.move_to_end(player_pos)
+            return table
+        if (player_pos not in self._offset_index):
+            raise KeyError(player_pos)
+        table = self._load_table(player_pos)
+        self._tables[player_pos] = table
+        while (len(self._tables) > self._max_tables):
+            self._tables.popitem(last=False)
+        return table
+    def __contains__(self, player_pos:int) -> bool:
+        return player_pos in self._offset_index
+    def __iter__(self):
+        return iter(self._offset_index.keys())
+    def __len__(self) -> int:
+        return len(self._offset_index)
+
+#Convert a text matrix file into a binary matrix file, without loading the text file fully into memory. Walls (and conmutativity) define the expected layout
+#If conmutative, swapped pairs of the text file are folded into their canonical rows (through the action-swap mapping) unless the canonical line is also present
+def text_to_binary(in_filename:str, out_filename:str, dimension:tuple[int,int], wall_index:list[int], is_conmutative:bool = True, dtype = np.int32, verbose:bool = False) -> DenseMatrix:
+    timestamp = time.time()
+    effective_range = [i for i in range(dimension[0]*dimension[1]) if i not in wall_index]
+    ghost_pairs = build_ghost_pairs(effective_range, is_conmutative)
+    matrix = create_binary_matrix(out_filename, dimension, effective_range, ghost_pairs, is_conmutative, dtype)
+    filled = np.zeros((len(effective_range), len(ghost_pairs)), dtype=bool)
+    canonical = np.zeros((len(effective_range), len(ghost_pairs)), dtype=bool) #Filled from a canonical line
+    for index, state, rewards in iter_matrix_file(in_filename, dimension):
+        pair, swapped = canonical_pair((state[0], state[1])) if (is_conmutative) else ((state[0], state[1]), False)
+        player_index = matrix.player_index(state[2])
+        pair_index = matrix.pair_index(pair)
+        if (player_index == -1) or (pair_index == -1):
+            raise ValueError(f"ERROR. State {tuple(state)} on file {in_filename} (line {index}) does not fit the expected layout. Check walls and conmutativity")
+        if (not swapped):
+            matrix.data[player_index, pair_index] = rewards
+            canonical[player_index, pair_index] = True
+        elif (not canonical[player_index, pair_index]):
+            matrix.data[player_index, pair_index] = swap_actions(rewards)
+        filled[player_index, pair_index] = True
+        if (verbose) and (index % 100000 == 0) and (index > 0):
+            print(f"Converted {index} lines (in {round(time.time() - timestamp, 4)}s)")
+    if (not filled.all()):
+        raise ValueError(f"ERROR. File {in_filename} is missing {int((~filled).sum())} states of the expected layout")
+    matrix.data.flush()
+    print(f"Converted {in_filename} into {out_filename} (in {round(time.time() - timestamp, 4)}s)")
+    return matrix
+
+#Convert a binary matrix file back into the pipe-delimited text format
+def binary_to_text(in_filename:str, out_filename:str, verbose:bool = False) -> None:
+    from Rmatrix_populator import save_full_matrix
+    save_full_matrix(load_binary_matrix(in_filename), out_filename, verbose)
+
+#Binary matrix files are recognized by their extension
+def is_binary_matrix_file(filename:str) -> bool:
+    return filename.endswith(MATRIX_EXTENSION)
+
+def main(argv:list[str] = None) -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description=f"Convert text matrixes into binary ({MATRIX_EXTENSION}) matrixes and vice versa, according to the input extension")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--map", default=None, help="Map file of text matrixes (default the package's map)")
+    args = parser.parse_args(argv)
+    if (is_binary_matrix_file(args.input)):
+        binary_to_text(args.input, args.output, True)
+    else:
+        from Map_resources import MAP_PATH, load_map
+        dimension, _, walls = load_map(MAP_PATH if (args.map is None) else args.map)
+        text_to_binary(args.input, args.output, dimension, walls, verbose=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import numpy as np
+from collections import deque
+from Map_resources import MAP_PATH, parse_map
+
+ACTION_COUNT = 4 #North, east, south, west
+
+# NOTE - Moves are encoded as 0 (north), 1 (east), 2 (south), 3 (west). -1 means stay. Joint ghost actions are encoded as action_g1*4 + action_g2
+
+#Static description of the maze: which squares are open and where every move leads. Built once and shared, so legality checks are plain lookups
+class MazeTopology:
+    def __init__(self, dimension:tuple[int,int], wall_index:list[int]):
+        self._dimension = (dimension[0], dimension[1])
+        cell_count = dimension[0]*dimension[1]
+        self._wall_set:frozenset[int] = frozenset(wall_index)
+        self._open_cells:list[int] = [i for i in range(cell_count) if i not in self._wall_set]
+
+        #Neighbor array. Moves out-of-bounds, into walls or from walls are illegal (-1)
+        cells = np.arange(cell_count)
+        neighbors = np.stack([cells - dimension[0], cells + 1, cells + dimension[0], cells - 1], axis=1)
+        neighbors[cells < dimension[0], 0] = -1
+        neighbors[(cells % dimension[0]) == (dimension[0] - 1), 1] = -1
+        neighbors[cells >= (cell_count - dimension[0]), 2] = -1
+        neighbors[(cells % dimension[0]) == 0, 3] = -1
+        is_wall = np.zeros(cell_count + 1, dtype=bool) #Extra slot so -1 indexes a non-wall
+        is_wall[list(self._wall_set)] = True
+        neighbors[is_wall[neighbors]] = -1
+        neighbors[is_wall[:-1]] = -1
+        self._neighbors:np.ndarray = neighbors.astype(np.int32)
+        self._neighbor_list:list[tuple[int,int,int,int]] = [tuple(row) for row in self._neighbors.tolist()]
+
+        #Legal joint actions for every (ghost1, ghost2) pair of squares, as 16-bit masks. Both moves must be legal and ghosts cannot land on the same square
+        first = self._neighbors[:, None, :, None]
+        second = self._neighbors[None, :, None, :]
+        legal = (first != -1) & (second != -1) & (first != second)
+        bits = (1 << np.arange(ACTION_COUNT*ACTION_COUNT)).astype(np.uint32)
+        self._joint_masks:np.ndarray = (legal.reshape(cell_count, cell_count, ACTION_COUNT*ACTION_COUNT) * bits).sum(axis=2).astype(np.uint16)
+        self._joint_mask_list:list[int] = self._joint_masks.reshape(-1).tolist()
+        self._mask_actions:dict[int,list[tuple[int,int]]] = dict()
+        self._distances:np.ndarray = None #Built on first use
+
+    #Build topology from a map file of 'O' (open) and 'X' (wall) squares
+    @classmethod
+    def from_map_file(cls, filename:str = MAP_PATH) -> "MazeTopology":
+        dimension, _, wall_index = parse_map(filename)
+        return cls(dimension, wall_index)
+
+    @property
+    def dimension(self) -> tuple[int,int]:
+        return self._dimension
+    @property
+    def cell_count(self) -> int:
+        return self._dimension[0]*self._dimension[1]
+    @property
+    def open_cells(self) -> list[int]:
+        return self._open_cells
+    @property
+    def wall_index(self) -> list[int]:
+        return sorted(self._wall_set)
+    @property
+    def neighbors(self) -> np.ndarray:
+        return self._neighbors
+    @property
+    def joint_masks(self) -> np.ndarray:
+        return self._joint_masks.reshape(self.cell_count, self.cell_count)
+
+    def is_open(self, position:int) -> bool:
+        return (0 <= position < self.cell_count) and (position not in self._wall_set)
+
+    #New position after the given move, or -1 if the move is illegal
+    def move(self, position:int, action:int) -> int:
+        if (action == -1):
+            return position
+        if (action < 0) or (action >= ACTION_COUNT):
+            raise ValueError("Action can only be stay (-1); or move north (0), east (1), south (2) or west (3)")
+        return self._neighbor_list[position][action]
+
+    #Bitmask of legal joint actions (bit action_g1*4 + action_g2) for the given ghost positions
+    def joint_mask(self, ghost_pos:tuple[int,int]) -> int:
+        return self._joint_mask_list[ghost_pos[0]*self.cell_count + ghost_pos[1]]
+
+    #List of legal joint action tuples for the given ghost positions. Lists are shared, do not modify them
+    def joint_actions(self, ghost_pos:tuple[int,int]) -> list[tuple[int,int]]:
+        mask = self._joint_mask_list[ghost_pos[0]*self.cell_count + ghost_pos[1]]
+        action_list = self._mask_actions.get(mask)
+        if (action_list is None):
+            action_list = [(i//ACTION_COUNT, i%ACTION_COUNT) for i in range(ACTION_COUNT*ACTION_COUNT) if (mask >> i) & 1]
+            self._mask_actions[mask] = action_list
+        return action_list
+
+    #Shortest path length between every pair of squares (moving through open squares only), or -1 if unreachable. Built on first use
+    @property
+    def distances(self) -> np.ndarray:
+        if (self._distances is None):
+            distances = np.full((self.cell_count, self.cell_count), -1, dtype=np.int32)
+            for origin in self._open_cells:
+                distances[origin, origin] = 0
+                queue = deque([origin])
+                while (queue):
+                    position = queue.popleft()
+                    for neighbor in self._neighbor_list[position]:
+                        if (neighbor != -1) and (distances[origin, neighbor] == -1):
+                            distances[origin, neighbor] = distances[origin, position] + 1
+                            queue.append(neighbor)
+            distances.setflags(write=False) #Shared by every caller, must not change
+            self._distances = distances
+        return self._distances
+
+    #Legal joint action masks for a list of ghost pairs (e.g. the ghost pairs of a dense matrix)
+    def pair_masks(self, ghost_pairs:list[tuple[int,int]]) -> np.ndarray:
+        pair_array = np.asarray(ghost_pairs, dtype=np.int64).reshape(-1, 2)
+        return self._joint_masks[pair_array[:,0], pair_array[:,1]]
+
+_topology_cache:dict[tuple,MazeTopology] = dict()
+
+#Get shared topology for the given dimension and walls, building it on first use
+def get_topology(dimension:tuple[int,int], wall_index:list[int] = ()) -> MazeTopology:
+    key = (dimension[0], dimension[1], tuple(sorted(wall_index)))
+    topology = _topology_cache.get(key)
+    if (topology is None):
+        topology = MazeTopology(dimension, wall_index)
+        _topology_cache[key] = topology
+    return topology
+
+#Get shared topology built from a map file, building it on first use
+def load_topology(filename:str = MAP_PATH) -> MazeTopology:
+    key = ("file", filename)
+    topology = _topology_cache.get(key)
+    if (topology is None):
+        topology = MazeTopology.from_map_file(filename)
+        _topology_cache[key] = topology
+    return topology
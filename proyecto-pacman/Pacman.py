@@ -1,11 +1,35 @@
+import os
 from GhostAI import GhostAI
-from Agent_trainer import load_full_matrix, load_walls
+from Agent_trainer import load_full_matrix
+from Map_resources import MAP_PATH, load_map
+from Maze_topology import get_topology
+from Policy_table import load_policy_table
+from State_sampler import get_sampler
 from Performance_util import performance_decorator
 
-QMATRIX_PATH = "output-files/ai-tables/GhostAI_Game.txt"
+QMATRIX_PATH = "output-files/ai-tables/GhostAI_Game.rqm" #Text matrixes still load, but binary ones open instantly
+POLICY_PATH = "output-files/ai-tables/GhostAI_Game.rqp" #Compile with 'python Policy_table.py GhostAI_Game.rqm GhostAI_Game.rqp'. Used instead of the q-matrix if it exists
 
-if __name__ == "__main__":
-    qmatrix = load_full_matrix(QMATRIX_PATH, (18,9))
-    ghost_brain = GhostAI((76,77,59), load_walls(), (18,9), qmatrix, 0)
+def main(argv:list[str] = None) -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description="Play against the trained ghosts (policy table if compiled, q-matrix otherwise)")
+    parser.add_argument("--map", default=MAP_PATH, help="Map file the ghosts were trained on")
+    parser.add_argument("--qmatrix", default=QMATRIX_PATH)
+    parser.add_argument("--policy", default=POLICY_PATH)
+    args = parser.parse_args(argv)
+    dimension, _, walls = load_map(args.map)
+    if (os.path.exists(args.policy)):
+        qmatrix = load_policy_table(args.policy) #Greedy actions only, decisions are a single lookup
+    else:
+        qmatrix = load_full_matrix(args.qmatrix, dimension, lazy=True) #Only the table for the current player position is ever needed
+    if (os.path.abspath(args.map) == os.path.abspath(MAP_PATH)):
+        ghost_brain = GhostAI((76,77,59), walls, dimension, qmatrix, 0)
+        ghost_brain.simulate_game(resume_game=False) #The game will be initialized regardless of initial state, since it resembles the original Pacman's setup
+    else: #Other maps have no classic setup, so the game starts with Pacman on the first open square and ghosts anywhere else
+        topology = get_topology(dimension, walls)
+        player_pos = topology.open_cells[0]
+        ghost_brain = GhostAI(get_sampler(topology).sample(player_pos) + (player_pos,), walls, dimension, qmatrix, 0, topology)
+        ghost_brain.simulate_game(resume_game=True, map_filename=None)
 
-    ghost_brain.simulate_game(resume_game=False) #The game will be initialized regardless of initial state, since it resembles the original Pacman's setup
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+from Heatmap_engine import DEFAULT_CHUNK_SIZE, build_player_heatmaps, build_player_rewards, build_reward_rows
+from Matrix_storage import DenseMatrix, build_ghost_pairs, create_binary_matrix, load_binary_matrix
+from Maze_topology import get_topology
+from Performance_util import get_metrics
+from Reward_shards import create_shard_store, save_shard, shard_path
+
+#Used to monitor performance
+import time
+
+# NOTE - Work is split by player position. Workers write their results straight into memory-mapped files (one slice per player position), so only indexes travel between processes. Every slice is computed independently, so results do not depend on worker count nor scheduling
+
+#Worker state, set once per process by the pool initializer
+_worker_config:dict = dict()
+
+def _init_worker(config:dict) -> None:
+    _worker_config.clear()
+    _worker_config.update(config)
+    _worker_config["arrays"] = dict() #Memory-mapped files opened by this worker, by path
+
+#Open (once per process) a memory-mapped array by path
+def _open_array(path:str, mode:str) -> np.ndarray:
+    arrays = _worker_config["arrays"]
+    if (path not in arrays):
+        if (path.endswith(".npy")):
+            arrays[path] = np.load(path, mmap_mode=mode)
+        else:
+            arrays[path] = load_binary_matrix(path, True, mode).data
+    return arrays[path]
+
+#Player positions reachable in one move from the given one, in action order (same as Rmatrix_populator.to_reward_combination)
+def adjacent_positions(player_pos:int, dimension:tuple[int,int], player_positions:list[int]) -> list[int]:
+    topology = get_topology(dimension)
+    position_set = set(player_positions)
+    adjacent:list[int] = []
+    for action in range(4):
+        new_pos = topology.move(player_pos, action)
+        if (new_pos in position_set):
+            adjacent.append(new_pos)
+    return adjacent
+
+def _heatmap_task(player_index:int) -> int:
+    config = _worker_config
+    output = _open_array(config["output"], "r+")
+    output[player_index] = build_player_heatmaps(config["player_positions"][player_index], config["ghost_pairs"], config["dimension"], config["base_matrix"], config["value"], config["decay"])
+    return player_index
+
+def _reward_task(player_index:int) -> int:
+    config = _worker_config
+    heatmaps = _open_array(config["heatmaps"], "r")
+    output = _open_array(config["output"], "r+")
+    adjacent_heatmaps = None
+    if (config["time_multiplier"] > 0):
+        adjacent_heatmaps = [heatmaps[index] for index in config["adjacent"][player_index]]
+    output[player_index] = build_player_rewards(heatmaps[player_index], config["ghost_pairs"], config["dimension"], config["stay_prize"], config["time_multiplier"], adjacent_heatmaps)
+    return player_index
+
+#Build reward rows of a player position, a chunk of ghost pairs at a time (heatmaps of the player position and its adjacent positions are built per chunk). Used when there is no full heatmap array to read from
+def _player_reward_rows(player_index:int) -> np.ndarray:
+    config = _worker_config
+    player_pos = config["player_positions"][player_index]
+    adjacent = adjacent_positions(player_pos, config["dimension"], config["player_positions"]) if (config["time_multiplier"] > 0) else []
+    return build_reward_rows(player_pos, adjacent, config["ghost_pairs"], config["dimension"], config["base_matrix"], config["value"], config["decay"], config["stay_prize"], config["time_multiplier"], config.get("chunk_size", DEFAULT_CHUNK_SIZE))
+
+def _full_reward_task(player_index:int) -> int:
+    output = _open_array(_worker_config["output"], "r+")
+    output[player_index] = _player_reward_rows(player_index)
+    return player_index
+
+#Same as _full_reward_task, but writes the shard of the player position instead (tasks index the positions to build)
+def _shard_task(task_index:int) -> int:
+    config = _worker_config
+    player_index = config["targets"][task_index]
+    save_shard(config["output"], config["player_positions"][player_index], _player_reward_rows(player_index))
+    return player_index
+
+#Run task over every player index, serially if workers <= 1 or on a process pool otherwise. Prints progress like the serial builders
+def _run_tasks(task, config:dict, task_count:int, workers:int, label:str, verbose:bool) -> None:
+    print_acc = [0, 1]
+    timestamp = time.time()
+    metrics = get_metrics()
+    metric_name = "build." + label.lower().replace(" ", "_")
+    def report() -> None:
+        metrics.count(metric_name + ".tasks")
+        metrics.maybe_export()
+        if (verbose):
+            print_acc[0] += 1
+            if ( print_acc[0] >= task_count*0.05 ):
+                print(f"{label} {print_acc[1]*5}% done (in {round(time.time() - timestamp, 4)}s)")
+                print_acc[0] = 0
+                print_acc[1] += 1
+
+    if (workers <= 1):
+        _init_worker(config)
+        for index in range(task_count):
+            task(index)
+            report()
+        _worker_config.clear() #Release memory-mapped files
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(config,)) as pool:
+            for _ in pool.imap_unordered(task, range(task_count)):
+                report()
+    metrics.record_time(metric_name, time.time() - timestamp)
+    if (verbose):
+        print(f"{label} completed in {round(time.time() - timestamp, 4)}s ({workers} workers)")
+
+#Default worker count for parallel builds (cores available to this process)
+def default_workers() -> int:
+    if (hasattr(os, "sched_getaffinity")):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+#Build heatmaps for all player positions and ghost pairs. Returns (player positions, ghost pairs, array shaped (players, pairs, cells))
+def build_heatmap_array(dimension:tuple[int,int], value:int, decay:int, base_matrix:list[int], wall_index:list[int], is_conmutative:bool = True, workers:int = 1, verbose:bool = False) -> tuple[list[int], list[tuple[int,int]], np.ndarray]:
+    player_positions = get_topology(dimension, wall_index).open_cells
+    ghost_pairs = build_ghost_pairs(player_positions, is_conmutative)
+    work_dir = tempfile.mkdtemp(prefix="heatmaps_")
+    try:
+        output_path = os.path.join(work_dir, "heatmaps.npy")
+        output = np.lib.format.open_memmap(output_path, "w+", np.int32, (len(player_positions), len(ghost_pairs), dimension[0]*dimension[1]))
+        del output
+        config = {"output": output_path, "player_positions": player_positions, "ghost_pairs": np.asarray(ghost_pairs), "dimension": dimension, "base_matrix": list(base_matrix), "value": value, "decay": decay}
+        _run_tasks(_heatmap_task, config, len(player_positions), workers, "Full build", verbose)
+        heatmaps = np.array(np.load(output_path, mmap_mode="r"))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return player_positions, ghost_pairs, heatmaps
+
+#Build reward rows for all player positions out of a full heatmap array (as returned by build_heatmap_array). Returns array shaped (players, pairs, 16)
+def build_reward_array(heatmaps:np.ndarray, player_positions:list[int], ghost_pairs:list[tuple[int,int]], dimension:tuple[int,int], stay_prize:int = 1000, time_multiplier:float = -1.0, workers:int = 1, verbose:bool = False) -> np.ndarray:
+    work_dir = tempfile.mkdtemp(prefix="rewards_")
+    try:
+        heatmap_path = os.path.join(work_dir, "heatmaps.npy")
+        np.save(heatmap_path, heatmaps)
+        output_path = os.path.join(work_dir, "rewards.npy")
+        output = np.lib.format.open_memmap(output_path, "w+", np.int32, (len(player_positions), len(ghost_pairs), 16))
+        del output
+        player_lookup = {player_pos: index for index, player_pos in enumerate(player_positions)}
+        adjacent = [[player_lookup[position] for position in adjacent_positions(player_pos, dimension, player_positions)] for player_pos in player_positions]
+        config = {"heatmaps": heatmap_path, "output": output_path, "ghost_pairs": np.asarray(ghost_pairs), "dimension": dimension, "stay_prize": stay_prize, "time_multiplier": time_multiplier, "adjacent": adjacent}
+        _run_tasks(_reward_task, config, len(player_positions), workers, "Reward combination", verbose)
+        rewards = np.array(np.load(output_path, mmap_mode="r"))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return rewards
+
+#Build the full r-matrix straight into a binary matrix file, without ever holding all heatmaps. Each worker builds the heatmaps it needs and writes the slice of its player position
+def build_reward_matrix(filename:str, dimension:tuple[int,int], value:int, decay:int, base_matrix:list[int], wall_index:list[int], stay_prize:int = 1000, time_multiplier:float = -1.0, is_conmutative:bool = True, workers:int = 1, verbose:bool = False) -> DenseMatrix:
+    player_positions = get_topology(dimension, wall_index).open_cells
+    ghost_pairs = build_ghost_pairs(player_positions, is_conmutative)
+    matrix = create_binary_matrix(filename, dimension, player_positions, ghost_pairs, is_conmutative)
+    del matrix
+    config = {"output": filename, "player_positions": player_positions, "ghost_pairs": np.asarray(ghost_pairs), "dimension": dimension, "base_matrix": list(base_matrix), "value": value, "decay": decay, "stay_prize": stay_prize, "time_multiplier": time_multiplier}
+    _run_tasks(_full_reward_task, config, len(player_positions), workers, "Reward matrix build", verbose)
+    return load_binary_matrix(filename)
+
+#Build the r-matrix of a map as a shard store on directory (one file per player position), keeping a single player table (plus the heatmaps of one chunk of ghost pairs) in memory per worker
+#Shards already on disk are kept, so interrupted builds resume where they stopped. If player_positions is given, only those shards are built. Returns positions built by this call
+def build_reward_shards(directory:str, dimension:tuple[int,int], value:int, decay:int, base_matrix:list[int], wall_index:list[int], stay_prize:int = 1000, time_multiplier:float = -1.0, is_conmutative:bool = True, workers:int = 1, verbose:bool = False, player_positions:list[int] = None, chunk_size:int = DEFAULT_CHUNK_SIZE, overwrite:bool = False) -> list[int]:
+    settings = {"value": value, "decay": decay, "stay_prize": stay_prize, "time_multiplier": time_multiplier}
+    create_shard_store(directory, dimension, wall_index, settings, is_conmutative, np.int32, overwrite)
+    all_positions = get_topology(dimension, wall_index).open_cells
+    player_lookup = {player_pos: index for index, player_pos in enumerate(all_positions)}
+    if (player_positions is None):
+        player_positions = all_positions
+    for player_pos in player_positions:
+        if (player_pos not in player_lookup):
+            raise ValueError(f"ERROR. Player position {player_pos} is not an open square of the map")
+    targets = [player_lookup[player_pos] for player_pos in player_positions if not os.path.isfile(shard_path(directory, player_pos))]
+    if (verbose) and (len(targets) < len(player_positions)):
+        print(f"Resuming shard build on {directory} ({len(player_positions) - len(targets)} shards already built)")
+    if (targets != []):
+        ghost_pairs = build_ghost_pairs(all_positions, is_conmutative)
+        config = {"output": directory, "targets": targets, "player_positions": all_positions, "ghost_pairs": np.asarray(ghost_pairs), "dimension": dimension, "base_matrix": list(base_matrix), "value": value, "decay": decay, "stay_prize": stay_prize, "time_multiplier": time_multiplier, "chunk_size": chunk_size}
+        _run_tasks(_shard_task, config, len(targets), workers, "Shard build", verbose)
+    return [all_positions[index] for index in targets]
@@ -0,0 +1,132 @@
+import random
+import multiprocessing
+import numpy as np
+from GhostAI import GhostAI
+from Matrix_storage import ACTION_COUNT, MATRIX_EXTENSION, DenseMatrix, is_binary_matrix_file, load_binary_matrix
+from Performance_util import configure_metrics, get_metrics
+from Reward_provider import RewardProvider
+from Sparse_storage import SPARSE_EXTENSION, SparseMatrix, is_sparse_matrix_file, load_sparse_matrix
+from Reward_shards import ShardedMatrix, is_shard_directory
+
+# NOTE - simulate_train only reads and writes the q-table of the current player position, so every target can be trained on its own process. Workers memory-map the binary r-matrix (or compute rewards on demand) and only exchange single player tables with the parent
+# Tables are exchanged as plain arrays: all 16 action values of every row for dense q-matrixes, packed legal values (plus the masks of the table) for sparse ones
+
+#Worker state, set once per process by the pool initializer
+_worker_state:dict = dict()
+
+#R-matrix sources are either the path of a binary or sparse r-matrix (memory-mapped), the directory of a shard store (shards memory-mapped on first access) or the arguments of a RewardProvider (rewards computed on demand by each process)
+#Raises if r_matrix_source is none of them (text r-matrixes, or matrixes instead of their paths or arguments)
+def check_r_matrix_source(r_matrix_source) -> None:
+    if (isinstance(r_matrix_source, dict)):
+        return
+    if (not isinstance(r_matrix_source, str)):
+        raise ValueError(f"ERROR. R-matrix sources must be a path or the arguments of a RewardProvider, not a {type(r_matrix_source).__name__}")
+    if (not is_binary_matrix_file(r_matrix_source)) and (not is_sparse_matrix_file(r_matrix_source)) and (not is_shard_directory(r_matrix_source)):
+        raise ValueError(f"ERROR. {r_matrix_source} is not a binary ({MATRIX_EXTENSION}) nor sparse ({SPARSE_EXTENSION}) r-matrix, nor a shard store. Convert text r-matrixes first with 'python Matrix_storage.py <matrix>.txt <matrix>{MATRIX_EXTENSION}'")
+
+def open_r_matrix(r_matrix_source):
+    check_r_matrix_source(r_matrix_source)
+    if (isinstance(r_matrix_source, dict)):
+        return RewardProvider(**r_matrix_source)
+    if (is_shard_directory(r_matrix_source)):
+        return ShardedMatrix(r_matrix_source)
+    if (is_sparse_matrix_file(r_matrix_source)):
+        return load_sparse_matrix(r_matrix_source)
+    return load_binary_matrix(r_matrix_source)
+
+def _init_worker(r_matrix_source, wall_index:list[int], train_args:tuple, seed:int, metrics_path:str = None, train_mode:str = "episodes") -> None:
+    _worker_state.clear()
+    if (metrics_path is not None): #Every process appends its own snapshots (tagged by pid) to the same file
+        configure_metrics(metrics_path)
+    _worker_state["r_matrix"] = open_r_matrix(r_matrix_source)
+    _worker_state["wall_index"] = wall_index
+    _worker_state["train_args"] = train_args
+    _worker_state["seed"] = seed
+    _worker_state["train_mode"] = train_mode
+
+#Seed for the random generator of a given target. Each target gets its own stream, so results do not depend on worker count nor scheduling
+def target_seed(seed:int, position:int) -> str:
+    return f"{seed}:{position}"
+
+#Values of a player table as exchanged with workers: (values, masks). Masks are None for dense q-matrixes
+def table_values(q_matrix, position:int) -> tuple[np.ndarray, np.ndarray]:
+    if (isinstance(q_matrix, SparseMatrix)):
+        q_table = q_matrix[position]
+        return np.asarray(q_table.packed), np.asarray(q_table.masks)
+    return np.asarray(q_matrix[position].data), None
+
+#Write trained values of a player table back into its q-matrix
+def store_table_values(q_matrix, position:int, values:np.ndarray) -> None:
+    if (isinstance(q_matrix, SparseMatrix)):
+        q_matrix[position].packed[:] = values
+    else:
+        q_matrix[position].data[:] = values
+
+#Train ghosts for a single target position, starting from the given q-table values (and masks, for sparse q-tables). Returns (position, trained values, error list)
+def _train_target(task:tuple[int, np.ndarray, np.ndarray]) -> tuple[int, np.ndarray, list[float]]:
+    position, values, masks = task
+    r_matrix = _worker_state["r_matrix"]
+    is_sparse = masks is not None
+    is_solved = _worker_state["train_mode"] == "value_iteration"
+    if (is_sparse) and (not is_solved):
+        q_matrix = SparseMatrix(masks[None].copy(), values.copy(), [position], r_matrix.ghost_pairs, r_matrix.dimension, r_matrix.is_conmutative, 0)
+    elif (is_sparse): #Value iteration works on dense tables, so sparse tables are expanded (illegal actions as 0) and packed back once solved
+        legal = ((masks[:, None].astype(np.uint32) >> np.arange(ACTION_COUNT, dtype=np.uint32)) & 1).astype(bool)
+        q_table = np.zeros((len(masks), ACTION_COUNT), dtype=values.dtype)
+        q_table[legal] = values
+        q_matrix = DenseMatrix(q_table[None], [position], r_matrix.ghost_pairs, r_matrix.dimension, r_matrix.is_conmutative)
+    else:
+        q_matrix = DenseMatrix(values[None].copy(), [position], r_matrix.ghost_pairs, r_matrix.dimension, r_matrix.is_conmutative)
+    ai_brain = GhostAI((79,82,position), _worker_state["wall_index"], r_matrix.dimension, q_matrix, 1)
+    if (_worker_state["seed"] is not None):
+        random.seed(target_seed(_worker_state["seed"], position))
+
+    if (is_solved):
+        print(f"Training begin ({position}). Value iteration")
+        ai_brain.solve_value_iteration(r_matrix, *_worker_state["train_args"])
+        error_list = [round(ai_brain.compute_error(r_matrix), 6)]
+    else:
+        episode_count, max_steps = _worker_state["train_args"][3], _worker_state["train_args"][4]
+        print(f"Training begin ({position}). {episode_count} Episodes of maximum {max_steps} steps each")
+        error_list = ai_brain.simulate_train(r_matrix, True, *_worker_state["train_args"])
+    print(f"Training ended ({position}). Error: {error_list[-1]}. Episodes: {len(error_list)}")
+    metrics = get_metrics()
+    metrics.count("train.targets")
+    if (metrics.export_path is not None):
+        metrics.export()
+    if (is_sparse) and (is_solved):
+        return position, q_matrix.data[0][legal], error_list
+    if (is_sparse):
+        return position, q_matrix.packed, error_list
+    return position, q_matrix.data[0], error_list
+
+#Train every target position (serially if workers <= 1, on a process pool otherwise), merging each trained table back into q_matrix as soon as it is done.
+#Returns an iterator of (position, error list) in completion order. train_args are the simulate_train arguments after randomize_ghost_pos: (epsilon_delta, learn_rate, gamma, episode_count, max_steps, ...)
+#If train_mode is 'value_iteration', tables are solved instead and train_args are the solve_value_iteration arguments: (gamma, tolerance, max_iterations). Error lists then hold the final error only
+#If metrics_path is given, training metrics are exported there (JSON lines) after every target. q_matrix can be dense or sparse
+#Arguments are checked (and the r-matrix opened) right away, before any worker starts: a worker that fails to initialize is respawned by the pool forever
+def train_targets(r_matrix_source, q_matrix:DenseMatrix, wall_index:list[int], target_positions:list[int], train_args:tuple, workers:int = 1, seed:int = None, metrics_path:str = None, train_mode:str = "episodes"):
+    if (train_mode not in ("episodes", "value_iteration")):
+        raise ValueError("Train mode can only be 'episodes' or 'value_iteration'")
+    if (not isinstance(q_matrix, (DenseMatrix, SparseMatrix))):
+        raise ValueError("ERROR. Targets can only be trained over dense or sparse q-matrixes")
+    if (workers <= 1):
+        _init_worker(r_matrix_source, wall_index, train_args, seed, metrics_path, train_mode)
+        pool = None
+    else:
+        open_r_matrix(r_matrix_source)
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(r_matrix_source, wall_index, train_args, seed, metrics_path, train_mode))
+    return _merge_results(q_matrix, target_positions, pool)
+
+#Train targets on pool (or on this process, if None) and merge them back into q_matrix
+def _merge_results(q_matrix:DenseMatrix, target_positions:list[int], pool:multiprocessing.Pool):
+    tasks = ((position,) + table_values(q_matrix, position) for position in target_positions)
+    results = map(_train_target, tasks) if (pool is None) else pool.imap_unordered(_train_target, tasks)
+    try:
+        for position, q_table, error_list in results:
+            store_table_values(q_matrix, position, q_table)
+            yield position, error_list
+    finally:
+        if (pool is not None):
+            pool.terminate()
+        _worker_state.clear()
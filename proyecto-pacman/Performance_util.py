@@ -1,15 +1,227 @@
+import os
+import csv
+import json
+import math
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+try:
+    import resource #Peak memory of the process (not available on Windows)
+except ImportError:
+    resource = None
+
 import time 
+METRICS_FORMATS = ("jsonl", "csv")
 #Get timestamp as string, in format DDMMYY_hhmm
 def get_timestamp() -> str:
     time_struct = time.localtime(time.time())
     stamp = str(time_struct.tm_mday) + str(time_struct.tm_mon) + str(time_struct.tm_year)[2:] + "_" + str(time_struct.tm_hour) + str(time_struct.tm_min)
     return stamp
-# Print time taken (in seconds) to sucessfully compute the given function call
+# Print time taken (in seconds) to sucessfully compute the given function call. Timing is also recorded as a timer (named after the function) on the active metrics recorder
 def performance_decorator(function):
     def wrapper(*args, **kwargs):
         timestamp = time.time()
         result = function(*args, **kwargs)
-        print(f"{function.__name__} completed in {round(time.time() - timestamp, 4)}s")
+        elapsed = time.time() - timestamp
+        get_metrics().record_time(function.__name__, elapsed)
+        print(f"{function.__name__} completed in {round(elapsed, 4)}s")
         return result
     
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+# NOTE - Metrics are kept in memory by a MetricsRecorder and exported as snapshots (one JSON object per line, or long-format CSV rows), so long runs can be graphed without parsing console output
+# Recording is cheap (a few dictionary updates), so hot loops record once per episode or per task, never once per step
+
+#Summary of observed values. Buckets have power-of-two upper bounds, so quantiles are approximate (within a factor of two) but memory stays constant
+class Histogram:
+    def __init__(self):
+        self._count:int = 0
+        self._total:float = 0.0
+        self._min:float = None
+        self._max:float = None
+        self._buckets:dict[int,int] = dict() #Bucket exponent -> count. Bucket e holds values in (2^(e-1), 2^e]
+
+    def observe(self, value:float) -> None:
+        self._count += 1
+        self._total += value
+        if (self._min is None) or (value < self._min):
+            self._min = value
+        if (self._max is None) or (value > self._max):
+            self._max = value
+        exponent = math.ceil(math.log2(value)) if (value > 0) else -1075 #Non-positive values share the lowest bucket
+        self._buckets[exponent] = self._buckets.get(exponent, 0) + 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+    @property
+    def total(self) -> float:
+        return self._total
+    @property
+    def mean(self) -> float:
+        return (self._total / self._count) if (self._count > 0) else None
+
+    #Approximate quantile (upper bound of the bucket holding it, capped by the max observed value)
+    def quantile(self, fraction:float) -> float:
+        if (self._count == 0):
+            return None
+        target = fraction * self._count
+        acc = 0
+        for exponent in sorted(self._buckets.keys()):
+            acc += self._buckets[exponent]
+            if (acc >= target):
+                return min(2.0**exponent, self._max) if (exponent > -1075) else self._min
+        return self._max
+
+    def to_dict(self) -> dict:
+        return {"count": self._count, "total": self._total, "mean": self.mean, "min": self._min, "max": self._max, "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
+
+#Named counters, histograms and timers (histograms of seconds). If an export path is given, snapshots are appended to it by export(), or by maybe_export() once every export_interval seconds
+class MetricsRecorder:
+    def __init__(self, export_path:str = None, export_format:str = "jsonl", export_interval:float = 60.0):
+        if (export_format not in METRICS_FORMATS):
+            raise ValueError(f"Metrics format can only be one of {METRICS_FORMATS}")
+        self._export_path = export_path
+        self._export_format = export_format
+        self._export_interval = export_interval
+        self.reset()
+
+    @property
+    def counters(self) -> dict[str,int]:
+        return self._counters
+    @property
+    def histograms(self) -> dict[str,Histogram]:
+        return self._histograms
+    @property
+    def timers(self) -> dict[str,Histogram]:
+        return self._timers
+    @property
+    def export_path(self) -> str:
+        return self._export_path
+
+    def reset(self) -> None:
+        self._counters:dict[str,int] = dict()
+        self._histograms:dict[str,Histogram] = dict()
+        self._timers:dict[str,Histogram] = dict()
+        self._start_time:float = time.time()
+        self._last_export:float = time.time()
+        self._last_counters:dict[str,int] = dict() #Counter values on last export, used to compute rates
+
+    def count(self, name:str, amount:int = 1) -> None:
+        self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name:str, value:float) -> None:
+        if (name not in self._histograms):
+            self._histograms[name] = Histogram()
+        self._histograms[name].observe(value)
+
+    def record_time(self, name:str, seconds:float) -> None:
+        if (name not in self._timers):
+            self._timers[name] = Histogram()
+        self._timers[name].observe(seconds)
+
+    #Time the enclosed block under the given name
+    @contextmanager
+    def timer(self, name:str):
+        timestamp = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.perf_counter() - timestamp)
+
+    #Current state of every metric. Rates are counter increments per second since the previous export
+    def snapshot(self) -> dict:
+        now = time.time()
+        interval = max(now - self._last_export, 1e-9)
+        return {
+            "time": round(now, 3),
+            "pid": os.getpid(),
+            "elapsed": round(now - self._start_time, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "counters": dict(self._counters),
+            "rates": {name: round((value - self._last_counters.get(name, 0)) / interval, 3) for name, value in self._counters.items()},
+            "timers": {name: timer.to_dict() for name, timer in self._timers.items()},
+            "histograms": {name: histogram.to_dict() for name, histogram in self._histograms.items()},
+        }
+
+    #Append a snapshot to the export file (or the given path). Returns the snapshot
+    def export(self, filename:str = None) -> dict:
+        filename = self._export_path if (filename is None) else filename
+        snapshot = self.snapshot()
+        if (filename is not None):
+            directory = os.path.dirname(filename)
+            if (directory != ""):
+                os.makedirs(directory, exist_ok=True)
+            if (self._export_format == "jsonl"):
+                with open(filename, 'a') as file:
+                    file.write(json.dumps(snapshot) + "\n")
+            else:
+                write_header = (not os.path.exists(filename)) or (os.path.getsize(filename) == 0)
+                with open(filename, 'a', newline="") as file:
+                    writer = csv.writer(file)
+                    if (write_header):
+                        writer.writerow(["time", "pid", "metric", "field", "value"])
+                    writer.writerows([snapshot["time"], snapshot["pid"], metric, field, value] for metric, field, value in flatten_snapshot(snapshot))
+        self._last_export = time.time()
+        self._last_counters = dict(self._counters)
+        return snapshot
+
+    #Export only if export_interval seconds passed since the last export (and there is somewhere to export to)
+    def maybe_export(self) -> None:
+        if (self._export_path is not None) and (time.time() - self._last_export >= self._export_interval):
+            self.export()
+
+#Snapshot as (metric, field, value) rows, as written on CSV exports
+def flatten_snapshot(snapshot:dict) -> list[tuple[str,str,float]]:
+    rows:list[tuple[str,str,float]] = [("process", "elapsed", snapshot["elapsed"]), ("process", "peak_rss_mb", snapshot["peak_rss_mb"])]
+    rows.extend((name, "count", value) for name, value in snapshot["counters"].items())
+    rows.extend((name, "rate", value) for name, value in snapshot["rates"].items())
+    for group in ("timers", "histograms"):
+        for name, summary in snapshot[group].items():
+            rows.extend((name, field, value) for field, value in summary.items())
+    return rows
+
+#Peak resident memory of this process in MB (None if it cannot be measured on this platform)
+def peak_rss_mb() -> float:
+    if (resource is None):
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024, 3) #Linux reports KB
+
+#Active recorder, shared by every instrumented function of this process
+_metrics = MetricsRecorder()
+
+def get_metrics() -> MetricsRecorder:
+    return _metrics
+
+#Replace the active recorder with a new one exporting to the given path. Returns it
+def configure_metrics(export_path:str = None, export_format:str = "jsonl", export_interval:float = 60.0) -> MetricsRecorder:
+    global _metrics
+    _metrics = MetricsRecorder(export_path, export_format, export_interval)
+    return _metrics
+
+#Profile the enclosed block with cProfile (and tracemalloc, if memory is set). Stats are saved to output_dir (as <name>_<timestamp>.prof, readable with pstats) or printed if none is given. Time and peak traced memory are recorded on the active recorder
+@contextmanager
+def profile_capture(name:str, output_dir:str = None, memory:bool = False, print_limit:int = 20):
+    profiler = cProfile.Profile()
+    if (memory):
+        tracemalloc.start()
+    timestamp = time.perf_counter()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        metrics = get_metrics()
+        metrics.record_time(f"profile.{name}", time.perf_counter() - timestamp)
+        if (memory):
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            metrics.observe(f"profile.{name}.peak_traced_mb", peak_memory / 2**20)
+            print(f"INFO. {name} peak traced memory: {round(peak_memory / 2**20, 3)}MB")
+        if (output_dir is not None):
+            os.makedirs(output_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(output_dir, f"{name}_{get_timestamp()}.prof"))
+        else:
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(print_limit)
@@ -0,0 +1,168 @@
+import struct
+import numpy as np
+from Matrix_storage import ACTION_COUNT, DATA_ALIGNMENT, DenseMatrix, build_ghost_pairs, build_lookups
+from Maze_topology import MazeTopology, get_topology
+from Sparse_storage import SparseMatrix
+
+#Used to monitor performance
+import time
+
+POLICY_EXTENSION = ".rqp"
+POLICY_MAGIC = b"RQPT"
+POLICY_VERSION = 1
+# Header layout: magic, version, width, height, is_conmutative, player count, pair count, best actions offset, tie masks offset
+POLICY_HEADER_FORMAT = "<4sHHHBIIQQ"
+POLICY_HEADER_SIZE = struct.calcsize(POLICY_HEADER_FORMAT)
+
+# NOTE - Playing only needs the greedy choice of every state, not its q-values. A policy table keeps, for every (player, ghost pair) state, the mask of optimal candidates pick_action would choose from (ties included) plus the first of them as an int8 (-1 if there are no legal actions)
+# Candidates follow pick_action: legal actions whose q-value is at least the max of the whole row (illegal actions count with their stored value), or every legal action if none is
+
+#Greedy candidate masks and first candidate of dense q-rows (n, 16), given the legal action masks of their ghost pairs
+def compile_rows(q_rows:np.ndarray, legal_masks:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    legal = ((legal_masks[:, None].astype(np.uint32) >> np.arange(ACTION_COUNT, dtype=np.uint32)) & 1).astype(bool)
+    candidates = legal & (q_rows >= q_rows.max(axis=1, keepdims=True))
+    candidates = np.where(candidates.any(axis=1, keepdims=True), candidates, legal)
+    ties = (candidates.astype(np.uint32) << np.arange(ACTION_COUNT, dtype=np.uint32)).sum(axis=1).astype(np.uint16)
+    best = np.where(candidates.any(axis=1), np.argmax(candidates, axis=1), -1).astype(np.int8)
+    return best, ties
+
+#Policy (player-position -> ghost pair -> greedy actions) compiled from a trained q-matrix
+class PolicyTable:
+    def __init__(self, best:np.ndarray, ties:np.ndarray, player_positions:list[int], ghost_pairs:list[tuple[int,int]], dimension:tuple[int,int], is_conmutative:bool):
+        if (best.shape != (len(player_positions), len(ghost_pairs))) or (ties.shape != best.shape):
+            raise ValueError(f"ERROR. Policy table arrays should be shaped ({len(player_positions)}, {len(ghost_pairs)})")
+        self._best = best
+        self._ties = ties
+        self._player_positions = list(player_positions)
+        self._ghost_pairs = list(ghost_pairs)
+        self._dimension = dimension
+        self._is_conmutative = is_conmutative
+        self._player_lookup, self._pair_lookup = build_lookups(self._player_positions, self._ghost_pairs, dimension)
+
+    #Compile a q-matrix (dense, sparse or nested dictionaries) into a policy table. Player tables are compiled one at a time, so memory-mapped and lazy matrixes are never fully loaded
+    @classmethod
+    def compile(cls, q_matrix, dimension:tuple[int,int], wall_index:list[int], verbose:bool = False) -> "PolicyTable":
+        timestamp = time.time()
+        topology:MazeTopology = get_topology(dimension, wall_index)
+        if (isinstance(q_matrix, (DenseMatrix, SparseMatrix))):
+            player_positions, ghost_pairs, is_conmutative = q_matrix.player_positions, q_matrix.ghost_pairs, q_matrix.is_conmutative
+        else: #Dictionary tables are keyed by canonical pairs
+            player_positions, ghost_pairs, is_conmutative = sorted(q_matrix.keys()), build_ghost_pairs(topology.open_cells, True), True
+        pair_array = np.asarray(ghost_pairs, dtype=np.int64).reshape(-1, 2)
+        legal_masks = topology.pair_masks(np.sort(pair_array, axis=1)) #GhostAI moves ghosts in (lower, higher) order
+        best = np.empty((len(player_positions), len(ghost_pairs)), dtype=np.int8)
+        ties = np.empty((len(player_positions), len(ghost_pairs)), dtype=np.uint16)
+        for index, player_pos in enumerate(player_positions):
+            table = q_matrix[player_pos]
+            if (isinstance(q_matrix, DenseMatrix)):
+                q_rows = np.asarray(table.data)
+            elif (isinstance(q_matrix, SparseMatrix)):
+                q_rows = table.expand()
+            else:
+                q_rows = np.asarray([table[pair] for pair in ghost_pairs])
+            best[index], ties[index] = compile_rows(q_rows, legal_masks)
+        if (verbose):
+            print(f"Policy compiled for {len(player_positions)} player positions (in {round(time.time() - timestamp, 4)}s)")
+        return cls(best, ties, player_positions, ghost_pairs, tuple(dimension), is_conmutative)
+
+    @property
+    def best(self) -> np.ndarray:
+        return self._best
+    @property
+    def ties(self) -> np.ndarray:
+        return self._ties
+    @property
+    def player_positions(self) -> list[int]:
+        return self._player_positions
+    @property
+    def ghost_pairs(self) -> list[tuple[int,int]]:
+        return self._ghost_pairs
+    @property
+    def dimension(self) -> tuple[int,int]:
+        return self._dimension
+    @property
+    def is_conmutative(self) -> bool:
+        return self._is_conmutative
+
+    #Transform player position into row index (or -1 if the position is not registered)
+    def player_index(self, player_pos:int) -> int:
+        if (player_pos < 0) or (player_pos >= len(self._player_lookup)):
+            return -1
+        return int(self._player_lookup[player_pos])
+    #Transform ghost positions into column index (or -1 if the pair is not registered)
+    def pair_index(self, ghost_pos:tuple[int,int]) -> int:
+        cell_count = len(self._player_lookup)
+        if (ghost_pos[0] < 0) or (ghost_pos[1] < 0) or (ghost_pos[0] >= cell_count) or (ghost_pos[1] >= cell_count):
+            return -1
+        return int(self._pair_lookup[ghost_pos[0]*cell_count + ghost_pos[1]])
+
+    #First greedy action index of a state (-1 if there are no legal actions)
+    def best_action(self, player_index:int, pair_index:int) -> int:
+        return int(self._best[player_index, pair_index])
+    #Mask of every greedy action index of a state
+    def tie_mask(self, player_index:int, pair_index:int) -> int:
+        return int(self._ties[player_index, pair_index])
+
+    def keys(self) -> list[int]:
+        return self._player_positions
+    def __contains__(self, player_pos:int) -> bool:
+        return self.player_index(player_pos) != -1
+    def __iter__(self):
+        return iter(self._player_positions)
+    def __len__(self) -> int:
+        return len(self._player_positions)
+
+#Save a policy table into a binary file: header, player positions, ghost pairs, best actions and tie masks. If it already exists, overwrites it.
+def save_policy_table(policy:PolicyTable, filename:str) -> None:
+    timestamp = time.time()
+    def align(offset:int) -> int:
+        return offset + (-offset) % DATA_ALIGNMENT
+    best_offset = align(POLICY_HEADER_SIZE + 4*len(policy.player_positions) + 8*len(policy.ghost_pairs))
+    ties_offset = align(best_offset + policy.best.size)
+    with open(filename, 'wb') as file:
+        file.write(struct.pack(POLICY_HEADER_FORMAT, POLICY_MAGIC, POLICY_VERSION, policy.dimension[0], policy.dimension[1], int(policy.is_conmutative), len(policy.player_positions), len(policy.ghost_pairs), best_offset, ties_offset))
+        file.write(np.asarray(policy.player_positions, dtype="<i4").tobytes())
+        file.write(np.asarray(policy.ghost_pairs, dtype="<i4").reshape(-1, 2).tobytes())
+        file.write(b"\0" * (best_offset - file.tell()))
+        file.write(np.ascontiguousarray(policy.best, dtype=np.int8).tobytes())
+        file.write(b"\0" * (ties_offset - file.tell()))
+        file.write(np.ascontiguousarray(policy.ties, dtype="<u2").tobytes())
+    print(f"Policy saved successfully at {filename} (in {round(time.time() - timestamp, 4)}s)")
+
+#Open a policy table file (arrays are memory-mapped, so loading is instant)
+def load_policy_table(filename:str) -> PolicyTable:
+    with open(filename, 'rb') as file:
+        raw_header = file.read(POLICY_HEADER_SIZE)
+        if (len(raw_header) != POLICY_HEADER_SIZE):
+            raise ValueError(f"ERROR. File {filename} is too short to be a policy table")
+        magic, version, width, height, is_conmutative, player_count, pair_count, best_offset, ties_offset = struct.unpack(POLICY_HEADER_FORMAT, raw_header)
+        if (magic != POLICY_MAGIC):
+            raise ValueError(f"ERROR. File {filename} is not a policy table (bad magic number)")
+        if (version != POLICY_VERSION):
+            raise ValueError(f"ERROR. File {filename} has policy table version {version}, only version {POLICY_VERSION} is supported")
+        player_positions = np.frombuffer(file.read(4*player_count), dtype="<i4").tolist()
+        ghost_pairs = [tuple(pair) for pair in np.frombuffer(file.read(8*pair_count), dtype="<i4").reshape(-1, 2).tolist()]
+    shape = (player_count, pair_count)
+    best = np.memmap(filename, dtype=np.int8, mode="r", offset=best_offset, shape=shape)
+    ties = np.memmap(filename, dtype="<u2", mode="r", offset=ties_offset, shape=shape)
+    return PolicyTable(best, ties, player_positions, ghost_pairs, (width, height), bool(is_conmutative))
+
+#Policy table files are recognized by their extension
+def is_policy_file(filename:str) -> bool:
+    return filename.endswith(POLICY_EXTENSION)
+
+def main(argv:list[str] = None) -> None:
+    import argparse
+    from Agent_trainer import load_full_matrix
+    from Map_resources import MAP_PATH, load_map
+    parser = argparse.ArgumentParser(description="Compile a trained q-matrix (binary, sparse or text) into a greedy policy table for playing")
+    parser.add_argument("qmatrix")
+    parser.add_argument("output", help=f"Policy table file ({POLICY_EXTENSION})")
+    parser.add_argument("--map", default=MAP_PATH, help="Map file the q-matrix was trained on")
+    args = parser.parse_args(argv)
+    dimension, _, walls = load_map(args.map)
+    q_matrix = load_full_matrix(args.qmatrix, dimension, lazy=True)
+    save_policy_table(PolicyTable.compile(q_matrix, dimension, walls, verbose=True), args.output)
+
+if __name__ == "__main__":
+    main()
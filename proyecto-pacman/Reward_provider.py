@@ -0,0 +1,111 @@
+import numpy as np
+from collections import OrderedDict
+from Heatmap_engine import build_player_heatmaps, build_player_rewards
+from Matrix_storage import DenseTable, build_ghost_pairs, build_lookups
+from Maze_topology import get_topology
+from Parallel_builder import adjacent_positions
+from Performance_util import get_metrics
+
+# NOTE - Rewards of a player position only depend on its heatmaps and the heatmaps of the positions the player can move to, so tables can be built on first access instead of reading a pre-built r-matrix
+# Player tables and heatmaps are kept in separate LRU caches. Neighbor positions share heatmaps, so training targets in map order rebuilds few of them
+
+DEFAULT_MAX_TABLES = 16 #Reward tables kept in memory (~350KB each on the 18x9 map)
+DEFAULT_MAX_HEATMAPS = 16 #Heatmap arrays kept in memory (~3.6MB each on the 18x9 map)
+
+#Read-only r-matrix whose player tables are computed on demand, with the same values as Parallel_builder.build_reward_matrix. Behaves like a DenseMatrix (tables are DenseTables), so GhostAI trains on it directly
+class RewardProvider:
+    def __init__(self, dimension:tuple[int,int], base_matrix:list[int], wall_index:list[int], value:int = 400, decay:int = 50, stay_prize:int = 1000, time_multiplier:float = 0.3, is_conmutative:bool = True, max_tables:int = DEFAULT_MAX_TABLES, max_heatmaps:int = DEFAULT_MAX_HEATMAPS, dtype = np.int32):
+        if (max_tables < 1) or (max_heatmaps < 1):
+            raise ValueError("At least one table and one heatmap array must fit in memory")
+        self._dimension = tuple(dimension)
+        self._base_matrix = list(base_matrix)
+        self._value = value
+        self._decay = decay
+        self._stay_prize = stay_prize
+        self._time_multiplier = time_multiplier
+        self._is_conmutative = is_conmutative
+        self._max_tables = max_tables
+        self._max_heatmaps = max_heatmaps
+        self._dtype = np.dtype(dtype)
+
+        self._player_positions = get_topology(dimension, wall_index).open_cells
+        self._ghost_pairs = build_ghost_pairs(self._player_positions, is_conmutative)
+        self._pair_array = np.asarray(self._ghost_pairs, dtype=np.int64)
+        self._player_lookup, self._pair_lookup = build_lookups(self._player_positions, self._ghost_pairs, dimension)
+        self._tables:OrderedDict[int,np.ndarray] = OrderedDict()
+        self._heatmaps:OrderedDict[int,np.ndarray] = OrderedDict()
+
+    @property
+    def player_positions(self) -> list[int]:
+        return self._player_positions
+    @property
+    def ghost_pairs(self) -> list[tuple[int,int]]:
+        return self._ghost_pairs
+    @property
+    def dimension(self) -> tuple[int,int]:
+        return self._dimension
+    @property
+    def is_conmutative(self) -> bool:
+        return self._is_conmutative
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+    @property
+    def loaded_positions(self) -> list[int]:
+        return list(self._tables.keys())
+
+    #Transform player position into index of the layout (or -1 if the position is not registered)
+    def player_index(self, player_pos:int) -> int:
+        if (player_pos < 0) or (player_pos >= len(self._player_lookup)):
+            return -1
+        return int(self._player_lookup[player_pos])
+
+    #Get a value from an LRU cache, building (and inserting) it if missing
+    def _cached(self, cache:OrderedDict, limit:int, key:int, build, metric:str) -> np.ndarray:
+        entry = cache.get(key)
+        if (entry is not None):
+            cache.move_to_end(key)
+            return entry
+        entry = build(key)
+        entry.setflags(write=False) #Shared by every caller, must not change
+        cache[key] = entry
+        while (len(cache) > limit):
+            cache.popitem(last=False)
+        get_metrics().count(metric)
+        return entry
+
+    def _build_heatmaps(self, player_pos:int) -> np.ndarray:
+        return build_player_heatmaps(player_pos, self._pair_array, self._dimension, self._base_matrix, self._value, self._decay)
+
+    def _build_table(self, player_pos:int) -> np.ndarray:
+        adjacent_heatmaps = None
+        if (self._time_multiplier > 0):
+            adjacent_heatmaps = [self.heatmaps(position) for position in adjacent_positions(player_pos, self._dimension, self._player_positions)]
+        return build_player_rewards(self.heatmaps(player_pos), self._pair_array, self._dimension, self._stay_prize, self._time_multiplier, adjacent_heatmaps, self._dtype)
+
+    #Heatmap array (pairs, cells) of a player position
+    def heatmaps(self, player_pos:int) -> np.ndarray:
+        if (self.player_index(player_pos) == -1):
+            raise KeyError(player_pos)
+        return self._cached(self._heatmaps, self._max_heatmaps, player_pos, self._build_heatmaps, "rewards.heatmaps_built")
+
+    def keys(self) -> list[int]:
+        return self._player_positions
+    def values(self):
+        for player_pos in self._player_positions:
+            yield self[player_pos]
+    def items(self):
+        for player_pos in self._player_positions:
+            yield player_pos, self[player_pos]
+
+    def __getitem__(self, player_pos:int) -> DenseTable:
+        if (self.player_index(player_pos) == -1):
+            raise KeyError(player_pos)
+        data = self._cached(self._tables, self._max_tables, player_pos, self._build_table, "rewards.tables_built")
+        return DenseTable(data, self._ghost_pairs, self._pair_lookup, len(self._player_lookup), self._is_conmutative)
+    def __contains__(self, player_pos:int) -> bool:
+        return self.player_index(player_pos) != -1
+    def __iter__(self):
+        return iter(self._player_positions)
+    def __len__(self) -> int:
+        return len(self._player_positions)
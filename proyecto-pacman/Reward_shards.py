@@ -0,0 +1,195 @@
+import os
+import json
+import numpy as np
+from collections import OrderedDict
+from Matrix_storage import ACTION_COUNT, DenseTable, build_ghost_pairs, build_lookups, create_binary_matrix
+from Maze_topology import get_topology
+
+#Used to monitor performance
+import time
+
+SHARD_MANIFEST_NAME = "manifest.json"
+SHARD_DIRECTORY = "tables"
+SHARD_VERSION = 1
+DEFAULT_MAX_SHARDS = 16 #Shards kept open (memory-mapped) at once
+
+# NOTE - A shard store keeps the r-matrix of a map as one file (shard) per player position, plus a manifest with the map layout and reward settings. Shards are built independently, so the full matrix never needs to fit in memory (nor on a single file), and interrupted builds resume from the shards already on disk
+# Every shard is an .npy array shaped (pairs, 16), written through a temporary file. A shard that exists is always complete
+
+#Write a file through a temporary one, so readers see either nothing or the full content
+def _atomic_save(filename:str, array:np.ndarray) -> None:
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, 'wb') as file:
+        np.save(file, array)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_filename, filename)
+
+#Manifest path of a shard store
+def manifest_path(directory:str) -> str:
+    return os.path.join(directory, SHARD_MANIFEST_NAME)
+
+#Shard path of a player position
+def shard_path(directory:str, player_pos:int) -> str:
+    return os.path.join(directory, SHARD_DIRECTORY, f"{player_pos}.npy")
+
+#Shard stores are recognized by their manifest
+def is_shard_directory(path:str) -> bool:
+    return os.path.isfile(manifest_path(path))
+
+#Write the reward table of a player position into its shard
+def save_shard(directory:str, player_pos:int, table:np.ndarray) -> None:
+    _atomic_save(shard_path(directory, player_pos), table)
+
+#Create a shard store for the given map layout and reward settings (or reuse the one on directory, if it was created with the same ones). Returns its manifest
+def create_shard_store(directory:str, dimension:tuple[int,int], wall_index:list[int], settings:dict, is_conmutative:bool = True, dtype = np.int32, overwrite:bool = False) -> dict:
+    manifest = {
+        "version": SHARD_VERSION,
+        "dimension": list(dimension),
+        "wall_index": sorted(int(wall) for wall in wall_index),
+        "settings": dict(settings),
+        "is_conmutative": bool(is_conmutative),
+        "dtype": str(np.dtype(dtype)),
+    }
+    if (is_shard_directory(directory)) and (not overwrite):
+        with open(manifest_path(directory), 'r') as file:
+            previous = json.load(file)
+        if (previous != manifest):
+            raise ValueError(f"ERROR. Shard store on {directory} was built for another map or reward settings. Remove it (or overwrite it) first")
+        return previous
+    os.makedirs(os.path.join(directory, SHARD_DIRECTORY), exist_ok=True)
+    if (overwrite):
+        for name in os.listdir(os.path.join(directory, SHARD_DIRECTORY)):
+            os.remove(os.path.join(directory, SHARD_DIRECTORY, name))
+    temp_filename = manifest_path(directory) + ".tmp"
+    with open(temp_filename, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(temp_filename, manifest_path(directory))
+    return manifest
+
+#Read-only r-matrix backed by a shard store. Behaves like a DenseMatrix (tables are DenseTables over memory-mapped shards), so GhostAI trains on it directly
+class ShardedMatrix:
+    def __init__(self, directory:str, max_shards:int = DEFAULT_MAX_SHARDS):
+        if (not is_shard_directory(directory)):
+            raise ValueError(f"ERROR. There is no shard store on {directory}")
+        if (max_shards < 1):
+            raise ValueError("At least one shard must be kept open")
+        with open(manifest_path(directory), 'r') as file:
+            manifest = json.load(file)
+        if (manifest["version"] != SHARD_VERSION):
+            raise ValueError(f"ERROR. Unsupported shard store version {manifest['version']} on {directory}")
+        self._directory = directory
+        self._manifest = manifest
+        self._dimension = tuple(manifest["dimension"])
+        self._wall_index:list[int] = manifest["wall_index"]
+        self._is_conmutative:bool = manifest["is_conmutative"]
+        self._dtype = np.dtype(manifest["dtype"])
+        self._max_shards = max_shards
+        self._player_positions = get_topology(self._dimension, self._wall_index).open_cells
+        self._ghost_pairs = build_ghost_pairs(self._player_positions, self._is_conmutative)
+        self._player_lookup, self._pair_lookup = build_lookups(self._player_positions, self._ghost_pairs, self._dimension)
+        self._shards:OrderedDict[int,np.ndarray] = OrderedDict()
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+    @property
+    def settings(self) -> dict:
+        return self._manifest["settings"]
+    @property
+    def wall_index(self) -> list[int]:
+        return self._wall_index
+    @property
+    def player_positions(self) -> list[int]:
+        return self._player_positions
+    @property
+    def ghost_pairs(self) -> list[tuple[int,int]]:
+        return self._ghost_pairs
+    @property
+    def dimension(self) -> tuple[int,int]:
+        return self._dimension
+    @property
+    def is_conmutative(self) -> bool:
+        return self._is_conmutative
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+    @property
+    def loaded_positions(self) -> list[int]:
+        return list(self._shards.keys())
+
+    #Player positions whose shard is on disk
+    def built_positions(self) -> list[int]:
+        return [player_pos for player_pos in self._player_positions if os.path.isfile(shard_path(self._directory, player_pos))]
+    #Player positions whose shard is still missing
+    def missing_positions(self) -> list[int]:
+        return [player_pos for player_pos in self._player_positions if not os.path.isfile(shard_path(self._directory, player_pos))]
+
+    #Transform player position into index of the layout (or -1 if the position is not registered)
+    def player_index(self, player_pos:int) -> int:
+        if (player_pos < 0) or (player_pos >= len(self._player_lookup)):
+            return -1
+        return int(self._player_lookup[player_pos])
+
+    #Memory-mapped shard of a player position, kept in an LRU cache
+    def _open_shard(self, player_pos:int) -> np.ndarray:
+        shard = self._shards.get(player_pos)
+        if (shard is not None):
+            self._shards.move_to_end(player_pos)
+            return shard
+        filename = shard_path(self._directory, player_pos)
+        if (not os.path.isfile(filename)):
+            raise ValueError(f"ERROR. Shard of player position {player_pos} has not been built on {self._directory}")
+        shard = np.load(filename, mmap_mode="r")
+        if (shard.shape != (len(self._ghost_pairs), ACTION_COUNT)):
+            raise ValueError(f"ERROR. Shard {filename} does not match the layout of its store")
+        self._shards[player_pos] = shard
+        while (len(self._shards) > self._max_shards):
+            self._shards.popitem(last=False)
+        return shard
+
+    def keys(self) -> list[int]:
+        return self._player_positions
+    def values(self):
+        for player_pos in self._player_positions:
+            yield self[player_pos]
+    def items(self):
+        for player_pos in self._player_positions:
+            yield player_pos, self[player_pos]
+
+    def __getitem__(self, player_pos:int) -> DenseTable:
+        if (self.player_index(player_pos) == -1):
+            raise KeyError(player_pos)
+        return DenseTable(self._open_shard(player_pos), self._ghost_pairs, self._pair_lookup, len(self._player_lookup), self._is_conmutative)
+    def __contains__(self, player_pos:int) -> bool:
+        return self.player_index(player_pos) != -1
+    def __iter__(self):
+        return iter(self._player_positions)
+    def __len__(self) -> int:
+        return len(self._player_positions)
+
+#Assemble every shard of a store into a single binary matrix file, one table at a time
+def merge_shards(directory:str, filename:str, verbose:bool = False):
+    timestamp = time.time()
+    shards = ShardedMatrix(directory, 1)
+    missing = shards.missing_positions()
+    if (missing != []):
+        raise ValueError(f"ERROR. {len(missing)} shards have not been built on {directory} (first one is player position {missing[0]})")
+    matrix = create_binary_matrix(filename, shards.dimension, shards.player_positions, shards.ghost_pairs, shards.is_conmutative, shards.dtype)
+    for index, player_pos in enumerate(shards.player_positions):
+        matrix.data[index] = shards[player_pos].data
+    matrix.data.flush()
+    if (verbose):
+        print(f"Shards merged successfully at {filename} (in {round(time.time() - timestamp, 4)}s)")
+    return matrix
+
+def main(argv:list[str] = None) -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description="Assemble a shard store (built with 'python Rmatrix_populator.py --shards <directory>') into a single binary r-matrix")
+    parser.add_argument("directory")
+    parser.add_argument("output", help="Binary matrix file (.rqm)")
+    args = parser.parse_args(argv)
+    merge_shards(args.directory, args.output, True)
+
+if __name__ == "__main__":
+    main()
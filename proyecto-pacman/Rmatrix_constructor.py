@@ -1,36 +1,9 @@
-IN_FILENAME = "base-files/map.txt"
-OUT_FILENAME = "base-files/base_r.txt"
-WALL_FILENAME = "base-files/wall_index.txt"
-base_map: list[int] = []
-wall_index: list[int] = []
+import argparse
+from Map_resources import MAP_PATH, BASE_PATH, WALL_PATH, clear_cache, parse_map, write_index_file
 
-#LOAD MAP
-with open(IN_FILENAME, 'r') as file:
-    map_height:int = 0
-    map_width:int = -1
-    for row,line in enumerate(file.readlines()):
-        map_height += 1
-        line = line.strip("\n")
-
-        if (map_width == -1):
-            map_width = len(line)
-        elif (map_width != len(line)):
-            raise ValueError("Map must be of fixed width")
-        
-        for i in range(map_width):
-            base_map.append(0)
-
-        for column,char in enumerate(line):
-            if (char == "O"):
-                base_map[map_width*row + (column)] = 0 #Set current square as 'legal' move
-            elif (char == "X"):
-                base_map[map_width*row + (column)] = -1 #Set current square as 'illegal' move
-                wall_index.append(map_width*row + (column))
-            else:
-                raise ValueError("Squares must be either spaces (O) or walls (X)")
-    
-    #Show that loading was successful
-    print(f"SIZE {map_width}x{map_height}")
+#Show a loaded map on console, walls in red
+def print_map(dimension:tuple[int,int], base_map:list[int], wall_index:list[int]) -> None:
+    print(f"SIZE {dimension[0]}x{dimension[1]}")
     acc = 0
     for square in base_map:
         if square == 0:
@@ -38,23 +11,33 @@ with open(IN_FILENAME, 'r') as file:
         else:
             print("\033[91m" + "X" + "\033[0m", end="")
         acc += 1
-        if (acc >= map_width):
+        if (acc >= dimension[0]):
             acc = 0
             print()
     print(f"\nWALLS ({len(wall_index)})\n",wall_index)
 
-#SAVE BASE R-MATRIX
-with open(OUT_FILENAME, 'w') as file:
-    for index,value in enumerate(base_map):
-        file.write(str(value))
-        if index < (len(base_map) - 1):
-            file.write("|")
-    print(f"\nSaved result to file at ({OUT_FILENAME})")
+#Build base r-matrix and wall index files from a map file. Returns (dimension, base r-matrix, wall index)
+def build_base_files(map_filename:str = MAP_PATH, base_filename:str = BASE_PATH, wall_filename:str = WALL_PATH, verbose:bool = True) -> tuple[tuple[int,int], list[int], list[int]]:
+    dimension, base_map, wall_index = parse_map(map_filename)
+    if (verbose): #Show that loading was successful
+        print_map(dimension, base_map, wall_index)
+    write_index_file(base_map, base_filename)
+    if (verbose):
+        print(f"\nSaved result to file at ({base_filename})")
+    write_index_file(wall_index, wall_filename)
+    if (verbose):
+        print(f"Also, saved wall index to file at ({wall_filename})")
+    clear_cache() #Files read before this point are stale
+    return dimension, base_map, wall_index
+
+def main(argv:list[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Build base r-matrix and wall index files from a map of 'O' (open) and 'X' (wall) squares")
+    parser.add_argument("--map", default=MAP_PATH)
+    parser.add_argument("--base", default=BASE_PATH, help="Base r-matrix output file")
+    parser.add_argument("--walls", default=WALL_PATH, help="Wall index output file")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+    build_base_files(args.map, args.base, args.walls, not args.quiet)
 
-#SAVE WALL INDEX
-with open(WALL_FILENAME, 'w') as file:
-    for index,value in enumerate(wall_index):
-        file.write(str(value))
-        if index < (len(wall_index) - 1):
-            file.write("|")
-    print(f"Also, saved wall index to file at ({WALL_FILENAME})")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,29 @@
-BASE_PATH = "base-files/base_r.txt"
-WALL_PATH = "base-files/wall_index.txt"
 OUTPUT_PATH = "output-files/heatmaps.txt"
 SIMPLE_REWARD_OUT_PATH = "output-files/simple_reward.txt"
 COMPOUND_REWARD_OUT_PATH = "output-files/compound_reward_30.txt"
+R_MATRIX_OUT_PATH = "output-files/rmatrix_v2.rqm"
+SAVE_BUFFER_SIZE = 1 << 20 #Write buffer for text matrixes (bytes)
 
 #Used to monitor performance
 import time 
+import threading
+import numpy as np
+from Maze_topology import MazeTopology, get_topology
+from Heatmap_engine import build_player_heatmaps
+from Matrix_storage import DenseTable, build_ghost_pairs, snapshot_matrix
+from Parallel_builder import build_heatmap_array, build_reward_array, build_reward_matrix, build_reward_shards, default_workers
+from Performance_util import get_metrics
+from Map_resources import MAP_PATH, load_base, load_map, load_walls #Map files are read (and cached) on first use, never on import
 
 # NOTE - ALL state tuples are given as (ghost1-pos, ghost2-pos, player-pos)
 
-#Load base r-matrix from specified file
-def load_base(filename:str = BASE_PATH) -> list[int]:
-    base_matrix:list[int] = []
-    with open(filename, 'r') as file:
-        file_str = file.read()
-        for value in file_str.split("|"):
-            base_matrix.append(int(value))
-    return base_matrix
-#Load index with all possible wall positions
-def load_walls(filename:str = WALL_PATH) -> list[int]:
-    wall_matrix:list[int] = []
-    with open(filename, 'r') as file:
-        file_str = file.read()
-        for value in file_str.split("|"):
-            wall_matrix.append(int(value))
-    return wall_matrix
-
-#Utility to help traverse the map. Returns new position in map or -1 if the desired action is illegal
-def parse_action(initial_pos:int, action:int, dimension:tuple[int,int]) -> int:
-    match action:
-        case -1: #Stay
-            return initial_pos
-        case 0: #Move North
-            candidate = initial_pos - dimension[0]
-            if ( candidate < 0 ):
-                return -1
-            return candidate
-        case 1: #Move East
-            if ( (initial_pos % dimension[0]) == (dimension[0] - 1) ):
-                return -1
-            return (initial_pos + 1)
-        case 2: #Move South
-            candidate = initial_pos + dimension[0]
-            if ( candidate > ((dimension[0]*dimension[1])-1) ):
-                return -1
-            return candidate
-        case 3: #Move West
-            if ( (initial_pos % dimension[0]) == (0) ):
-                return -1
-            return (initial_pos - 1)
-        case _: #Illegal action
-            raise ValueError("Action can only be stay (-1); or move north (0), east (1), south (2) or west (3)")
-
-#Populate given matrix with heatmap
+#Utility to help traverse the map. Returns new position in map or -1 if the desired action is illegal. Without topology, only map borders are checked (walls are left to the caller)
+def parse_action(initial_pos:int, action:int, dimension:tuple[int,int], topology:MazeTopology = None) -> int:
+    if (topology is None):
+        topology = get_topology(dimension)
+    return topology.move(initial_pos, action)
+
+#Populate given matrix with heatmap (recursive flood for a single state. Heatmap_engine builds the same heatmaps for many states at once)
 def populate_matrix(target:list[int], dimension:tuple[int,int], state:tuple[int,int,int], position:int = None, value:int = 400, decay:int = 50) -> list[int]:
     if (position is None):
         position = state[2]
@@ -68,41 +39,52 @@ def populate_matrix(target:list[int], dimension:tuple[int,int], state:tuple[int,
     return target
 
 #Construct dictionary with all possible combinations of ghost positions for a given player position (with associated heatmaps)
-def build_ghost_shifted(player_pos:int, dimension:tuple[int,int], value:int = 400, decay:int = 50, base_matrix:list[int] = load_base(), wall_index:list[int] = load_walls(), is_conmutative:bool = False) -> dict[tuple[int,int],list[int]]:
-    effective_range = []
-    for i in range(dimension[0]*dimension[1]):
-        if i not in wall_index:
-            effective_range.append(i)
+#If conmutative (default), only canonical (lower, higher) ghost pairs are kept. Otherwise swapped pairs are also listed, sharing the heatmap of their canonical pair
+#Base matrix and wall index default to the package's base files
+def build_ghost_shifted(player_pos:int, dimension:tuple[int,int], value:int = 400, decay:int = 50, base_matrix:list[int] = None, wall_index:list[int] = None, is_conmutative:bool = True) -> dict[tuple[int,int],list[int]]:
+    if (base_matrix is None):
+        base_matrix = load_base()
+    if (wall_index is None):
+        wall_index = load_walls()
+    effective_range = get_effective_range(dimension, wall_index)
 
     if (player_pos not in effective_range):
         raise ValueError("Player is not in a valid position. Cannot construct heatmaps")
     
-    r_heatmap_dict:dict[tuple[int,int],list[int]] = dict()
-
-    for ghost1_pos in effective_range:
-        for ghost2_pos in effective_range:
-            if (ghost1_pos != ghost2_pos):
-                if (ghost1_pos < ghost2_pos) or (not is_conmutative):
-                    state = (ghost1_pos, ghost2_pos, player_pos)
-                    ghost_pos = (ghost1_pos,ghost2_pos)
-                    r_heatmap_matrix:list[int] = populate_matrix(base_matrix.copy(), dimension, state, None, value, decay) 
-                    r_heatmap_dict[ghost_pos] = r_heatmap_matrix
+    ghost_pairs = build_ghost_pairs(effective_range, is_conmutative)
+    heatmaps = build_player_heatmaps(player_pos, ghost_pairs, dimension, base_matrix, value, decay) #All heatmaps of this player position are built at once
+    r_heatmap_dict:dict[tuple[int,int],list[int]] = dict(zip(ghost_pairs, heatmaps.tolist()))
     return r_heatmap_dict   
 
+#List of squares that are not walls
+def get_effective_range(dimension:tuple[int,int], wall_index:list[int]) -> list[int]:
+    wall_set = set(wall_index)
+    return [i for i in range(dimension[0]*dimension[1]) if i not in wall_set]
+
 #Construct dictionary with all possible state combinations. Keys are the player's states and value are dictionaries that contain r-matrixes as values and ghost-positions as keys
-def build_full_shifted(dimension:tuple[int,int], value:int = 400, decay:int = 50, base_matrix:list[int] = load_base(), wall_index:list[int] = load_walls(), verbose:bool = False, is_conmutative:bool = False) -> dict[int,dict[tuple[int,int],list[int]]]:
-    effective_range = []
-    for i in range(dimension[0]*dimension[1]):
-        if i not in wall_index:
-            effective_range.append(i)
+#If workers is higher than one, player positions are split across a process pool. Base matrix and wall index default to the package's base files
+def build_full_shifted(dimension:tuple[int,int], value:int = 400, decay:int = 50, base_matrix:list[int] = None, wall_index:list[int] = None, verbose:bool = False, is_conmutative:bool = True, workers:int = 1) -> dict[int,dict[tuple[int,int],list[int]]]:
+    if (base_matrix is None):
+        base_matrix = load_base()
+    if (wall_index is None):
+        wall_index = load_walls()
+    if (workers > 1):
+        player_positions, ghost_pairs, heatmaps = build_heatmap_array(dimension, value, decay, base_matrix, wall_index, is_conmutative, workers, verbose)
+        return {player_pos: dict(zip(ghost_pairs, heatmaps[index].tolist())) for index, player_pos in enumerate(player_positions)}
+
+    effective_range = get_effective_range(dimension, wall_index)
     
     heatmap_dict:dict[int,dict[tuple[int,int],list[int]]] = dict()
 
     print_acc = [0, 1]
     timestamp = time.time()
+    metrics = get_metrics()
     for position in effective_range:
-        r_heatmap_dict = build_ghost_shifted(position, dimension, value, decay, base_matrix, wall_index, is_conmutative)
+        with metrics.timer("build.heatmaps.player"):
+            r_heatmap_dict = build_ghost_shifted(position, dimension, value, decay, base_matrix, wall_index, is_conmutative)
         heatmap_dict[position] = r_heatmap_dict
+        metrics.count("build.heatmaps", len(r_heatmap_dict))
+        metrics.maybe_export()
         if (verbose):
             print_acc[0] += 1
             if ( print_acc[0] >= len(effective_range)*0.05 ):
@@ -176,22 +158,42 @@ def traverse_ghost_matrix(ghost_shifted_matrix:dict[tuple[int,int],list[int]], d
             else:
                 state = (newPos_g1, newPos_g2, state[2])
 
+#Format every state of a player table as text lines (one 'g1|g2|p = v1|v2|...' line per state, as load_full_matrix reads them) in a single string
+#Rows of equal length are formatted with a single template over all their values, instead of concatenating value by value
+def format_table_block(player_pos:int, table) -> str:
+    if (isinstance(table, DenseTable)) and (table.data.dtype.kind in "iu"):
+        keys = table.keys()
+        rows = table.data.tolist() #Plain integers print exactly like array values
+    else:
+        keys = list(table.keys())
+        rows = [table[ghost_pos] for ghost_pos in keys]
+    lengths = {len(row) for row in rows}
+    if (len(lengths) > 1): #Uneven rows, format one by one
+        return "".join(format_table_block(player_pos, {ghost_pos: row}) for ghost_pos, row in zip(keys, rows))
+    if (len(lengths) == 0):
+        return ""
+    line = "%s|%s|" + str(player_pos) + " = " + "|".join(["%s"]*lengths.pop()) + "\n"
+    values:list = []
+    for ghost_pos, row in zip(keys, rows):
+        values.append(ghost_pos[0])
+        values.append(ghost_pos[1])
+        values.extend(row)
+    return (line*len(rows)) % tuple(values)
+
 #Save a full heatmap - with all possible state configurations - into target file. If it already exists, overwrites it.
 #NOTE This can also be used to save r-matrixes since they have the same structure, only with different values inside. Whoops.
-def save_full_matrix(full_matrix:dict[int,dict[tuple[int,int],list[int]]], filename:str, verbose:bool = False) -> None:
+#Each player position block is formatted and written at once. If background, a copy of the matrix is written on a separate thread (so the original may keep changing meanwhile), and the thread is returned
+def save_full_matrix(full_matrix:dict[int,dict[tuple[int,int],list[int]]], filename:str, verbose:bool = False, background:bool = False) -> threading.Thread:
+    if (background):
+        thread = threading.Thread(target=save_full_matrix, args=(snapshot_matrix(full_matrix), filename, verbose), name="save_full_matrix")
+        thread.start()
+        return thread
+
     print_acc = [0,1]
     timestamp = time.time()
-    with open(filename, 'w') as file:
+    with open(filename, 'w', buffering=SAVE_BUFFER_SIZE) as file:
         for player_pos in full_matrix.keys():
-            for ghost_pos in full_matrix[player_pos].keys():
-                state_str = str(ghost_pos[0]) + "|" + str(ghost_pos[1]) + "|" + str(player_pos)
-                data_str = ""
-                current_matrix = full_matrix[player_pos][ghost_pos]
-                for index,value in enumerate(current_matrix):
-                    data_str += str(value)
-                    if index < (len(current_matrix) - 1):
-                        data_str += "|"
-                file.write(state_str + " = " + data_str + "\n")
+            file.write(format_table_block(player_pos, full_matrix[player_pos]))
 
             if (verbose):
                 print_acc[0] += 1
@@ -200,6 +202,7 @@ def save_full_matrix(full_matrix:dict[int,dict[tuple[int,int],list[int]]], filen
                     print_acc[0] = 0
                     print_acc[1] += 1
     print(f"Matrix saved successfully at {filename} (in {round(time.time() - timestamp, 4)}s)")
+    return None
 
 #Generate r-matrixes using generated heatmaps as starting point. Adjacent player states represent ghost-shifted matrixes with player positions as where player may stand on time t+1. Returns state->action matrix. Actions sorted by sequence (0,0), (0,1), (0,2), ...
 #If time_multiplier is non-zero, and adjacent-player-states is not None, compounds available reward for time t with available reward for time t+1.
@@ -236,13 +239,22 @@ def to_reward_matrix(ghost_shifted_matrix:dict[tuple[int,int], list[int]], dimen
     return reward_matrix
 
 #Generate r-matrixes using fully generated heatmap combinations as starting point. Adjacent player states represent ghost-shifted matrixes with player positions as where player may stand on time t+1. Returns state->action matrix. Actions sorted by sequence (0,0), (0,1), (0,2), ...
-#If time multiplier is non-zero, compounds available reward for time t with available reward on time t+1
-def to_reward_combination(full_heatmap:dict[int,dict[tuple[int,int],list[int]]], dimension:tuple[int, int], stay_prize:int = 1000, time_multiplier:float = -1.0, verbose:bool = False) -> dict[int,dict[tuple[int,int],list[int]]]:
+#If time multiplier is non-zero, compounds available reward for time t with available reward on time t+1. If workers is higher than one, player positions are split across a process pool
+def to_reward_combination(full_heatmap:dict[int,dict[tuple[int,int],list[int]]], dimension:tuple[int, int], stay_prize:int = 1000, time_multiplier:float = -1.0, verbose:bool = False, workers:int = 1) -> dict[int,dict[tuple[int,int],list[int]]]:
+    if (workers > 1):
+        player_positions = list(full_heatmap.keys())
+        ghost_pairs = list(full_heatmap[player_positions[0]].keys())
+        heatmaps = np.array([[full_heatmap[player_pos][ghost_pos] for ghost_pos in ghost_pairs] for player_pos in player_positions], dtype=np.int32)
+        rewards = build_reward_array(heatmaps, player_positions, ghost_pairs, dimension, stay_prize, time_multiplier, workers, verbose)
+        return {player_pos: dict(zip(ghost_pairs, rewards[index].tolist())) for index, player_pos in enumerate(player_positions)}
+
     full_reward_matrix:dict[int,dict[tuple[int,int],list[int]]] = dict()
     
     print_acc:list[int] = [0,1]
     timestamp:float = time.time() #Monitor performance
+    metrics = get_metrics()
     for player_pos in full_heatmap.keys():
+        player_timestamp = time.perf_counter()
         adjacent_heatmap_list = None
         if (time_multiplier > 0):
             adjacent_heatmap_list = []
@@ -253,6 +265,9 @@ def to_reward_combination(full_heatmap:dict[int,dict[tuple[int,int],list[int]]],
         
         reward_matrix = to_reward_matrix(full_heatmap[player_pos], dimension, stay_prize, time_multiplier, adjacent_heatmap_list)
         full_reward_matrix[player_pos] = reward_matrix
+        metrics.record_time("build.rewards.player", time.perf_counter() - player_timestamp)
+        metrics.count("build.reward_rows", len(reward_matrix))
+        metrics.maybe_export()
 
         if (verbose):
             print_acc[0] += 1
@@ -264,11 +279,22 @@ def to_reward_combination(full_heatmap:dict[int,dict[tuple[int,int],list[int]]],
         print(f"Reward combination completed in {round(time.time() - timestamp, 4)}s")
     return full_reward_matrix
 
-if __name__ == "__main__": #Only execute building commands if this is the main file being executed
+#Build the default r-matrix (entry point of 'python Rmatrix_populator.py')
+def main(argv:list[str] = None) -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the conmutative r-matrix (time multiplier 0.3) of a map into a binary file, or into a shard store (one file per player position) for large maps")
+    parser.add_argument("--map", default=MAP_PATH, help="Map file to build rewards for")
+    parser.add_argument("--output", default=R_MATRIX_OUT_PATH)
+    parser.add_argument("--shards", default=None, help="Build into this shard store directory instead of --output. Interrupted builds resume from the shards on disk")
+    parser.add_argument("--workers", type=int, default=None, help="Processes used to build it (default all cores)")
+    args = parser.parse_args(argv)
+    dimension, base_map, walls = load_map(args.map)
+    workers = default_workers() if (args.workers is None) else args.workers
+
     #* Remove comments below to construct regular, non-conmutative, reward matrixes
 
     # #Now, we test full build and saving to file
-    # full_heatmap = build_full_shifted((18,9), 400, 50, verbose=True)
+    # full_heatmap = build_full_shifted((18,9), 400, 50, verbose=True, is_conmutative=False)
     # # print("Trying to save to txt file...") #WARNING. File weights ~520Mb
     # # save_full_matrix(full_heatmap, OUTPUT_PATH, True)
 
@@ -284,10 +310,11 @@ if __name__ == "__main__": #Only execute building commands if this is the main f
 
 
     #* Remove comments below to construct conmutative reward matrixes
-    full_conm_heatmap = build_full_shifted((18,9), 400, 50, verbose=True, is_conmutative=True)
-    print("Reward construction")
-    conm_reward = to_reward_combination(full_conm_heatmap, (18,9), 1000, 0.3, True)
-    save_full_matrix(conm_reward, "output-files/rmatrix_v2.txt", True)
+    #Heatmaps and rewards are built per player position across all cores, straight into the binary file
+    if (args.shards is not None):
+        build_reward_shards(args.shards, dimension, 400, 50, base_map, walls, 1000, 0.3, True, workers, True)
+    else:
+        build_reward_matrix(args.output, dimension, 400, 50, base_map, walls, 1000, 0.3, True, workers, True) #Use 'python Matrix_storage.py rmatrix_v2.rqm rmatrix_v2.txt' for the text version
 
     #* Remove comments below to test ghost matrix traversal
 
@@ -301,3 +328,6 @@ if __name__ == "__main__": #Only execute building commands if this is the main f
 
     # #Finally, we show
     # traverse_ghost_matrix(shift_so, (18,9), state_so)
+
+if __name__ == "__main__": #Only execute building commands if this is the main file being executed
+    main()
@@ -0,0 +1,329 @@
+import struct
+import numpy as np
+from Matrix_storage import ACTION_COUNT, DATA_ALIGNMENT, DTYPE_CODES, DenseMatrix, build_lookups, canonical_pair, swap_actions
+
+#Used to monitor performance
+import time
+
+SPARSE_EXTENSION = ".rqs"
+SPARSE_MAGIC = b"RQSP"
+SPARSE_VERSION = 1
+# Header layout: magic, version, width, height, is_conmutative, dtype code, fill value, player count, pair count, value count, mask offset, values offset
+SPARSE_HEADER_FORMAT = "<4sHHHBBiIIQQQ"
+SPARSE_HEADER_SIZE = struct.calcsize(SPARSE_HEADER_FORMAT)
+ILLEGAL_REWARD = -1 #Value of illegal actions on r-matrixes
+
+# NOTE - Most joint actions are illegal (ghosts hitting walls, borders or each other), and illegal actions always hold the same value (-1 on r-matrixes, 0 on untrained q-matrixes)
+# Sparse matrixes store, for every (player, ghost pair) row, a 16-bit mask of legal actions plus the values of legal actions only, packed in action order into a single flat array. Row offsets into that array are the running count of mask bits
+
+_BIT_COUNTS = np.unpackbits(np.arange(1 << ACTION_COUNT, dtype="<u2").view(np.uint8).reshape(-1, 2), axis=1).sum(axis=1, dtype=np.int64) #Set bits of every mask
+_MASK_ACTIONS:dict[int,list[int]] = dict() #Legal action indexes of every mask, filled on demand
+_MASK_JOINT_ACTIONS:dict[int,list[tuple[int,int]]] = dict()
+
+#Legal action indexes (in order) of a mask
+def mask_actions(mask:int) -> list[int]:
+    actions = _MASK_ACTIONS.get(mask)
+    if (actions is None):
+        actions = [action for action in range(ACTION_COUNT) if (mask >> action) & 1]
+        _MASK_ACTIONS[mask] = actions
+    return actions
+
+#Legal action tuples (lower ghost's move, higher ghost's move) of a mask, sorted like MazeTopology.joint_actions
+def mask_joint_actions(mask:int) -> list[tuple[int,int]]:
+    actions = _MASK_JOINT_ACTIONS.get(mask)
+    if (actions is None):
+        actions = [(action // 4, action % 4) for action in mask_actions(mask)]
+        _MASK_JOINT_ACTIONS[mask] = actions
+    return actions
+
+#Pack dense rows (n, 16) given which entries are legal. Returns (masks, packed values)
+def pack_rows(rows:np.ndarray, legal:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    masks = (legal.astype(np.uint32) << np.arange(ACTION_COUNT, dtype=np.uint32)).sum(axis=1).astype(np.uint16)
+    return masks, rows[legal]
+
+#Start of every row in the packed values (one more entry than masks, the last one being the value count)
+def row_offsets(masks:np.ndarray) -> np.ndarray:
+    offsets = np.zeros(len(masks) + 1, dtype=np.int64)
+    np.cumsum(_BIT_COUNTS[np.asarray(masks)], out=offsets[1:])
+    return offsets
+
+#Table (ghost-positions -> action values) for a single player position of a sparse matrix. Mapping access expands rows into the usual 16 values, indexed access works on packed values
+class SparseTable:
+    def __init__(self, masks:np.ndarray, offsets:np.ndarray, values:np.ndarray, fill:int, ghost_pairs:list[tuple[int,int]], pair_lookup:np.ndarray, cell_count:int, is_conmutative:bool):
+        self._masks = masks
+        self._mask_list:list[int] = masks.tolist() #Scalar lookups on lists are much faster than on arrays
+        self._offsets = offsets
+        self._offset_list:list[int] = offsets.tolist()
+        self._values = values
+        self._fill = fill
+        self._ghost_pairs = ghost_pairs
+        self._pair_lookup = pair_lookup
+        self._cell_count = cell_count
+        self._is_conmutative = is_conmutative
+
+    @property
+    def masks(self) -> np.ndarray:
+        return self._masks
+    @property
+    def fill(self) -> int:
+        return self._fill
+    #Packed values of the whole table
+    @property
+    def packed(self) -> np.ndarray:
+        return self._values[self._offset_list[0]:self._offset_list[-1]]
+
+    #Number of legal actions of every row
+    def row_counts(self) -> np.ndarray:
+        return _BIT_COUNTS[self._masks]
+
+    #Transform ghost positions into row index (or -1 if the pair is not registered)
+    def pair_index(self, ghost_pos:tuple[int,int]) -> int:
+        if (ghost_pos[0] < 0) or (ghost_pos[1] < 0) or (ghost_pos[0] >= self._cell_count) or (ghost_pos[1] >= self._cell_count):
+            return -1
+        return int(self._pair_lookup[ghost_pos[0]*self._cell_count + ghost_pos[1]])
+
+    def legal_actions(self, index:int) -> list[int]:
+        return mask_actions(self._mask_list[index])
+    def joint_actions(self, index:int) -> list[tuple[int,int]]:
+        return mask_joint_actions(self._mask_list[index])
+    #Packed values of a row (legal actions only, in action order)
+    def row(self, index:int) -> np.ndarray:
+        return self._values[self._offset_list[index]:self._offset_list[index + 1]]
+    #Position of an action of a row in the packed values, or -1 if the action is illegal
+    def slot(self, index:int, action_index:int) -> int:
+        mask = self._mask_list[index]
+        if not ((mask >> action_index) & 1):
+            return -1
+        return self._offset_list[index] + int(_BIT_COUNTS[mask & ((1 << action_index) - 1)])
+    def value(self, index:int, action_index:int) -> int:
+        slot = self.slot(index, action_index)
+        return self._fill if (slot == -1) else self._values[slot].item()
+    def set_value(self, index:int, action_index:int, value:int) -> None:
+        slot = self.slot(index, action_index)
+        if (slot == -1):
+            raise ValueError(f"ERROR. Action {action_index} is not legal for ghost pair {self._ghost_pairs[index]}, it cannot be stored on a sparse matrix")
+        self._values[slot] = value
+
+    #Row with all 16 action values (illegal ones set to fill)
+    def expand_row(self, index:int) -> list[int]:
+        expanded = [self._fill]*ACTION_COUNT
+        for action, value in zip(self.legal_actions(index), self.row(index).tolist()):
+            expanded[action] = value
+        return expanded
+    #Whole table as a dense array (pairs, 16)
+    def expand(self) -> np.ndarray:
+        legal = ((self._masks[:, None].astype(np.uint32) >> np.arange(ACTION_COUNT, dtype=np.uint32)) & 1).astype(bool)
+        expanded = np.full((len(self._masks), ACTION_COUNT), self._fill, dtype=self._values.dtype)
+        expanded[legal] = self.packed
+        return expanded
+    #Max of every expanded row (same as max(row) over all 16 values)
+    def row_max(self) -> np.ndarray:
+        counts = self.row_counts()
+        start = self._offset_list[0]
+        packed = self.packed
+        row_max = np.full(len(self._masks), self._fill, dtype=np.int64)
+        filled = counts > 0
+        if (filled.any()):
+            row_max[filled] = np.maximum.reduceat(packed, self._offsets[:-1][filled] - start)
+        partial = filled & (counts < ACTION_COUNT) #Illegal actions take part in the max too
+        row_max[partial] = np.maximum(row_max[partial], self._fill)
+        return row_max
+
+    def keys(self) -> list[tuple[int,int]]:
+        return self._ghost_pairs
+    def values(self):
+        for index in range(len(self._ghost_pairs)):
+            yield self.expand_row(index)
+    def items(self):
+        for index, ghost_pos in enumerate(self._ghost_pairs):
+            yield ghost_pos, self.expand_row(index)
+
+    #Swapped pairs are read through the action-swap mapping on conmutative tables. Returned rows are copies
+    def __getitem__(self, ghost_pos:tuple[int,int]) -> list[int]:
+        index = self.pair_index(ghost_pos)
+        if (index != -1):
+            return self.expand_row(index)
+        if (self._is_conmutative):
+            pair, swapped = canonical_pair(ghost_pos)
+            index = self.pair_index(pair)
+            if (index != -1):
+                return swap_actions(self.expand_row(index)) if (swapped) else self.expand_row(index)
+        raise KeyError(ghost_pos)
+    def __contains__(self, ghost_pos:tuple[int,int]) -> bool:
+        return (self.pair_index(ghost_pos) != -1) or ((self._is_conmutative) and (self.pair_index(canonical_pair(ghost_pos)[0]) != -1))
+    def __iter__(self):
+        return iter(self._ghost_pairs)
+    def __len__(self) -> int:
+        return len(self._ghost_pairs)
+
+#Full matrix (player-position -> ghost-positions -> action values) stored sparsely. Same layout and mapping behavior as DenseMatrix
+class SparseMatrix:
+    def __init__(self, masks:np.ndarray, values:np.ndarray, player_positions:list[int], ghost_pairs:list[tuple[int,int]], dimension:tuple[int,int], is_conmutative:bool, fill:int = ILLEGAL_REWARD):
+        if (masks.shape != (len(player_positions), len(ghost_pairs))):
+            raise ValueError(f"ERROR. Sparse matrix masks should be shaped ({len(player_positions)}, {len(ghost_pairs)}) but are shaped {masks.shape}")
+        self._masks = masks
+        self._offsets = row_offsets(masks.reshape(-1))
+        if (len(values) != self._offsets[-1]):
+            raise ValueError(f"ERROR. Sparse matrix masks have {self._offsets[-1]} legal actions but there are {len(values)} values")
+        self._values = values
+        self._player_positions = list(player_positions)
+        self._ghost_pairs = list(ghost_pairs)
+        self._dimension = dimension
+        self._is_conmutative = is_conmutative
+        self._fill = fill
+        self._player_lookup, self._pair_lookup = build_lookups(self._player_positions, self._ghost_pairs, dimension)
+
+    #Build a sparse matrix out of a dense one (or any matrix with the same layout interface, such as a RewardProvider). Entries equal to fill are taken as illegal
+    @classmethod
+    def from_dense(cls, matrix:DenseMatrix, fill:int = ILLEGAL_REWARD) -> "SparseMatrix":
+        masks = np.zeros((len(matrix.player_positions), len(matrix.ghost_pairs)), dtype=np.uint16)
+        packed:list[np.ndarray] = []
+        for player_index, player_pos in enumerate(matrix.player_positions): #One player table at a time, so memory-mapped sources are never fully loaded
+            rows = np.asarray(matrix[player_pos].data)
+            masks[player_index], values = pack_rows(rows, rows != fill)
+            packed.append(values)
+        return cls(masks, np.concatenate(packed), matrix.player_positions, matrix.ghost_pairs, matrix.dimension, matrix.is_conmutative, fill)
+
+    #Zero-filled matrix with the same layout and legal actions as the given one (used to initialize q-matrixes from sparse r-matrixes). If masks are given, they replace the legal actions of the given matrix
+    @classmethod
+    def zeros_like(cls, other:"SparseMatrix", dtype = None, masks:np.ndarray = None) -> "SparseMatrix":
+        if (dtype is None):
+            dtype = other.dtype
+        masks = np.array(other.masks) if (masks is None) else np.asarray(masks, dtype=np.uint16)
+        return cls(masks, np.zeros(int(_BIT_COUNTS[masks].sum()), dtype=dtype), other.player_positions, other.ghost_pairs, other.dimension, other.is_conmutative, 0)
+
+    @property
+    def masks(self) -> np.ndarray:
+        return self._masks
+    #Packed values of legal actions, for every row in order
+    @property
+    def packed(self) -> np.ndarray:
+        return self._values
+    @property
+    def dtype(self) -> np.dtype:
+        return self._values.dtype
+    @property
+    def fill(self) -> int:
+        return self._fill
+    @property
+    def nbytes(self) -> int:
+        return self._masks.nbytes + self._values.nbytes + self._offsets.nbytes
+    @property
+    def player_positions(self) -> list[int]:
+        return self._player_positions
+    @property
+    def ghost_pairs(self) -> list[tuple[int,int]]:
+        return self._ghost_pairs
+    @property
+    def dimension(self) -> tuple[int,int]:
+        return self._dimension
+    @property
+    def is_conmutative(self) -> bool:
+        return self._is_conmutative
+
+    def player_index(self, player_pos:int) -> int:
+        if (player_pos < 0) or (player_pos >= len(self._player_lookup)):
+            return -1
+        return int(self._player_lookup[player_pos])
+    def pair_index(self, ghost_pos:tuple[int,int]) -> int:
+        cell_count = len(self._player_lookup)
+        if (ghost_pos[0] < 0) or (ghost_pos[1] < 0) or (ghost_pos[0] >= cell_count) or (ghost_pos[1] >= cell_count):
+            return -1
+        return int(self._pair_lookup[ghost_pos[0]*cell_count + ghost_pos[1]])
+
+    #Expand into a dense matrix
+    def to_dense(self) -> DenseMatrix:
+        data = np.stack([table.expand() for table in self.values()])
+        return DenseMatrix(data, self._player_positions, self._ghost_pairs, self._dimension, self._is_conmutative)
+
+    def keys(self) -> list[int]:
+        return self._player_positions
+    def values(self):
+        for player_pos in self._player_positions:
+            yield self[player_pos]
+    def items(self):
+        for player_pos in self._player_positions:
+            yield player_pos, self[player_pos]
+
+    def __getitem__(self, player_pos:int) -> SparseTable:
+        index = self.player_index(player_pos)
+        if (index == -1):
+            raise KeyError(player_pos)
+        pair_count = len(self._ghost_pairs)
+        return SparseTable(self._masks[index], self._offsets[index*pair_count:(index + 1)*pair_count + 1], self._values, self._fill, self._ghost_pairs, self._pair_lookup, len(self._player_lookup), self._is_conmutative)
+    def __contains__(self, player_pos:int) -> bool:
+        return self.player_index(player_pos) != -1
+    def __iter__(self):
+        return iter(self._player_positions)
+    def __len__(self) -> int:
+        return len(self._player_positions)
+
+#Save a sparse matrix into a binary file: header, player positions, ghost pairs, masks and packed values. If it already exists, overwrites it.
+def save_sparse_matrix(matrix:SparseMatrix, filename:str) -> None:
+    timestamp = time.time()
+    dtype_code:int = -1
+    for code, candidate in DTYPE_CODES.items():
+        if (candidate == np.dtype(matrix.dtype).newbyteorder("<")):
+            dtype_code = code
+    if (dtype_code == -1):
+        raise ValueError(f"ERROR. Unsupported matrix dtype {matrix.dtype}. Must be one of {[str(value) for value in DTYPE_CODES.values()]}")
+
+    def align(offset:int) -> int:
+        return offset + (-offset) % DATA_ALIGNMENT
+    mask_offset = align(SPARSE_HEADER_SIZE + 4*len(matrix.player_positions) + 8*len(matrix.ghost_pairs))
+    values_offset = align(mask_offset + 2*matrix.masks.size)
+    with open(filename, 'wb') as file:
+        file.write(struct.pack(SPARSE_HEADER_FORMAT, SPARSE_MAGIC, SPARSE_VERSION, matrix.dimension[0], matrix.dimension[1], int(matrix.is_conmutative), dtype_code, matrix.fill, len(matrix.player_positions), len(matrix.ghost_pairs), len(matrix.packed), mask_offset, values_offset))
+        file.write(np.asarray(matrix.player_positions, dtype="<i4").tobytes())
+        file.write(np.asarray(matrix.ghost_pairs, dtype="<i4").reshape(-1, 2).tobytes())
+        file.write(b"\0" * (mask_offset - file.tell()))
+        file.write(np.ascontiguousarray(matrix.masks, dtype="<u2").tobytes())
+        file.write(b"\0" * (values_offset - file.tell()))
+        file.write(np.ascontiguousarray(matrix.packed, dtype=np.dtype(matrix.dtype).newbyteorder("<")).tobytes())
+    print(f"Matrix saved successfully at {filename} (in {round(time.time() - timestamp, 4)}s)")
+
+#Open a sparse matrix file. If memory_map, packed values are memory-mapped instead of read (use mode 'r+' to write through, 'c' for copy-on-write)
+def load_sparse_matrix(filename:str, memory_map:bool = True, mode:str = "r") -> SparseMatrix:
+    with open(filename, 'rb') as file:
+        raw_header = file.read(SPARSE_HEADER_SIZE)
+        if (len(raw_header) != SPARSE_HEADER_SIZE):
+            raise ValueError(f"ERROR. File {filename} is too short to be a sparse matrix")
+        magic, version, width, height, is_conmutative, dtype_code, fill, player_count, pair_count, value_count, mask_offset, values_offset = struct.unpack(SPARSE_HEADER_FORMAT, raw_header)
+        if (magic != SPARSE_MAGIC):
+            raise ValueError(f"ERROR. File {filename} is not a sparse matrix (bad magic number)")
+        if (version != SPARSE_VERSION) or (dtype_code not in DTYPE_CODES):
+            raise ValueError(f"ERROR. File {filename} has an unsupported sparse matrix version or layout")
+        player_positions = np.frombuffer(file.read(4*player_count), dtype="<i4").tolist()
+        ghost_pairs = [tuple(pair) for pair in np.frombuffer(file.read(8*pair_count), dtype="<i4").reshape(-1, 2).tolist()]
+        file.seek(mask_offset)
+        masks = np.fromfile(file, dtype="<u2", count=player_count*pair_count).reshape(player_count, pair_count)
+        dtype = DTYPE_CODES[dtype_code]
+        if (memory_map):
+            values = np.memmap(filename, dtype=dtype, mode=mode, offset=values_offset, shape=(value_count,)) if (value_count > 0) else np.zeros(0, dtype=dtype)
+        else:
+            file.seek(values_offset)
+            values = np.fromfile(file, dtype=dtype, count=value_count)
+    return SparseMatrix(masks, values, player_positions, ghost_pairs, (width, height), bool(is_conmutative), fill)
+
+#Sparse matrix files are recognized by their extension
+def is_sparse_matrix_file(filename:str) -> bool:
+    return filename.endswith(SPARSE_EXTENSION)
+
+def main(argv:list[str] = None) -> None:
+    import sys
+    argv = sys.argv[1:] if (argv is None) else argv
+    from Matrix_storage import MATRIX_EXTENSION, is_binary_matrix_file, load_binary_matrix, save_binary_matrix
+    if (len(argv) != 2):
+        print(f"Usage: python Sparse_storage.py <input> <output>\n\tConverts binary r-matrixes into sparse ({SPARSE_EXTENSION}) matrixes and vice versa, according to the input extension")
+        sys.exit(1)
+    if (is_sparse_matrix_file(argv[0])):
+        matrix = load_sparse_matrix(argv[0])
+        save_binary_matrix(matrix.to_dense(), argv[1], matrix.dimension)
+    elif (is_binary_matrix_file(argv[0])):
+        save_sparse_matrix(SparseMatrix.from_dense(load_binary_matrix(argv[0])), argv[1])
+    else:
+        print(f"ERROR. Input must be a binary ({SPARSE_EXTENSION} or {MATRIX_EXTENSION}) matrix. Convert text matrixes with Matrix_storage.py first")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import random
+import numpy as np
+from Maze_topology import MazeTopology
+
+# NOTE - Episodes start with both ghosts on open squares, apart from each other and from the player. Every unordered pair of open squares is listed once, and the squares of each player position are kept as an index array into that list, so a draw is a single random index plus a coin flip for ghost order
+
+#Uniform sampler of ghost positions (episode start states) for every player position
+#Scalar draws use rng (a random.Random) or, if None, the global random module, so random.seed keeps training reproducible. Batched draws use NumPy generators
+class StateSampler:
+    def __init__(self, topology:MazeTopology, rng:random.Random = None):
+        self._rng = rng if (rng is not None) else random
+        open_cells = np.asarray(topology.open_cells, dtype=np.int64)
+        lower, higher = np.triu_indices(len(open_cells), k=1)
+        self._pairs:np.ndarray = np.stack([open_cells[lower], open_cells[higher]], axis=1) #(lower, higher), sorted
+        self._pair_list:list[tuple[int,int]] = [tuple(pair) for pair in self._pairs.tolist()]
+        self._valid:dict[int,np.ndarray] = dict() #Filled on demand
+        self._valid_counts:dict[int,int] = dict()
+
+    @property
+    def pairs(self) -> np.ndarray:
+        return self._pairs
+
+    #Indexes (into pairs) of the ghost pairs where an episode may start with the player standing on player_pos
+    def valid_pairs(self, player_pos:int) -> np.ndarray:
+        valid = self._valid.get(player_pos)
+        if (valid is None):
+            valid = np.flatnonzero((self._pairs[:,0] != player_pos) & (self._pairs[:,1] != player_pos)).astype(np.int32)
+            if (len(valid) == 0):
+                raise ValueError(f"ERROR. There are no valid ghost positions for player position {player_pos}")
+            self._valid[player_pos] = valid
+            self._valid_counts[player_pos] = len(valid)
+        return valid
+
+    #Draw ghost positions (in ghost order) uniformly among valid start states. Ghosts are swapped half of the time
+    def sample(self, player_pos:int) -> tuple[int,int]:
+        valid = self.valid_pairs(player_pos)
+        pair = self._pair_list[valid[self._rng.randrange(self._valid_counts[player_pos])]]
+        if (self._rng.random() < 0.5):
+            return (pair[1], pair[0])
+        return pair
+
+    #Draw count start states at once. Returns array shaped (count, 2) in ghost order. If canonical, pairs are kept as (lower, higher)
+    def sample_batch(self, player_pos:int, count:int, rng:np.random.Generator = None, canonical:bool = False) -> np.ndarray:
+        if (rng is None):
+            rng = np.random.default_rng()
+        valid = self.valid_pairs(player_pos)
+        pairs = self._pairs[valid[rng.integers(0, len(valid), count)]]
+        if (not canonical):
+            swapped = rng.random(count) < 0.5
+            pairs[swapped] = pairs[swapped][:, ::-1]
+        return pairs
+
+_sampler_cache:dict[MazeTopology,StateSampler] = dict()
+
+#Get shared sampler (drawing from the global random module) for the given topology, building it on first use
+def get_sampler(topology:MazeTopology) -> StateSampler:
+    sampler = _sampler_cache.get(topology)
+    if (sampler is None):
+        sampler = StateSampler(topology)
+        _sampler_cache[topology] = sampler
+    return sampler